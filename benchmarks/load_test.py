@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from typing import List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+from config.settings import Config
+from benchmarks.run import configure, latency_summary
+from benchmarks.stub_server import StubState, fake_text, start_stub_server
+from benchmarks.synthetic_library import generate_library
+from services.search_modes import SEARCH_MODES
+
+
+class _Connection:
+    """最小的HTTP/1.1 keep-alive客户端连接，服务端关闭连接时自动重连"""
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body: bytes = b"") -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n"
+                "Content-Type: application/json\r\n\r\n")
+        try:
+            self.writer.write(head.encode("latin-1") + body)
+            await self.writer.drain()
+            status = int((await self.reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            content = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        except (OSError, IndexError, ValueError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, content
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_load(url: str, queries: List[str], concurrency: int, top_k: int, batch_size: int) -> dict:
+    """以 concurrency 个keep-alive连接发送全部查询，batch_size 大于1时使用 /search/batch"""
+    address = urlsplit(url)
+    host, port = address.hostname, address.port or 80
+    if batch_size > 1:
+        requests = [("POST", "/search/batch", json.dumps({"queries": queries[i:i + batch_size], "top_k": top_k},
+                                                         ensure_ascii=False).encode("utf-8"))
+                    for i in range(0, len(queries), batch_size)]
+    else:
+        requests = [("GET", f"/search?q={quote(query)}&top_k={top_k}", b"") for query in queries]
+
+    latencies, statuses = [], Counter()
+    next_request = iter(requests)
+
+    async def worker():
+        connection = _Connection(host, port)
+        for method, path, body in next_request:
+            start = time.perf_counter()
+            try:
+                status, _ = await connection.request(method, path, body)
+            except (OSError, IndexError, ValueError, asyncio.IncompleteReadError):
+                status = "connection_error"
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] += 1
+        connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    return dict({"requests": len(requests), "queries": len(queries), "batch_size": batch_size,
+                 "concurrency": concurrency, "seconds": seconds, "requests_per_second": len(requests) / seconds,
+                 "queries_per_second": len(queries) / seconds, "statuses": dict(statuses)},
+                **latency_summary(latencies))
+
+
+def start_local_service(mode: str, workers: int, max_pending: int, timeout: float) -> Tuple[str, object]:
+    """在后台线程的事件循环中启动搜索服务并等待引擎预热完成，返回 (服务地址, 服务)"""
+    from services.serve import SearchService
+    from services.engine_registry import warm_up_image_search
+    service = SearchService(search_mode=mode, max_workers=workers, max_pending=max_pending, request_timeout=timeout)
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    server = asyncio.run_coroutine_threadsafe(service.start_server("127.0.0.1", 0), loop).result()
+    # 预热一次查询，导入openai与建立连接不计入结果
+    warm_up_image_search(search_mode=mode).result().search("预热", top_k=1)
+    return f"http://127.0.0.1:{server.sockets[0].getsockname()[1]}", service
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP搜索服务的压力测试，默认在合成库与本地桩服务器上于进程内启动服务")
+    parser.add_argument("--url", default=None, help="已启动的搜索服务地址，指定时不启动桩服务器与本地服务")
+    parser.add_argument("--size", type=int, default=1000, help="合成库的规模")
+    parser.add_argument("--mode", default="embedding", choices=list(SEARCH_MODES), help="搜索模式")
+    parser.add_argument("--requests", type=int, default=2000, help="查询总数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发连接数")
+    parser.add_argument("--batch-size", type=int, default=1, help="大于1时通过 /search/batch 批量发送")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=Config.SERVE_MAX_WORKERS, help="服务同时执行的搜索数")
+    parser.add_argument("--max-pending", type=int, default=Config.SERVE_MAX_PENDING, help="服务的排队上限")
+    parser.add_argument("--timeout", type=float, default=Config.SERVE_REQUEST_TIMEOUT, help="服务的请求超时（秒）")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding维度")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务器每个请求的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="桩服务器额外的随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务器注入错误的概率")
+    parser.add_argument("--workdir", default=None, help="合成库的存放目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--output", default=None, help="结果JSON文件，默认只打印")
+    args = parser.parse_args()
+
+    # 查询各不相同，不会命中查询缓存
+    queries = [fake_text(f"load-{i}", words=3)[6:-1] for i in range(args.requests)]
+    server = workdir = None
+    try:
+        if args.url is None:
+            model = "stub-embedding"
+            server, base_url = start_stub_server(state=StubState(args.latency, args.jitter, args.error_rate, args.dim))
+            workdir = args.workdir or tempfile.mkdtemp(prefix="chatmeme-load-")
+            paths = generate_library(os.path.join(workdir, f"library-{args.size}"), args.size, args.dim, model)
+            configure(paths, base_url, model, "exact")
+            url, _ = start_local_service(args.mode, args.workers, args.max_pending, args.timeout)
+        else:
+            url = args.url
+        stub_before = server.state.requests if server else 0
+        result = asyncio.run(run_load(url, queries, args.concurrency, args.top_k, args.batch_size))
+        result.update({"benchmark": "serve_load", "mode": args.mode, "size": args.size, "url": url})
+        if server is not None:
+            result["stub_requests"] = server.state.requests - stub_before
+    finally:
+        if server is not None:
+            server.shutdown()
+        if workdir is not None and args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
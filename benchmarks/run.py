@@ -0,0 +1,245 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from config.settings import Config
+from benchmarks.stub_server import StubState, fake_text, image_urls, start_stub_server
+from benchmarks.synthetic_library import generate_library
+from services.image_description_database import ImageDescriptionDatabase
+from services.image_search import ImageSearch, SEARCH_MODES
+from services.web_image_cache import WebImageCache
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def configure(paths: Dict[str, str], base_url: str, model: str, vector_index: str) -> None:
+    """将配置指向合成库与桩服务器"""
+    Config.LOCAL_IMAGE_FOLDER = paths["local_image_folder"]
+    Config.WEB_URL_FILE = paths["web_url_file"]
+    Config.DATABASE_FILE = paths["database_file"]
+    Config.INDEX_FILE = paths["index_file"]
+    Config.EMBEDDING_DATABASE_DIR = paths["embedding_database_dir"]
+    Config.LEXICAL_INDEX_DIR = paths["lexical_index_dir"]
+    # 预处理后的图片、网络图片与缩略图缓存也放在合成库中，不写入仓库的 data/cache
+    Config.IMAGE_PAYLOAD_CACHE_DIR = os.path.join(paths["cache_dir"], "image_payloads")
+    Config.WEB_IMAGE_CACHE_DIR = os.path.join(paths["cache_dir"], "web_images")
+    Config.THUMBNAIL_DIR = os.path.join(paths["cache_dir"], "thumbnails")
+    Config.BUILD_SHARDS_DIR = os.path.join(paths["cache_dir"], "shards")
+    Config.IMAGE_DESCRIBE_API_KEY = Config.SEARCH_API_KEY = Config.EMBEDDING_API_KEY = "stub"
+    Config.IMAGE_DESCRIBE_BASE_URL = Config.SEARCH_BASE_URL = Config.EMBEDDING_BASE_URL = base_url
+    Config.IMAGE_DESCRIBE_REQUEST_DELAY = 0
+    Config.EMBEDDING_MODEL = model
+    Config.VECTOR_INDEX = vector_index
+    # 查询各不相同，且不使用磁盘缓存，避免不同轮次之间互相影响
+    Config.QUERY_CACHE_FILE = ""
+    Config.USE_QUERY_UNDERSTANDING = False
+
+
+def open_database(paths: Dict[str, str]) -> ImageDescriptionDatabase:
+    return ImageDescriptionDatabase(
+        local_image_folder=paths["local_image_folder"],
+        web_url_file=paths["web_url_file"],
+        database_file=paths["database_file"],
+        index_file=paths["index_file"],
+        image_describe_api_key=Config.IMAGE_DESCRIBE_API_KEY,
+        image_describe_base_url=Config.IMAGE_DESCRIBE_BASE_URL,
+        image_describe_model=Config.IMAGE_DESCRIBE_MODEL,
+        image_describe_request_delay=0,
+    )
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """延迟分位数（毫秒）"""
+    ms = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+# 冷启动导入的模块：页面首屏只需要前者，搜索引擎在后台预热时才导入后者
+IMPORT_TARGETS = {
+    "pages": "config.settings, services.engine_registry, services.search_modes, services.metrics",
+    "search_engine": "services.image_search",
+}
+
+
+def bench_import(repeats: int = 3) -> dict:
+    """冷启动：在新进程中导入页面所需模块与搜索模块的时间"""
+    result = {"benchmark": "cold_start_import", "repeats": repeats}
+    for name, modules in IMPORT_TARGETS.items():
+        code = f"import time; t = time.perf_counter(); import {modules}; print(time.perf_counter() - t)"
+        timings = []
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True,
+                                    check=True).stdout
+            timings.append(float(output.strip().splitlines()[-1]))
+        result[f"{name}_seconds"] = float(np.median(timings))
+    return result
+
+
+def bench_build(paths: Dict[str, str], size: int) -> dict:
+    """从只有图片的库开始构建描述数据库（经由桩服务器描述每张图片）"""
+    database = open_database(paths)
+    start = time.perf_counter()
+    database.construct_image_description_database()
+    seconds = time.perf_counter() - start
+    return {"benchmark": "build_description_database", "size": size, "seconds": seconds,
+            "images_per_second": size / seconds, "described": len(database.index_list)}
+
+
+def bench_embeddings(paths: Dict[str, str], size: int) -> dict:
+    """_load_or_create_embeddings：首次生成全部embedding，以及存储已存在时的加载"""
+    database = open_database(paths)
+    database.construct_image_description_database()
+
+    start = time.perf_counter()
+    ImageSearch(search_mode="embedding", image_description_database=database)
+    create_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ImageSearch(search_mode="embedding", image_description_database=database)
+    load_seconds = time.perf_counter() - start
+    return {"benchmark": "load_or_create_embeddings", "size": size,
+            "create_seconds": create_seconds, "load_seconds": load_seconds}
+
+
+def bench_queries(paths: Dict[str, str], size: int, mode: str, num_queries: int, concurrency: int) -> dict:
+    """单个搜索模式的引擎启动时间、查询延迟与吞吐"""
+    start = time.perf_counter()
+    database = open_database(paths)
+    database.construct_image_description_database()
+    engine = ImageSearch(search_mode=mode, image_description_database=database)
+    startup_seconds = time.perf_counter() - start
+
+    # 查询按规模与模式区分，避免命中之前轮次留下的查询缓存
+    queries = [fake_text(f"{size}-{mode}-{i}", words=3)[6:-1] for i in range(num_queries)]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        engine.search(query, top_k=5)
+        latencies.append(time.perf_counter() - start)
+
+    concurrent_queries = [fake_text(f"{size}-{mode}-concurrent-{i}", words=3)[6:-1] for i in range(num_queries)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda q: engine.search(q, top_k=5), concurrent_queries))
+    concurrent_seconds = time.perf_counter() - start
+
+    return dict({"benchmark": "query", "size": size, "mode": mode, "startup_seconds": startup_seconds,
+                 "queries": num_queries, "sequential_qps": num_queries / sum(latencies),
+                 "concurrency": concurrency, "concurrent_qps": num_queries / concurrent_seconds},
+                **latency_summary(latencies))
+
+
+def bench_web_images(server, base_url: str, workdir: str, count: int, max_workers: int) -> dict:
+    """网络图片缓存：首次并发下载、缓存命中、过期后重新校验（304）与源站内容变化后重新下载"""
+    urls = image_urls(base_url, count)
+    cache = WebImageCache(os.path.join(workdir, "web_images"), max_workers=max_workers, max_age=3600)
+    result = {"benchmark": "web_image_cache", "images": count, "max_workers": max_workers}
+    for phase in ("download", "hit", "revalidate", "changed"):
+        if phase == "revalidate":
+            cache.max_age = 0
+        elif phase == "changed":
+            server.state.image_revision += 1
+        requests_before, not_modified_before = server.state.image_requests, server.state.not_modified
+        start = time.perf_counter()
+        paths = cache.fetch_many(urls)
+        result[f"{phase}_seconds"] = time.perf_counter() - start
+        result[f"{phase}_origin_requests"] = server.state.image_requests - requests_before
+        result[f"{phase}_not_modified"] = server.state.not_modified - not_modified_before
+        result[f"{phase}_failed"] = sum(path is None for path in paths.values())
+    return result
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def parse_sizes(value: str) -> List[int]:
+    return [int(size) for size in value.split(",") if size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatMeme离线性能基准，所有远程调用都由本地桩服务器代替")
+    parser.add_argument("--sizes", type=parse_sizes, default=[1000, 10000, 100000], help="查询基准的库规模，逗号分隔")
+    parser.add_argument("--build-sizes", type=parse_sizes, default=[1000], help="构建与embedding基准的库规模，逗号分隔")
+    parser.add_argument("--modes", default=",".join(SEARCH_MODES), help="参与查询基准的搜索模式，逗号分隔")
+    parser.add_argument("--queries", type=int, default=50, help="每个模式的查询次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="吞吐测试的并发查询数")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding维度")
+    parser.add_argument("--vector-index", default="exact", help="向量索引类型")
+    parser.add_argument("--latency", type=float, default=0.0, help="桩服务器每个请求的延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="桩服务器额外的随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务器注入错误的概率")
+    parser.add_argument("--web-images", type=int, default=200, help="网络图片缓存基准的图片数，0表示跳过")
+    parser.add_argument("--workdir", default=None, help="合成库的存放目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--output", default="bench_results.json", help="结果JSON文件")
+    args = parser.parse_args()
+
+    model = "stub-embedding"
+    modes = [mode for mode in args.modes.split(",") if mode]
+    server, base_url = start_stub_server(state=StubState(args.latency, args.jitter, args.error_rate, args.dim))
+    workdir = args.workdir or tempfile.mkdtemp(prefix="chatmeme-bench-")
+    results = [bench_import()]
+    try:
+        if args.web_images:
+            results.append(bench_web_images(server, base_url, workdir, args.web_images, Config.WEB_IMAGE_MAX_WORKERS))
+
+        for size in args.build_sizes:
+            paths = generate_library(os.path.join(workdir, f"build-{size}"), size, args.dim, model,
+                                     with_descriptions=False, with_embeddings=False)
+            configure(paths, base_url, model, args.vector_index)
+            results.append(bench_build(paths, size))
+
+            paths = generate_library(os.path.join(workdir, f"embed-{size}"), size, args.dim, model,
+                                     with_embeddings=False)
+            configure(paths, base_url, model, args.vector_index)
+            results.append(bench_embeddings(paths, size))
+
+        for size in args.sizes:
+            paths = generate_library(os.path.join(workdir, f"query-{size}"), size, args.dim, model)
+            configure(paths, base_url, model, args.vector_index)
+            for mode in modes:
+                results.append(bench_queries(paths, size, mode, args.queries, args.concurrency))
+    finally:
+        server.shutdown()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "stub_requests": server.state.requests,
+            "stub_errors": server.state.errors,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"基准结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+import re
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+import numpy as np
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+from services.lexical_index import tokenize
+
+# 生成假描述与假查询用的词表
+VOCABULARY = [
+    "开心", "无语", "震惊", "尴尬", "自信", "生气", "委屈", "点赞", "吃瓜", "摸鱼",
+    "加班", "下班", "熬夜", "躺平", "内卷", "破防", "真香", "离谱", "绝绝子", "芭比Q",
+    "猫猫", "狗狗", "熊猫头", "蘑菇头", "小黄脸", "老板", "同事", "打工人", "学生", "考试",
+    "表示赞同", "表示拒绝", "疑惑地看着", "大声喊出", "默默流泪", "疯狂点头", "冷笑一声", "翻了个白眼",
+]
+
+
+def fake_text(seed_text: str, words: int = 12) -> str:
+    """根据种子文本确定性地生成一段假描述"""
+    rng = random.Random(hashlib.blake2b(seed_text.encode("utf-8"), digest_size=8).digest())
+    return "这张表情包里" + "，".join(rng.choice(VOCABULARY) for _ in range(words)) + "。"
+
+
+def fake_embedding(text: str, dim: int) -> np.ndarray:
+    """确定性的假embedding：字符n-gram特征哈希到dim维后归一化，文本越相近向量越相近"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in tokenize(text) or [text]:
+        h = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def tiny_png(seed: int, size: int = 8) -> bytes:
+    """生成内容随种子变化的小尺寸PNG，保证每张图片的内容哈希不同"""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+    raw = b"".join(b"\x00" + pixels[y].tobytes() for y in range(size))
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def _message_text(content) -> Tuple[str, bool]:
+    """取出消息中的文本，并判断是否包含图片"""
+    if isinstance(content, str):
+        return content, False
+    texts, has_image = [], False
+    for part in content or []:
+        if part.get("type") == "text":
+            texts.append(part.get("text", ""))
+        elif part.get("type") == "image_url":
+            has_image = True
+            texts.append(part.get("image_url", {}).get("url", "")[-256:])
+    return "\n".join(texts), has_image
+
+
+def fake_chat_answer(messages: List[dict]) -> str:
+    """确定性地回答三类请求：图片描述、查询理解与表情包排序"""
+    text, has_image = _message_text(messages[-1].get("content"))
+    if has_image:
+        return fake_text(text)
+
+    match = re.search(r"问题: (.*?)\n数据库: (.*)\n请返回(\d+)个", text, re.S)
+    if match is None:
+        return f"用户想找表达“{text}”的表情包。"
+
+    query, database, top_k = match.group(1), match.group(2), int(match.group(3))
+    query_tokens = set(tokenize(query))
+    candidates = []
+    for line in database.splitlines():
+        number, _, description = line.partition(". ")
+        if number.strip().isdigit():
+            overlap = len(query_tokens & set(tokenize(description)))
+            candidates.append((-overlap, int(number), description))
+    candidates.sort()
+    return "\n".join(f"{rank}-{number}-与查询有{-score}处重合" for rank, (score, number, _)
+                     in enumerate(candidates[:top_k], start=1))
+
+
+class StubState:
+    """桩服务器的配置与统计"""
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 dim: int = 1024, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.dim = dim
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        # 网络图片：修改 image_revision 模拟源站更新了全部图片
+        self.image_revision = 0
+        self.image_requests = 0
+        self.not_modified = 0
+
+    def next_request(self) -> Tuple[float, bool]:
+        """返回本次请求的延迟与是否注入错误，随机序列由种子决定"""
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return delay, failed
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """兼容OpenAI接口的 /embeddings 与 /chat/completions，以及供网络图片下载使用的 /images"""
+    server_version = "ChatMemeStub/1.0"
+    protocol_version = "HTTP/1.1"
+    # 响应头与响应体分两次写出，关闭Nagle算法避免延迟确认带来的额外40ms
+    disable_nagle_algorithm = True
+
+    @property
+    def state(self) -> StubState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """/images/<种子>.png：确定性的PNG图片，支持 ETag / Last-Modified 条件请求"""
+        match = re.fullmatch(r"/images/(\d+)\.png", self.path.split("?")[0])
+        if match is None:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+        delay, failed = self.state.next_request()
+        with self.state.lock:
+            self.state.image_requests += 1
+            revision = self.state.image_revision
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        etag = f'"{match.group(1)}-{revision}"'
+        last_modified = formatdate(1700000000 + revision * 3600, usegmt=True)
+        if self.headers.get("If-None-Match") == etag or (
+                "If-None-Match" not in self.headers and self.headers.get("If-Modified-Since") == last_modified):
+            with self.state.lock:
+                self.state.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = tiny_png(int(match.group(1)) * 1000 + revision)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        delay, failed = self.state.next_request()
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            self._send_json(500, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completions(request)
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+
+    def _embeddings(self, request: dict) -> None:
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = []
+        for i, text in enumerate(inputs):
+            vector = fake_embedding(text, self.state.dim)
+            if request.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = sum(len(text) for text in inputs)
+        self._send_json(200, {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def _chat_completions(self, request: dict) -> None:
+        answer = fake_chat_answer(request.get("messages", []))
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub")}
+        if not request.get("stream"):
+            self._send_json(200, dict(base, object="chat.completion", choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }], usage={"prompt_tokens": 0, "completion_tokens": len(answer), "total_tokens": len(answer)}))
+            return
+
+        # 流式输出：逐行发送，模拟模型逐步生成
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        chunks = [line + "\n" for line in answer.split("\n")]
+        for i, chunk in enumerate(chunks):
+            payload = dict(base, object="chat.completion.chunk", choices=[{
+                "index": 0,
+                "delta": {"content": chunk},
+                "finish_reason": "stop" if i == len(chunks) - 1 else None,
+            }])
+            self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def image_urls(base_url: str, count: int) -> List[str]:
+    """桩服务器上 count 张网络图片的URL，base_url 为 start_stub_server 返回的地址"""
+    root = base_url[:-len("/v1")] if base_url.endswith("/v1") else base_url
+    return [f"{root}/images/{i}.png" for i in range(count)]
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, state: Optional[StubState] = None):
+    """在后台线程中启动桩服务器，返回 (server, base_url)；port为0时自动选择空闲端口"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = state or StubState()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="兼容OpenAI接口的本地桩服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的固定延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="额外的随机延迟上限（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入500错误的概率")
+    parser.add_argument("--dim", type=int, default=1024, help="embedding维度")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    state = StubState(args.latency, args.jitter, args.error_rate, args.dim, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    server.state = state
+    print(f"桩服务器已启动: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import argparse
+import numpy as np
+from typing import Dict
+from benchmarks.stub_server import fake_embedding, fake_text, tiny_png
+from services.embedding_cache import EmbeddingCache
+
+
+def library_paths(root: str) -> Dict[str, str]:
+    """合成库的目录结构，与 data/ 下的真实库一致"""
+    return {
+        "root": root,
+        "local_image_folder": os.path.join(root, "images"),
+        "web_url_file": os.path.join(root, "web_urls.txt"),
+        "database_file": os.path.join(root, "database", "text_description", "database.txt"),
+        "index_file": os.path.join(root, "database", "text_description", "index.txt"),
+        "embedding_database_dir": os.path.join(root, "database", "embedding"),
+        "lexical_index_dir": os.path.join(root, "database", "lexical"),
+        "cache_dir": os.path.join(root, "cache"),
+    }
+
+
+def generate_library(root: str, num_images: int, dim: int = 1024, model: str = "stub-embedding",
+                     with_descriptions: bool = True, with_embeddings: bool = True) -> Dict[str, str]:
+    """生成含 num_images 张图片的合成表情包库，可选地预先写入描述与embedding
+
+    图片文件名即配文；描述与embedding和桩服务器的输出一致，因此预生成的库与
+    通过桩服务器构建出来的库完全相同。
+    """
+    paths = library_paths(root)
+    os.makedirs(paths["local_image_folder"], exist_ok=True)
+    os.makedirs(os.path.dirname(paths["database_file"]), exist_ok=True)
+    open(paths["web_url_file"], "w").close()
+
+    image_ids = []
+    for i in range(num_images):
+        image_id = f"{i:07d}_{fake_text(str(i), words=2)[6:-1].replace('，', '')}.png"
+        with open(os.path.join(paths["local_image_folder"], image_id), "wb") as f:
+            f.write(tiny_png(i))
+        image_ids.append(image_id)
+
+    if with_descriptions:
+        descriptions = [fake_text(image_id) for image_id in image_ids]
+        with open(paths["index_file"], "w", encoding="utf-8") as f:
+            f.write("\n".join(image_ids) + "\n")
+        with open(paths["database_file"], "w", encoding="utf-8") as f:
+            f.write("\n".join(descriptions) + "\n")
+
+        if with_embeddings:
+            cache = EmbeddingCache(os.path.join(paths["embedding_database_dir"], model.replace("/", "_")), model)
+            missing = cache.update(image_ids, descriptions)
+            if missing:
+                cache.add(list(missing), np.stack([fake_embedding(d, dim) for d in missing.values()]))
+            cache.save()
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成表情包库")
+    parser.add_argument("root", help="输出目录")
+    parser.add_argument("--num-images", type=int, default=1000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--model", default="stub-embedding")
+    parser.add_argument("--no-descriptions", action="store_true", help="只生成图片，不预先写入描述")
+    parser.add_argument("--no-embeddings", action="store_true", help="不预先写入embedding")
+    args = parser.parse_args()
+    paths = generate_library(args.root, args.num_images, args.dim, args.model,
+                             with_descriptions=not args.no_descriptions,
+                             with_embeddings=not args.no_embeddings)
+    print(f"已生成 {args.num_images} 张图片的合成库: {paths['root']}")
+
+
+if __name__ == "__main__":
+    main()
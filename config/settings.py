@@ -2,21 +2,33 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 
-# 打印当前工作目录和.env文件位置
-print(f"Current working directory: {os.getcwd()}")
 env_path = Path('.env')
-print(f".env file exists: {env_path.exists()}")
-print(f".env file path: {env_path.absolute()}")
 
 # 显式指定.env文件路径，并强制覆盖已存在的环境变量
 load_dotenv(dotenv_path=env_path, override=True)
 
+# 只在 CONFIG_DEBUG=true 时打印配置解析过程，导入配置本身没有输出
+CONFIG_DEBUG = os.getenv("CONFIG_DEBUG", "false").lower() == "true"
+
+
+def _debug(message: str) -> None:
+    if CONFIG_DEBUG:
+        print(message)
+
+
+# 打印当前工作目录和.env文件位置
+_debug(f"Current working directory: {os.getcwd()}")
+_debug(f".env file exists: {env_path.exists()}")
+_debug(f".env file path: {env_path.absolute()}")
+
 class Config:
     # SILICON_API_KEY = os.getenv("SILICON_API_KEY")
     IMAGE_DESCRIBE_API_KEY = os.getenv("IMAGE_DESCRIBE_API_KEY", None)
     IMAGE_DESCRIBE_BASE_URL = os.getenv("IMAGE_DESCRIBE_BASE_URL", "https://api.siliconapi.com/v1")
     IMAGE_DESCRIBE_MODEL = os.getenv("IMAGE_DESCRIBE_MODEL", "deepseek-ai/deepseek-vl2")
     IMAGE_DESCRIBE_REQUEST_DELAY = os.getenv("IMAGE_DESCRIBE_REQUEST_DELAY", 0.1)
+    IMAGE_DESCRIBE_MAX_WORKERS = int(os.getenv("IMAGE_DESCRIBE_MAX_WORKERS", 4))
+    IMAGE_DESCRIBE_BURST = float(os.getenv("IMAGE_DESCRIBE_BURST", 1))
     
     SEARCH_API_KEY = os.getenv("SEARCH_API_KEY", None)
     SEARCH_MODEL = os.getenv("SEARCH_MODEL", "gemini-2.0-flash")
@@ -24,7 +36,7 @@ class Config:
     
     # 基础路径
     BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # 项目根目录
-    print(f"\nBASE_DIR: {BASE_DIR}")
+    _debug(f"\nBASE_DIR: {BASE_DIR}")
     
     # 从环境变量获取相对路径，如果没有设置则使用默认值
     _LOCAL_IMAGE_FOLDER = os.getenv("LOCAL_IMAGE_FOLDER", "data/images")
@@ -32,11 +44,11 @@ class Config:
     _DATABASE_FILE = os.getenv("DATABASE_FILE", "data/database/text_description/database.txt")
     _INDEX_FILE = os.getenv("INDEX_FILE", "data/database/text_description/index.txt")
     
-    print("\n环境变量读取结果:")
-    print(f"  _LOCAL_IMAGE_FOLDER: {_LOCAL_IMAGE_FOLDER}")
-    print(f"  _WEB_URL_FILE: {_WEB_URL_FILE}")
-    print(f"  _DATABASE_FILE: {_DATABASE_FILE}")
-    print(f"  _INDEX_FILE: {_INDEX_FILE}")
+    _debug("\n环境变量读取结果:")
+    _debug(f"  _LOCAL_IMAGE_FOLDER: {_LOCAL_IMAGE_FOLDER}")
+    _debug(f"  _WEB_URL_FILE: {_WEB_URL_FILE}")
+    _debug(f"  _DATABASE_FILE: {_DATABASE_FILE}")
+    _debug(f"  _INDEX_FILE: {_INDEX_FILE}")
     
     # 将相对路径转换为绝对路径
     LOCAL_IMAGE_FOLDER = os.path.join(BASE_DIR, _LOCAL_IMAGE_FOLDER)
@@ -44,21 +56,109 @@ class Config:
     DATABASE_FILE = os.path.join(BASE_DIR, _DATABASE_FILE)
     INDEX_FILE = os.path.join(BASE_DIR, _INDEX_FILE)
     
+    # 本地表情包库收录的图片扩展名（逗号分隔，不区分大小写）；新增扩展名会让这些图片在下次加载时请求视觉模型描述
+    IMAGE_EXTENSIONS = tuple(ext.strip().lower() for ext in os.getenv("IMAGE_EXTENSIONS", ".jpg,.png").split(",") if ext.strip())
+    
     # 打印路径信息用于调试
-    print("\n最终路径配置:")
-    print(f"  LOCAL_IMAGE_FOLDER: {LOCAL_IMAGE_FOLDER}")
-    print(f"  WEB_URL_FILE: {WEB_URL_FILE}")
-    print(f"  DATABASE_FILE: {DATABASE_FILE}")
-    print(f"  INDEX_FILE: {INDEX_FILE}")
+    _debug("\n最终路径配置:")
+    _debug(f"  LOCAL_IMAGE_FOLDER: {LOCAL_IMAGE_FOLDER}")
+    _debug(f"  WEB_URL_FILE: {WEB_URL_FILE}")
+    _debug(f"  DATABASE_FILE: {DATABASE_FILE}")
+    _debug(f"  INDEX_FILE: {INDEX_FILE}")
+    
+    # 发送给视觉模型前的图片预处理：缩放到最长边不超过 IMAGE_PAYLOAD_MAX_EDGE 并以 IMAGE_PAYLOAD_FORMAT
+    # （jpeg / webp / png）重新编码，结果按内容哈希缓存；IMAGE_DESCRIBE_DETAIL 为请求中的 detail（low / high / auto）
+    IMAGE_PAYLOAD_MAX_EDGE = int(os.getenv("IMAGE_PAYLOAD_MAX_EDGE", 1024))
+    IMAGE_PAYLOAD_FORMAT = os.getenv("IMAGE_PAYLOAD_FORMAT", "webp").lower()
+    IMAGE_PAYLOAD_QUALITY = int(os.getenv("IMAGE_PAYLOAD_QUALITY", 80))
+    IMAGE_PAYLOAD_CACHE_DIR = os.path.join(BASE_DIR, os.getenv("IMAGE_PAYLOAD_CACHE_DIR", "data/cache/image_payloads"))
+    IMAGE_DESCRIBE_DETAIL = os.getenv("IMAGE_DESCRIBE_DETAIL", "auto")
+    
+    # 描述日志：每追加多少条记录fsync一次、积累多少条记录后压缩为快照
+    DESCRIPTION_JOURNAL_FSYNC_EVERY = int(os.getenv("DESCRIPTION_JOURNAL_FSYNC_EVERY", 32))
+    DESCRIPTION_JOURNAL_COMPACT_EVERY = int(os.getenv("DESCRIPTION_JOURNAL_COMPACT_EVERY", 1000))
+    # 分片构建：各分片的描述与embedding输出到该目录下的 shard-i-of-N，合并后写入正式数据库
+    BUILD_SHARDS_DIR = os.path.join(BASE_DIR, os.getenv("BUILD_SHARDS_DIR", "data/shards"))
+    
+    # 近似重复去重：感知哈希（pHash）的汉明距离不超过 DEDUP_MAX_DISTANCE 的图片直接沿用代表图片的描述与embedding；
+    # COLLAPSE_DUPLICATES 为true时搜索只在代表图片中进行，结果中不会出现同一张图的多个版本
+    DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() == "true"
+    DEDUP_MAX_DISTANCE = int(os.getenv("DEDUP_MAX_DISTANCE", 16))
+    COLLAPSE_DUPLICATES = os.getenv("COLLAPSE_DUPLICATES", "true").lower() == "true"
     
     # Embedding相关配置
     EMBEDDING_API_KEY = os.getenv("EMBEDDING_API_KEY", None)
     EMBEDDING_BASE_URL = os.getenv("EMBEDDING_BASE_URL", "https://api.siliconapi.com/v1")
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "BAAI/bge-m3")
     EMBEDDING_DATABASE_DIR = os.path.join(BASE_DIR, "data/database/embedding")
+    EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 32))
+    EMBEDDING_BATCH_TOKENS = int(os.getenv("EMBEDDING_BATCH_TOKENS", 16000))
+    # embedding缓存以 (模型, 规范化描述) 寻址，不再被库引用超过该秒数的向量会被回收
+    EMBEDDING_GC_MAX_AGE = float(os.getenv("EMBEDDING_GC_MAX_AGE", 30 * 86400))
+    # 向量索引：exact（精确检索）或 ivf（倒排文件近似检索），向量数少于 IVF_MIN_VECTORS 时始终使用精确检索；
+    # IVF_NLIST 为0时按向量数自动选择列表数，IVF_NPROBE 为每次查询检索的列表数
+    VECTOR_INDEX = os.getenv("VECTOR_INDEX", "exact")
+    IVF_NLIST = int(os.getenv("IVF_NLIST", 0))
+    IVF_NPROBE = int(os.getenv("IVF_NPROBE", 8))
+    IVF_MIN_VECTORS = int(os.getenv("IVF_MIN_VECTORS", 20000))
     USE_EMBEDDING_SEARCH = os.getenv("USE_EMBEDDING_SEARCH", "false").lower() == "true"
+    # 搜索模式：llm / sharded_llm / embedding / hybrid / bm25 / fusion，未设置时由 USE_EMBEDDING_SEARCH 决定
+    SEARCH_MODE = os.getenv("SEARCH_MODE") or ("embedding" if USE_EMBEDDING_SEARCH else "llm")
+    # 混合搜索中交给LLM重排的候选数量（融合搜索中每一路召回的数量）
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 50))
+    # 混合搜索的召回方式：embedding / bm25 / fusion（BM25与embedding倒数排名融合）
+    HYBRID_RETRIEVER = os.getenv("HYBRID_RETRIEVER", "embedding")
+    # 本地BM25关键词索引的存储目录
+    LEXICAL_INDEX_DIR = os.path.join(BASE_DIR, "data/database/lexical")
+    # 分片LLM搜索：每个分片的token预算（按字符数估计）、固定分片数（0表示按预算自动划分）、
+    # 并发请求数与每个分片返回的候选数（不少于请求的结果数）
+    SHARD_TOKEN_BUDGET = int(os.getenv("SHARD_TOKEN_BUDGET", 30000))
+    SHARD_COUNT = int(os.getenv("SHARD_COUNT", 0))
+    SHARD_MAX_WORKERS = int(os.getenv("SHARD_MAX_WORKERS", 8))
+    SHARD_TOP_K = int(os.getenv("SHARD_TOP_K", 5))
     USE_QUERY_UNDERSTANDING = os.getenv("USE_QUERY_UNDERSTANDING", "false").lower() == "true"
     
+    # 查询缓存：缓存查询embedding与查询理解结果，QUERY_CACHE_FILE 为空时只使用内存缓存
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 4096))
+    QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", 7 * 24 * 3600))
+    QUERY_CACHE_DISK_MAX_ROWS = int(os.getenv("QUERY_CACHE_DISK_MAX_ROWS", 100000))
+    _QUERY_CACHE_FILE = os.getenv("QUERY_CACHE_FILE", "data/cache/query_cache.sqlite3")
+    QUERY_CACHE_FILE = os.path.join(BASE_DIR, _QUERY_CACHE_FILE) if _QUERY_CACHE_FILE else ""
+    
+    # 网络图片缓存：WEB_URL_FILE 中的图片下载到 WEB_IMAGE_CACHE_DIR，按内容哈希存储；
+    # 超过 WEB_IMAGE_MAX_AGE 秒的条目下次下载时通过 ETag / Last-Modified 重新校验
+    WEB_IMAGE_CACHE_DIR = os.path.join(BASE_DIR, os.getenv("WEB_IMAGE_CACHE_DIR", "data/cache/web_images"))
+    WEB_IMAGE_MAX_WORKERS = int(os.getenv("WEB_IMAGE_MAX_WORKERS", 8))
+    WEB_IMAGE_TIMEOUT = float(os.getenv("WEB_IMAGE_TIMEOUT", 10))
+    WEB_IMAGE_MAX_AGE = float(os.getenv("WEB_IMAGE_MAX_AGE", 86400))
+    WEB_IMAGE_MAX_BYTES = int(os.getenv("WEB_IMAGE_MAX_BYTES", 20 << 20))
+    
+    # 缩略图：按内容哈希缓存在 THUMBNAIL_DIR，为每张图片生成 THUMBNAIL_SIZES 中的各个尺寸（最长边像素），
+    # 格式为 webp 或 jpeg；THUMBNAIL_WORKERS 为生成缩略图的进程数，0表示在当前进程中生成
+    THUMBNAIL_DIR = os.path.join(BASE_DIR, os.getenv("THUMBNAIL_DIR", "data/cache/thumbnails"))
+    THUMBNAIL_SIZES = tuple(int(size) for size in os.getenv("THUMBNAIL_SIZES", "256,384").split(",") if size.strip())
+    THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "webp").lower()
+    THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", 75))
+    THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", min(4, os.cpu_count() or 1)))
+    
+    # 后台预热失败后，库没有变化时至少等待多少秒再重新构建
+    WARMUP_RETRY_BACKOFF = float(os.getenv("WARMUP_RETRY_BACKOFF", 30))
+    
+    # HTTP搜索服务（python -m services.serve）：监听地址、同时执行的搜索数、排队上限（超过时返回503）、
+    # 单个请求的超时（秒，超时返回504）、/search/batch 一次的查询数上限与 top_k 上限
+    SERVE_HOST = os.getenv("SERVE_HOST", "127.0.0.1")
+    SERVE_PORT = int(os.getenv("SERVE_PORT", 8600))
+    SERVE_MAX_WORKERS = int(os.getenv("SERVE_MAX_WORKERS", 16))
+    SERVE_MAX_PENDING = int(os.getenv("SERVE_MAX_PENDING", 64))
+    SERVE_REQUEST_TIMEOUT = float(os.getenv("SERVE_REQUEST_TIMEOUT", 30))
+    SERVE_MAX_BATCH = int(os.getenv("SERVE_MAX_BATCH", 32))
+    SERVE_MAX_TOP_K = int(os.getenv("SERVE_MAX_TOP_K", 50))
+    
+    # 指标：METRICS_ENABLED 控制是否记录各阶段耗时，METRICS_PORT 非0时在 METRICS_HOST 的该端口提供Prometheus格式的 /metrics
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+    
     # EMBEDDING_MODEL = "BAAI/bge-m3"
     # IMAGE_DIR = os.path.join(os.path.dirname(__file__), os.getenv("IMAGE_DIR"))
     # CACHE_FILE = os.path.join(os.path.dirname(__file__), '../data/embeddings.pkl') 
\ No newline at end of file
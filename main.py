@@ -1,8 +1,24 @@
+import time
 import streamlit as st
+from services.metrics import record_stage, start_metrics_server
+
+# 从脚本开始执行计时，首次运行的耗时即首屏时间
+render_start = time.perf_counter()
+
+# METRICS_PORT 非0时在后台提供Prometheus格式的 /metrics，重复调用只会启动一次
+start_metrics_server()
 
 pg = st.navigation([
     st.Page("pages/meme_search.py"),
     st.Page("pages/config.py"),
     st.Page("pages/meme_library.py")
 ])
-pg.run()
\ No newline at end of file
+try:
+    pg.run()
+finally:
+    render_seconds = time.perf_counter() - render_start
+    record_stage("page_render", render_start, render_seconds)
+    if "first_paint_ms" not in st.session_state:
+        # 每个会话的首屏时间：引擎在后台预热，不计入其中
+        st.session_state.first_paint_ms = render_seconds * 1000
+        record_stage("first_paint", render_start, render_seconds)
@@ -1,5 +1,6 @@
 import streamlit as st
 from config.settings import Config
+from services.search_modes import EMBEDDING_SEARCH_MODES, SEARCH_MODES
 
 # 页面配置
 st.set_page_config(
@@ -24,8 +25,9 @@ if 'SEARCH_MODEL' not in st.session_state:
     st.session_state.SEARCH_MODEL = Config.SEARCH_MODEL
 if 'SEARCH_BASE_URL' not in st.session_state:
     st.session_state.SEARCH_BASE_URL = Config.SEARCH_BASE_URL
-if 'USE_EMBEDDING_SEARCH' not in st.session_state:
-    st.session_state.USE_EMBEDDING_SEARCH = Config.USE_EMBEDDING_SEARCH
+if 'SEARCH_MODE' not in st.session_state:
+    # 环境变量中的搜索模式无效时回退到LLM搜索
+    st.session_state.SEARCH_MODE = Config.SEARCH_MODE if Config.SEARCH_MODE in SEARCH_MODES else "llm"
 if 'USE_QUERY_UNDERSTANDING' not in st.session_state:
     st.session_state.USE_QUERY_UNDERSTANDING = Config.USE_QUERY_UNDERSTANDING
 if 'EMBEDDING_API_KEY' not in st.session_state:
@@ -95,16 +97,18 @@ with col1:
 with col2:
     # 搜索模式选择
     st.subheader("🎯 搜索模式")
-    st.checkbox(
-        "使用Embedding搜索",
-        value=st.session_state.USE_EMBEDDING_SEARCH,
-        key="use_embedding_search_input",
-        help="启用后将使用基于Embedding的语义搜索",
-        on_change=lambda: setattr(st.session_state, 'USE_EMBEDDING_SEARCH', st.session_state.use_embedding_search_input)
+    st.selectbox(
+        "搜索模式",
+        options=list(SEARCH_MODES),
+        index=list(SEARCH_MODES).index(st.session_state.SEARCH_MODE),
+        format_func=lambda mode: SEARCH_MODES[mode],
+        key="search_mode_input",
+        help="LLM搜索将整个库交给LLM；Embedding搜索使用语义向量检索；混合搜索先用Embedding召回候选，再由LLM重排并给出推荐原因",
+        on_change=lambda: setattr(st.session_state, 'SEARCH_MODE', st.session_state.search_mode_input)
     )
     
-    # 只有在启用Embedding搜索时才显示相关配置
-    if st.session_state.USE_EMBEDDING_SEARCH:
+    # 只有在使用Embedding的搜索模式下才显示相关配置
+    if st.session_state.SEARCH_MODE in EMBEDDING_SEARCH_MODES:
         st.subheader("🧬 Embedding配置")
         st.text_input(
             "Embedding API密钥",
@@ -1,7 +1,8 @@
 import streamlit as st
-from services.image_description_database import ImageDescriptionDatabase
-from config.settings import Config
-import os
+from services.catalog_reader import SORT_ORDERS
+from services.engine_registry import get_catalog_reader
+from services.metrics import span
+from services.thumbnails import get_thumbnail_cache
 
 # 页面配置
 st.set_page_config(
@@ -11,32 +12,71 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 初始化session state用于存储当前页码
+# 点击缩略图后在对话框中查看原图
+@st.dialog("查看原图", width="large")
+def show_original(image_path, description):
+    st.image(image_path, use_container_width=True)
+    st.markdown(description)
+
+# 初始化session state用于存储当前页码、排序方式与过滤条件
 if 'current_page' not in st.session_state:
     st.session_state.current_page = 1
+if 'library_sort' not in st.session_state:
+    st.session_state.library_sort = "default"
+if 'library_filter' not in st.session_state:
+    st.session_state.library_filter = ""
 
-# 初始化数据库
-image_db = ImageDescriptionDatabase(
-    local_image_folder=Config.LOCAL_IMAGE_FOLDER,
-    web_url_file=Config.WEB_URL_FILE,
-    database_file=Config.DATABASE_FILE,
-    index_file=Config.INDEX_FILE,
-    image_describe_api_key=st.session_state.get('IMAGE_DESCRIBE_API_KEY'),
-    image_describe_base_url=st.session_state.get('IMAGE_DESCRIBE_BASE_URL'),
-    image_describe_model=st.session_state.get('IMAGE_DESCRIBE_MODEL'),
-    image_describe_request_delay=st.session_state.get('IMAGE_DESCRIBE_REQUEST_DELAY')
-)
-
-# 构建数据库（如果需要）
-image_db.construct_image_description_database()
+# 只读的表情包目录：只按页读取描述快照，不会扫描图片目录或描述新图片（新图片在搜索页面加载表情包库时描述）
+catalog = get_catalog_reader()
 
 st.title("📚 表情包库")
 st.markdown("这里展示了所有可用的表情包及其描述")
 
+# 排序与过滤变化后回到第一页
+def reset_page():
+    st.session_state.current_page = 1
+
+filter_cols = st.columns([3, 1])
+with filter_cols[0]:
+    st.text_input("过滤", key="library_filter", placeholder="按文件名或描述过滤", on_change=reset_page)
+with filter_cols[1]:
+    st.selectbox("排序", list(SORT_ORDERS), key="library_sort", format_func=SORT_ORDERS.get, on_change=reset_page)
+query = st.session_state.library_filter.strip()
+if catalog.error:
+    st.warning(catalog.error)
+elif not len(catalog):
+    st.info("表情包库中还没有描述，打开搜索页面加载表情包库后即可在这里浏览。")
+
+# 构建数据库时按感知哈希识别出的近似重复分组，每组第一张为代表图片
+duplicate_clusters = catalog.duplicate_clusters()
+if duplicate_clusters:
+    max_clusters = 20
+    max_members = 6
+    duplicate_count = sum(len(members) for members in duplicate_clusters.values())
+    with st.expander(f"近似重复的表情包：{len(duplicate_clusters)} 组，共 {duplicate_count} 张重复"):
+        st.caption("重复的图片沿用代表图片的描述，不会再次请求视觉模型；"
+                   f"以下按重复数从多到少显示前 {max_clusters} 组。")
+        for canonical, members in list(duplicate_clusters.items())[:max_clusters]:
+            group = [canonical] + members[:max_members - 1]
+            with span("thumbnails"):
+                group_thumbnails = get_thumbnail_cache().get_many(
+                    [catalog.resolve_image_path(image_id) for image_id in group], width=256)
+            group_cols = st.columns(max_members)
+            for col, image_id, thumbnail in zip(group_cols, group, group_thumbnails):
+                with col:
+                    label = image_id.rsplit("/", 1)[-1]
+                    st.image(thumbnail, caption=f"代表：{label}" if image_id == canonical else label,
+                             use_container_width=True)
+            if len(members) > max_members - 1:
+                st.caption(f"另有 {len(members) - max_members + 1} 张重复未显示")
+
 # 分页设置
 images_per_page = 30
-total_images = len(image_db.index_list)
-num_pages = (total_images + images_per_page - 1) // images_per_page
+total_images = catalog.count(query)
+num_pages = max(1, (total_images + images_per_page - 1) // images_per_page)
+st.session_state.current_page = min(st.session_state.current_page, num_pages)
+if query:
+    st.caption(f"共 {total_images} 个匹配的表情包")
 
 # 创建分页导航
 with st.container():  # 使用容器来居中
@@ -94,28 +134,37 @@ with st.container():  # 使用容器来居中
                 st.session_state.current_page += 1
                 st.rerun()  # 确保页面更新
 
-# 计算当前页的图片索引
-start_idx = (st.session_state.current_page - 1) * images_per_page
-end_idx = min(start_idx + images_per_page, total_images)
+# 只读取当前页的条目
+with span("catalog_page"):
+    entries = catalog.page(st.session_state.current_page, images_per_page,
+                           st.session_state.library_sort, query)
+
+# 本页图片的完整路径（网络图片直接使用URL）
+image_paths = [catalog.resolve_image_path(entry.image_id) for entry in entries]
+
+# 并行生成本页缺失的缩略图，并在后台预先生成下一页
+thumbnail_cache = get_thumbnail_cache()
+with span("thumbnails"):
+    thumbnails = thumbnail_cache.get_many(image_paths)
+if st.session_state.current_page < num_pages:
+    next_entries = catalog.page(st.session_state.current_page + 1, images_per_page,
+                                st.session_state.library_sort, query)
+    thumbnail_cache.prefetch([catalog.resolve_image_path(entry.image_id) for entry in next_entries])
 
 # 显示当前页的图片和描述
 cols_per_row = 3
-for idx in range(start_idx, end_idx):
+for idx, entry in enumerate(entries):
     if idx % cols_per_row == 0:
         cols = st.columns(cols_per_row)  # 创建新的列
     col_idx = idx % cols_per_row
     with cols[col_idx]:
-        image_path = image_db.index_list[idx]
-        description = image_db.database_list[idx]
-        
-        # 如果是本地图片，需要构建完整路径
-        if not image_path.startswith('http'):
-            full_image_path = os.path.join(Config.LOCAL_IMAGE_FOLDER, image_path)
-        else:
-            full_image_path = image_path
+        full_image_path = image_paths[idx]
+        description = entry.description
         
-        # 显示图片和描述
-        st.image(full_image_path, use_container_width=True)
+        # 显示缩略图和描述，点击按钮查看原图
+        st.image(thumbnails[idx], use_container_width=True)
+        if st.button("查看原图", key=f"original_{entry.row}", use_container_width=True):
+            show_original(full_image_path, description)
         st.markdown(f"""
             <div style='padding: 10px; border-radius: 5px; margin-bottom: 20px'>
                 <p style='margin: 0; font-size: 0.9em'>{description}</p>
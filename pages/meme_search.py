@@ -1,7 +1,10 @@
 import streamlit as st
 import random
-from services.image_search import ImageSearch
+from services.engine_registry import clear as clear_engines, warm_up_image_search
 from config.settings import Config
+from services.search_modes import EMBEDDING_SEARCH_MODES, SEARCH_MODES
+from services.metrics import span, trace
+from services.thumbnails import get_thumbnail_cache
 
 # 页面配置
 st.set_page_config(
@@ -26,8 +29,9 @@ if 'SEARCH_MODEL' not in st.session_state:
     st.session_state.SEARCH_MODEL = Config.SEARCH_MODEL
 if 'SEARCH_BASE_URL' not in st.session_state:
     st.session_state.SEARCH_BASE_URL = Config.SEARCH_BASE_URL
-if 'USE_EMBEDDING_SEARCH' not in st.session_state:
-    st.session_state.USE_EMBEDDING_SEARCH = Config.USE_EMBEDDING_SEARCH
+if 'SEARCH_MODE' not in st.session_state:
+    # 环境变量中的搜索模式无效时回退到LLM搜索
+    st.session_state.SEARCH_MODE = Config.SEARCH_MODE if Config.SEARCH_MODE in SEARCH_MODES else "llm"
 if 'USE_QUERY_UNDERSTANDING' not in st.session_state:
     st.session_state.USE_QUERY_UNDERSTANDING = Config.USE_QUERY_UNDERSTANDING
 if 'EMBEDDING_API_KEY' not in st.session_state:
@@ -37,21 +41,38 @@ if 'EMBEDDING_BASE_URL' not in st.session_state:
 if 'EMBEDDING_MODEL' not in st.session_state:
     st.session_state.EMBEDDING_MODEL = Config.EMBEDDING_MODEL
 
-# 使用session state中的配置初始化搜索引擎
-search_engine = ImageSearch(
-    image_describe_api_key=st.session_state.IMAGE_DESCRIBE_API_KEY,
-    image_describe_base_url=st.session_state.IMAGE_DESCRIBE_BASE_URL,
-    image_describe_model=st.session_state.IMAGE_DESCRIBE_MODEL,
-    image_describe_request_delay=st.session_state.IMAGE_DESCRIBE_REQUEST_DELAY,
-    search_api_key=st.session_state.SEARCH_API_KEY,
-    search_model=st.session_state.SEARCH_MODEL,
-    search_base_url=st.session_state.SEARCH_BASE_URL,
-    use_embedding_search=st.session_state.USE_EMBEDDING_SEARCH,
-    use_query_understanding=st.session_state.USE_QUERY_UNDERSTANDING,
-    embedding_api_key=st.session_state.EMBEDDING_API_KEY,
-    embedding_base_url=st.session_state.EMBEDDING_BASE_URL,
-    embedding_model=st.session_state.EMBEDDING_MODEL
-)
+# 使用session state中的配置在后台预热进程内共享的搜索引擎，首屏不等待表情包库与索引加载
+def warm_up_search_engine():
+    return warm_up_image_search(
+        image_describe_api_key=st.session_state.IMAGE_DESCRIBE_API_KEY,
+        image_describe_base_url=st.session_state.IMAGE_DESCRIBE_BASE_URL,
+        image_describe_model=st.session_state.IMAGE_DESCRIBE_MODEL,
+        image_describe_request_delay=st.session_state.IMAGE_DESCRIBE_REQUEST_DELAY,
+        search_api_key=st.session_state.SEARCH_API_KEY,
+        search_model=st.session_state.SEARCH_MODEL,
+        search_base_url=st.session_state.SEARCH_BASE_URL,
+        search_mode=st.session_state.SEARCH_MODE,
+        use_query_understanding=st.session_state.USE_QUERY_UNDERSTANDING,
+        embedding_api_key=st.session_state.EMBEDDING_API_KEY,
+        embedding_base_url=st.session_state.EMBEDDING_BASE_URL,
+        embedding_model=st.session_state.EMBEDDING_MODEL
+    )
+
+def ready_search_engine(future):
+    """预热完成且成功时返回搜索引擎，否则返回None"""
+    if future.done() and future.exception() is None:
+        return future.result()
+    return None
+
+search_engine_future = warm_up_search_engine()
+search_engine = ready_search_engine(search_engine_future)
+
+# 预热期间定时检查，完成后重新运行整个页面
+@st.fragment(run_every=0.5)
+def warmup_status(future):
+    if future.done():
+        st.rerun()
+    st.info("⏳ 正在预热：加载表情包库与索引，完成后即可搜索……")
 
 # 搜索框提示语列表
 SEARCH_PLACEHOLDERS = [
@@ -71,40 +92,76 @@ if 'search_query' not in st.session_state:
     st.session_state.search_query = ""
 if 'n_results' not in st.session_state:
     st.session_state.n_results = 5
+if 'SHOW_TIMINGS' not in st.session_state:
+    st.session_state.SHOW_TIMINGS = False
+
+# 点击结果后在对话框中查看原图
+@st.dialog("查看原图", width="large")
+def show_original(image, reason):
+    st.image(image, use_container_width=True)
+    st.caption(f"推荐原因: {reason}")
 
-# 搜索函数
-def search():
+# 渲染单个搜索结果卡片，网格中只显示缩略图
+def render_result_card(idx, image, reason, thumbnail=None):
+    st.markdown('<div class="result-card">', unsafe_allow_html=True)
+    st.markdown('<div class="image-wrapper">', unsafe_allow_html=True)
+    st.image(thumbnail or get_thumbnail_cache().get(image), use_container_width=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+    st.markdown(f"""
+        <div class="result-info">
+            <p style='margin:0;font-weight:bold;font-size:14px'>推荐排序 #{idx + 1}</p>
+            <p style='margin:0;font-style:italic;color:#666;font-size:12px'>推荐原因: {reason}</p>
+        </div>
+    """, unsafe_allow_html=True)
+    st.markdown('</div>', unsafe_allow_html=True)
+    if st.button("查看原图", key=f"original_{idx}", use_container_width=True):
+        show_original(image, reason)
+
+# 搜索函数：流式获取结果，每收到一个结果就立即渲染对应的卡片
+def search(cols_per_row=3):
     if not st.session_state.search_query:
         return
-    try:
-        with st.spinner('搜索中...'):
-            results, reasons = search_engine.search(
-                st.session_state.search_query, 
-                st.session_state.n_results,
-            )
-            return (results, reasons) if results else ([], [])
-    except ValueError as e:
-        # API密钥未设置等配置错误
-        st.sidebar.error(f"配置错误: {str(e)}")
-        return [], []
-    except Exception as e:
-        # 其他错误（网络问题、API调用失败等）
-        import traceback
-        error_details = traceback.format_exc()
-        st.sidebar.error(f"搜索失败: {str(e)}")
-        st.sidebar.error("详细错误信息:")
-        st.sidebar.code(error_details)
-        return [], []
+    results, reasons = [], []
+    # 记录本次查询各阶段的耗时，供调试面板展示
+    with trace() as query_trace:
+        try:
+            with st.spinner('搜索中...'):
+                for image, reason in search_engine.search_stream(
+                    st.session_state.search_query, 
+                    st.session_state.n_results,
+                ):
+                    # 每行第一个结果到达时创建新的一行
+                    if len(results) % cols_per_row == 0:
+                        cols = st.columns(cols_per_row)
+                    with cols[len(results) % cols_per_row], span("render"):
+                        render_result_card(len(results), image, reason)
+                    results.append(image)
+                    reasons.append(reason)
+            return results, reasons
+        except ValueError as e:
+            # API密钥未设置等配置错误
+            st.sidebar.error(f"配置错误: {str(e)}")
+            return results, reasons
+        except Exception as e:
+            # 其他错误（网络问题、API调用失败等）
+            import traceback
+            error_details = traceback.format_exc()
+            st.sidebar.error(f"搜索失败: {str(e)}")
+            st.sidebar.error("详细错误信息:")
+            st.sidebar.code(error_details)
+            return results, reasons
+        finally:
+            st.session_state.last_trace = (query_trace.total_ms, query_trace.spans)
 
-# 回调函数
+# 回调函数：只记录查询，搜索在主区域中流式执行
 def on_input_change():
     st.session_state.search_query = st.session_state.user_input
-    st.session_state.results = search()
+    st.session_state.pending_search = True
 
 def on_slider_change():
     st.session_state.n_results = st.session_state.n_results_widget
     if st.session_state.search_query:
-        st.session_state.results = search()
+        st.session_state.pending_search = True
 
 # def on_api_key_change():
 #     st.session_state.api_key = st.session_state.api_key_input
@@ -164,16 +221,18 @@ with st.sidebar:
         
         # 搜索模式选择
         st.subheader("搜索模式")
-        st.checkbox(
-            "使用Embedding搜索",
-            value=st.session_state.USE_EMBEDDING_SEARCH,
-            key="use_embedding_search_input",
-            help="启用后将使用基于Embedding的语义搜索",
-            on_change=lambda: setattr(st.session_state, 'USE_EMBEDDING_SEARCH', st.session_state.use_embedding_search_input)
+        st.selectbox(
+            "搜索模式",
+            options=list(SEARCH_MODES),
+            index=list(SEARCH_MODES).index(st.session_state.SEARCH_MODE),
+            format_func=lambda mode: SEARCH_MODES[mode],
+            key="search_mode_input",
+            help="LLM搜索将整个库交给LLM；Embedding搜索使用语义向量检索；混合搜索先用Embedding召回候选，再由LLM重排并给出推荐原因",
+            on_change=lambda: setattr(st.session_state, 'SEARCH_MODE', st.session_state.search_mode_input)
         )
         
-        # 只有在启用Embedding搜索时才显示相关配置
-        if st.session_state.USE_EMBEDDING_SEARCH:
+        # 只有在使用Embedding的搜索模式下才显示相关配置
+        if st.session_state.SEARCH_MODE in EMBEDDING_SEARCH_MODES:
             st.subheader("Embedding配置")
             st.text_input(
                 "Embedding API密钥",
@@ -204,21 +263,9 @@ with st.sidebar:
         
         # 应用配置按钮
         if st.button("应用配置", use_container_width=True):
-            # 重新初始化搜索引擎
-            search_engine = ImageSearch(
-                image_describe_api_key=st.session_state.IMAGE_DESCRIBE_API_KEY,
-                image_describe_base_url=st.session_state.IMAGE_DESCRIBE_BASE_URL,
-                image_describe_model=st.session_state.IMAGE_DESCRIBE_MODEL,
-                image_describe_request_delay=st.session_state.IMAGE_DESCRIBE_REQUEST_DELAY,
-                search_api_key=st.session_state.SEARCH_API_KEY,
-                search_model=st.session_state.SEARCH_MODEL,
-                search_base_url=st.session_state.SEARCH_BASE_URL,
-                use_embedding_search=st.session_state.USE_EMBEDDING_SEARCH,
-                use_query_understanding=st.session_state.USE_QUERY_UNDERSTANDING,
-                embedding_api_key=st.session_state.EMBEDDING_API_KEY,
-                embedding_base_url=st.session_state.EMBEDDING_BASE_URL,
-                embedding_model=st.session_state.EMBEDDING_MODEL
-            )
+            # 按新配置在后台预热搜索引擎，配置未变化时直接复用
+            search_engine_future = warm_up_search_engine()
+            search_engine = ready_search_engine(search_engine_future)
             st.success("配置已更新！")
     
     # 原有的搜索输入框和其他控件
@@ -239,9 +286,32 @@ with st.sidebar:
     )
     
     search_button = st.button("搜索", use_container_width=True, on_click=on_input_change)
+    
+    st.checkbox(
+        "显示各阶段耗时",
+        value=st.session_state.SHOW_TIMINGS,
+        key="show_timings_input",
+        help="在侧边栏展示最近一次搜索中查询理解、embedding、检索、LLM生成、解析与渲染等阶段的耗时",
+        on_change=lambda: setattr(st.session_state, 'SHOW_TIMINGS', st.session_state.show_timings_input)
+    )
 
 # 主区域显示
-if not st.session_state.get("results"):
+if search_engine_future.done() and search_engine_future.exception() is not None:
+    # 预热失败：展示错误，重试时丢弃失败的结果重新构建
+    st.error(f"加载表情包库失败: {search_engine_future.exception()}")
+    if st.button("重试"):
+        clear_engines()
+        st.rerun()
+elif search_engine is None:
+    # 预热中：搜索请求保留到预热完成后再执行
+    warmup_status(search_engine_future)
+elif st.session_state.get("pending_search"):
+    # 新的搜索：边接收边渲染结果
+    st.session_state.pending_search = False
+    st.session_state.results = search()
+    if st.session_state.results is not None and not st.session_state.results[0]:
+        st.sidebar.warning("未找到匹配的表情包")
+elif not st.session_state.get("results"):
     # 初始页面显示欢迎信息
     st.title("👋 欢迎使用表情包搜索！")
     st.markdown("""
@@ -252,6 +322,10 @@ else:
     results, reasons = st.session_state.results
     if results:
         
+        # 并行生成本页缺失的缩略图
+        with span("thumbnails"):
+            thumbnails = get_thumbnail_cache().get_many(results)
+        
         # 计算每行显示的列数
         cols_per_row = 3
         # 计算需要多少行
@@ -264,20 +338,17 @@ else:
                 idx = row * cols_per_row + col_idx
                 if idx < len(results):
                     with cols[col_idx]:
-                        st.markdown('<div class="result-card">', unsafe_allow_html=True)
-                        st.markdown('<div class="image-wrapper">', unsafe_allow_html=True)
-                        st.image(results[idx], use_container_width=True)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                        st.markdown(f"""
-                            <div class="result-info">
-                                <p style='margin:0;font-weight:bold;font-size:14px'>推荐排序 #{idx + 1}</p>
-                                <p style='margin:0;font-style:italic;color:#666;font-size:12px'>推荐原因: {reasons[idx]}</p>
-                            </div>
-                        """, unsafe_allow_html=True)
-                        st.markdown('</div>', unsafe_allow_html=True)
+                        render_result_card(idx, results[idx], reasons[idx], thumbnails[idx])
     else:
         st.sidebar.warning("未找到匹配的表情包") 
 
+# 最近一次搜索的各阶段耗时
+if st.session_state.SHOW_TIMINGS and st.session_state.get("last_trace"):
+    total_ms, spans = st.session_state.last_trace
+    with st.sidebar.expander("⏱️ 各阶段耗时", expanded=True):
+        st.caption(f"总耗时: {total_ms:.1f} ms")
+        st.dataframe(spans, use_container_width=True)
+
 # 添加页脚
 st.markdown("---")
 st.markdown(
@@ -0,0 +1,356 @@
+import os
+import re
+import json
+import mmap
+import threading
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import IO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from services.lexical_index import caption_of
+from services.perceptual_hash import duplicate_clusters, load_duplicates
+from services.web_image_cache import get_web_image_cache
+
+# 排序方式 -> 说明
+SORT_ORDERS = {
+    "default": "库中顺序",
+    "newest": "最近加入",
+    "name": "文件名",
+}
+
+
+class CatalogEntry(NamedTuple):
+    row: int
+    image_id: str
+    description: str
+
+
+def _file_signature(f: Optional[IO[bytes]]) -> list:
+    """已打开文件的签名；文件被替换后inode与修改时间随之变化"""
+    if f is None:
+        return [0, 0, 0]
+    stat = os.fstat(f.fileno())
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def _line_spans(f: Optional[IO[bytes]], chunk_size: int = 64 << 20) -> Tuple[np.ndarray, np.ndarray]:
+    """分块扫描文件中的换行符，返回每个非空行的起止字节偏移（不含换行符）"""
+    size = os.fstat(f.fileno()).st_size if f is not None else 0
+    if size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    newlines = []
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for start in range(0, size, chunk_size):
+            chunk = np.frombuffer(mm, dtype=np.uint8, count=min(chunk_size, size - start), offset=start)
+            newlines.append(np.flatnonzero(chunk == ord("\n")).astype(np.int64) + start)
+            del chunk
+    ends = np.concatenate(newlines)
+    starts = np.concatenate([[0], ends + 1])[:len(ends)]
+    if not len(ends) or ends[-1] != size - 1:
+        # 最后一行没有换行符
+        starts = np.append(starts, ends[-1] + 1 if len(ends) else 0)
+        ends = np.append(ends, size)
+    # 与 DescriptionJournal 一致，跳过空行
+    keep = ends > starts
+    return starts[keep], ends[keep]
+
+
+class _StaleSnapshot(Exception):
+    """快照文件在读取前已被替换"""
+
+
+class _Snapshot:
+    """某一版本快照的行偏移与排序，快照文件被替换后整体换成新对象
+
+    两个文件的行数不一致（例如压缩只替换了其中一个）或描述日志的压缩尚未完成时无法确定行的对应关系，
+    此时 error 说明原因、count 为0，不展示任何条目。
+    """
+    def __init__(self, signature: list, spans: Dict[str, Tuple[np.ndarray, np.ndarray]], error: Optional[str] = None):
+        self.signature = signature
+        self.spans = spans
+        counts = {len(starts) for starts, _ in spans.values()}
+        if error is None and len(counts) > 1:
+            error = f"描述数据库与索引行数不一致: {len(spans['database'][0])} != {len(spans['index'][0])}"
+        self.error = error
+        self.count = 0 if error is not None else counts.pop()
+        self.orders: Dict[str, np.ndarray] = {}
+        # (查询, 排序) -> 过滤并排序后的行号
+        self.filtered: "OrderedDict[Tuple[str, str], np.ndarray]" = OrderedDict()
+        self.lock = threading.Lock()
+
+
+class CatalogReader:
+    """只读的表情包目录：按行偏移随机读取 index.txt / database.txt 快照
+
+    两个快照文件的行偏移扫描一次后保存在缓存目录中，快照不变时直接加载；读取一页只需
+    对本页的每一行 seek + read，翻页的开销与页大小成正比，与库的规模无关。排序以行号排列
+    （按文件名排序时缓存到磁盘）表示，过滤在快照上逐块匹配，结果只保存匹配的行号。
+    只读取快照，不会扫描图片目录或描述新图片；新描述在构建数据库并压缩日志后才可见。
+    """
+    FILES = ("index", "database")
+    HEADER_FILE = "header.json"
+    FORMAT_VERSION = 1
+    MAX_CACHED_FILTERS = 16
+
+    def __init__(self, database_file: str, index_file: str, local_image_folder: str = "",
+                 cache_dir: Optional[str] = None):
+        self.paths = {"index": index_file, "database": database_file}
+        self.local_image_folder = local_image_folder
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(index_file), "catalog")
+        self.duplicates_file = os.path.join(os.path.dirname(database_file), "duplicates.json")
+        self._duplicates: Tuple[Optional[int], Dict[str, List[str]]] = (None, {})
+        self._snapshot: Optional[_Snapshot] = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self) -> int:
+        return self._snapshot.count
+
+    @property
+    def error(self) -> Optional[str]:
+        """当前快照无法读取的原因，正常时为None"""
+        return self._snapshot.error
+
+    def resolve_image_path(self, image_id: str) -> str:
+        """网络图片使用本地缓存（尚未缓存时使用URL），本地图片拼接为完整路径"""
+        if image_id.startswith("http"):
+            return get_web_image_cache().resolve(image_id)
+        return os.path.join(self.local_image_folder, image_id)
+
+    def duplicate_clusters(self) -> Dict[str, List[str]]:
+        """构建数据库时识别出的近似重复分组：代表图片 -> 重复图片，文件更新后重新读取"""
+        try:
+            mtime = os.stat(self.duplicates_file).st_mtime_ns
+        except OSError:
+            return {}
+        if self._duplicates[0] != mtime:
+            self._duplicates = (mtime, duplicate_clusters(load_duplicates(self.duplicates_file)))
+        return self._duplicates[1]
+
+    def _signature(self) -> list:
+        signature = []
+        for name in self.FILES:
+            try:
+                stat = os.stat(self.paths[name])
+                signature.append([stat.st_size, stat.st_mtime_ns, stat.st_ino])
+            except OSError:
+                signature.append([0, 0, 0])
+        return signature
+
+    @property
+    def _compaction_file(self) -> str:
+        """DescriptionJournal 压缩时写入的完整记录，存在时说明快照正在（或上次未完成）替换"""
+        return os.path.splitext(self.paths["database"])[0] + ".journal.snapshot"
+
+    @contextmanager
+    def _open_files(self, snapshot: Optional[_Snapshot] = None) -> Iterator[Dict[str, Optional[IO[bytes]]]]:
+        """打开两个快照文件；给定 snapshot 时核对文件仍是该快照的版本，否则抛出 _StaleSnapshot"""
+        files: Dict[str, Optional[IO[bytes]]] = {}
+        try:
+            for i, name in enumerate(self.FILES):
+                try:
+                    files[name] = open(self.paths[name], "rb")
+                except OSError:
+                    files[name] = None
+                if snapshot is not None and _file_signature(files[name]) != snapshot.signature[i]:
+                    raise _StaleSnapshot()
+            yield files
+        finally:
+            for f in files.values():
+                if f is not None:
+                    f.close()
+
+    def _with_snapshot(self, read):
+        """在当前快照上读取；期间快照文件被替换时重新加载后重试"""
+        for _ in range(3):
+            snapshot = self._snapshot
+            try:
+                return read(snapshot)
+            except _StaleSnapshot:
+                self.refresh()
+        raise OSError("表情包描述快照正在频繁更新，请稍后重试")
+
+    def _cache_path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, name)
+
+    def _load_cache(self, signature: list) -> Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]]:
+        try:
+            with open(self._cache_path(self.HEADER_FILE), "r", encoding="utf-8") as f:
+                header = json.load(f)
+            if header.get("format_version") != self.FORMAT_VERSION or header.get("signature") != signature:
+                return None
+            return {name: (np.load(self._cache_path(f"{name}_starts.npy")),
+                           np.load(self._cache_path(f"{name}_ends.npy"))) for name in self.FILES}
+        except (OSError, ValueError):
+            return None
+
+    def _save_array(self, name: str, array: np.ndarray) -> None:
+        tmp_path = self._cache_path(name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, self._cache_path(name))
+
+    def _save_cache(self, snapshot: _Snapshot) -> None:
+        """保存行偏移；头信息最后写入，中途失败时缓存视为无效"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # 旧快照的排序已失效
+            for sort in SORT_ORDERS:
+                if os.path.exists(self._cache_path(f"order_{sort}.npy")):
+                    os.remove(self._cache_path(f"order_{sort}.npy"))
+            for name, (starts, ends) in snapshot.spans.items():
+                self._save_array(f"{name}_starts.npy", starts)
+                self._save_array(f"{name}_ends.npy", ends)
+            tmp_path = self._cache_path(self.HEADER_FILE + ".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"format_version": self.FORMAT_VERSION, "signature": snapshot.signature}, f)
+            os.replace(tmp_path, self._cache_path(self.HEADER_FILE))
+        except OSError:
+            # 缓存只用于加速，写入失败时下次重新扫描即可
+            pass
+
+    def refresh(self) -> bool:
+        """快照文件变化时重新加载行偏移，返回是否有变化"""
+        signature = self._signature()
+        with self._lock:
+            if self._snapshot is not None and self._snapshot.signature == signature:
+                return False
+            # 以打开的文件为准计算签名与行偏移，避免与之后被替换的文件混用
+            with self._open_files() as files:
+                signature = [_file_signature(files[name]) for name in self.FILES]
+                spans = self._load_cache(signature)
+                computed = spans is None
+                if computed:
+                    spans = {name: _line_spans(files[name]) for name in self.FILES}
+            error = "描述数据库正在更新，请稍后刷新" if os.path.exists(self._compaction_file) else None
+            snapshot = _Snapshot(signature, spans, error)
+            if computed:
+                self._save_cache(snapshot)
+            self._snapshot = snapshot
+            return True
+
+    def rows(self, rows) -> List[CatalogEntry]:
+        """按行号读取若干条目，每行只读取对应的字节范围"""
+        return self._with_snapshot(lambda snapshot: self._read(snapshot, rows))
+
+    def _read(self, snapshot: _Snapshot, rows) -> List[CatalogEntry]:
+        rows = [row for row in rows if row < snapshot.count]
+        columns = {name: [] for name in self.FILES}
+        if rows:
+            with self._open_files(snapshot) as files:
+                for name in self.FILES:
+                    starts, ends = snapshot.spans[name]
+                    f = files[name]
+                    for row in rows:
+                        f.seek(int(starts[row]))
+                        columns[name].append(f.read(int(ends[row] - starts[row])).decode("utf-8").strip())
+        return [CatalogEntry(int(row), image_id, description)
+                for row, image_id, description in zip(rows, columns["index"], columns["database"])]
+
+    def _order(self, snapshot: _Snapshot, sort: str) -> Optional[np.ndarray]:
+        """排序后的行号，库中顺序返回None"""
+        if sort == "default":
+            return None
+        if sort == "newest":
+            # 新描述追加在快照末尾
+            return np.arange(snapshot.count - 1, -1, -1, dtype=np.int64)
+        if sort != "name":
+            raise ValueError(f"不支持的排序方式: {sort}，可选: {', '.join(SORT_ORDERS)}")
+        with snapshot.lock:
+            order = snapshot.orders.get(sort)
+            if order is None:
+                order = self._load_order(snapshot, sort)
+                snapshot.orders[sort] = order
+        return order
+
+    @staticmethod
+    def _sort_name(image_id: str) -> str:
+        """排序用的文件名：本地图片直接取路径最后一段，网络图片解析URL"""
+        if image_id.startswith("http"):
+            return caption_of(image_id).lower()
+        return image_id.rpartition("/")[2].lower()
+
+    def _load_order(self, snapshot: _Snapshot, sort: str) -> np.ndarray:
+        """按文件名排序需要读取全部图片id（不读取描述），结果按快照版本缓存到磁盘"""
+        path = self._cache_path(f"order_{sort}.npy")
+        try:
+            with open(self._cache_path(self.HEADER_FILE), "r", encoding="utf-8") as f:
+                cached = json.load(f).get("signature") == snapshot.signature
+            if cached:
+                order = np.load(path)
+                if len(order) == snapshot.count:
+                    return order
+        except (OSError, ValueError):
+            pass
+        starts, ends = snapshot.spans["index"]
+        with self._open_files(snapshot) as files:
+            data = files["index"].read() if snapshot.count else b""
+        names = [self._sort_name(data[starts[i]:ends[i]].decode("utf-8").strip()) for i in range(snapshot.count)]
+        order = np.array(sorted(range(snapshot.count), key=names.__getitem__), dtype=np.int64)
+        try:
+            self._save_array(f"order_{sort}.npy", order)
+        except OSError:
+            pass
+        return order
+
+    def _match(self, snapshot: _Snapshot, query: str) -> np.ndarray:
+        """图片id或描述中包含查询文本（忽略ASCII大小写）的行号，升序"""
+        needle = query.encode("utf-8")
+        pattern = re.compile(re.escape(needle), re.IGNORECASE)
+        matched = []
+        if not snapshot.count:
+            return np.zeros(0, dtype=np.int64)
+        with self._open_files(snapshot) as files:
+            for name in self.FILES:
+                starts, ends = snapshot.spans[name]
+                with mmap.mmap(files[name].fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    positions = np.fromiter((m.start() for m in pattern.finditer(mm)), dtype=np.int64)
+                rows = np.searchsorted(starts, positions, side="right") - 1
+                valid = (rows >= 0) & (positions + len(needle) <= ends[np.maximum(rows, 0)])
+                matched.append(rows[valid])
+        rows = np.unique(np.concatenate(matched)) if matched else np.zeros(0, dtype=np.int64)
+        return rows[rows < snapshot.count]
+
+    def _filtered(self, snapshot: _Snapshot, query: str, sort: str) -> np.ndarray:
+        """过滤并排序后的行号，按快照版本缓存最近的若干个查询"""
+        key = (query, sort)
+        with snapshot.lock:
+            rows = snapshot.filtered.get(key)
+            if rows is not None:
+                snapshot.filtered.move_to_end(key)
+                return rows
+        rows = self._match(snapshot, query)
+        order = None if sort == "newest" else self._order(snapshot, sort)
+        if sort == "newest":
+            rows = rows[::-1]
+        elif order is not None:
+            rank = np.empty(snapshot.count, dtype=np.int64)
+            rank[order] = np.arange(snapshot.count, dtype=np.int64)
+            rows = rows[np.argsort(rank[rows], kind="stable")]
+        with snapshot.lock:
+            snapshot.filtered[key] = rows
+            while len(snapshot.filtered) > self.MAX_CACHED_FILTERS:
+                snapshot.filtered.popitem(last=False)
+        return rows
+
+    def count(self, query: str = "") -> int:
+        """满足过滤条件的条目数"""
+        if not query:
+            return self._snapshot.count
+        return self._with_snapshot(lambda snapshot: len(self._filtered(snapshot, query, "default")))
+
+    def page(self, page: int, page_size: int, sort: str = "default", query: str = "") -> List[CatalogEntry]:
+        """读取第 page 页（从1开始）的条目，只读取本页的行"""
+        return self._with_snapshot(lambda snapshot: self._page(snapshot, page, page_size, sort, query))
+
+    def _page(self, snapshot: _Snapshot, page: int, page_size: int, sort: str, query: str) -> List[CatalogEntry]:
+        start = max(0, (page - 1) * page_size)
+        stop = start + page_size
+        if query:
+            rows = self._filtered(snapshot, query, sort)[start:stop]
+        elif sort == "newest":
+            rows = np.arange(snapshot.count - 1 - start, max(snapshot.count - 1 - stop, -1), -1)
+        else:
+            order = self._order(snapshot, sort)
+            rows = np.arange(start, min(stop, snapshot.count)) if order is None else order[start:stop]
+        return self._read(snapshot, rows)
@@ -0,0 +1,28 @@
+import threading
+from typing import TYPE_CHECKING, Dict, Tuple
+from services.metrics import count_http_request
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# 按 (base_url, api_key) 复用OpenAI客户端，保持HTTP连接池与keep-alive连接
+_clients: Dict[Tuple[str, str], "OpenAI"] = {}
+_lock = threading.Lock()
+
+
+def get_openai_client(api_key: str, base_url: str) -> "OpenAI":
+    """获取进程内共享的OpenAI客户端，openai包在第一次创建客户端时才导入"""
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                from openai import DefaultHttpxClient, OpenAI
+                client = _clients[key] = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    # 通过请求钩子统计客户端内部的重试次数
+                    http_client=DefaultHttpxClient(event_hooks={"request": [count_http_request]})
+                )
+    return client
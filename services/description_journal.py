@@ -0,0 +1,176 @@
+import os
+import json
+import threading
+from typing import Dict, List, Optional
+from rich import print
+
+
+class DescriptionJournal:
+    """追加写入、可崩溃恢复的描述日志
+
+    database.txt / index.txt 作为快照，新描述以单行JSON记录追加到日志文件中，
+    每条记录通过一次 write 调用写入，并按批次 fsync。加载时先读快照再重放日志；
+    日志积累到一定条数后压缩：先把当前全部记录以JSONL原子地写入一个压缩文件，再依次替换两份快照、删除日志，
+    最后删除压缩文件。两份快照不能同时原子替换，压缩中途崩溃时加载以压缩文件为准并重新完成压缩，
+    不会把新索引与旧描述错位地拼在一起。
+    """
+    def __init__(self, journal_file: str, database_file: str, index_file: str,
+                 fsync_every: int = 32, compact_every: int = 1000):
+        self.journal_file = journal_file
+        self.database_file = database_file
+        self.index_file = index_file
+        self.compact_file = journal_file + ".snapshot"
+        self.fsync_every = max(1, int(fsync_every))
+        self.compact_every = max(1, int(compact_every))
+
+        # 图片id -> 描述，保持插入顺序，即database.txt与index.txt的行顺序
+        self.records: Dict[str, str] = {}
+        self._fd: Optional[int] = None
+        self._unsynced = 0
+        self._journal_records = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_lines(path: str) -> List[str]:
+        if not os.path.exists(path):
+            return []
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f.readlines() if line.strip()]
+
+    def _apply(self, record: dict) -> None:
+        # 旧版本可能写入过空描述，重放时当作没有描述，下次构建重新描述
+        if record.get("op") == "remove" or not " ".join((record["description"] or "").split()):
+            self.records.pop(record["id"], None)
+        else:
+            self.records[record["id"]] = record["description"]
+
+    def _read_compact_file(self) -> Optional[Dict[str, str]]:
+        """读取未完成的压缩留下的完整记录，没有时返回None"""
+        records = {}
+        try:
+            with open(self.compact_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        image_id, description = json.loads(line)
+                        records[image_id] = description
+        except FileNotFoundError:
+            # 不存在，或另一个进程刚好完成了压缩
+            return None
+        return records
+
+    def load(self, read_only: bool = False) -> Dict[str, str]:
+        """读取快照并重放日志，返回 图片id -> 描述
+
+        read_only 为True时不修复任何文件（不完成中断的压缩、不截断残缺的日志记录），
+        用于读取另一个进程正在写入的数据库，修复留给写入方。
+        """
+        records = self._read_compact_file()
+        if records is not None and read_only:
+            self.records = records
+            return self.records
+        if records is not None:
+            # 上次压缩在替换快照的中途中断：压缩文件已包含快照与日志中的全部记录，据此重新完成压缩
+            print(f"从中断的压缩中恢复描述数据库: {self.compact_file}")
+            self.records = records
+            self.compact()
+            return self.records
+
+        descriptions = self._read_lines(self.database_file)
+        image_ids = self._read_lines(self.index_file)
+        if len(descriptions) != len(image_ids):
+            # 行数不一致时无法确定描述与图片的对应关系，丢弃快照，由日志重放与重新描述补齐
+            print(f"描述数据库与索引行数不一致，忽略快照: {len(descriptions)} != {len(image_ids)}")
+            descriptions, image_ids = [], []
+        self.records = dict(zip(image_ids, descriptions))
+
+        self._journal_records = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file, "rb") as f:
+                data = f.read()
+            # 最后一行没有换行符说明写入时被中断，截断掉残缺的记录
+            complete = data[:data.rfind(b"\n") + 1]
+            if len(complete) != len(data) and not read_only:
+                with open(self.journal_file, "r+b") as f:
+                    f.truncate(len(complete))
+            for line in complete.decode("utf-8").splitlines():
+                if not line.strip():
+                    continue
+                try:
+                    self._apply(json.loads(line))
+                    self._journal_records += 1
+                except (ValueError, KeyError) as e:
+                    print(f"跳过损坏的日志记录: {e}")
+        return self.records
+
+    def _write(self, record: dict) -> None:
+        """以一次write调用追加一条完整记录"""
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            if self._fd is None:
+                os.makedirs(os.path.dirname(self.journal_file) or ".", exist_ok=True)
+                self._fd = os.open(self.journal_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._fd, line)
+            self._apply(record)
+            self._journal_records += 1
+            self._unsynced += 1
+            if self._unsynced >= self.fsync_every:
+                os.fsync(self._fd)
+                self._unsynced = 0
+            need_compact = self._journal_records >= self.compact_every
+        if need_compact:
+            self.compact()
+
+    def append(self, image_id: str, description: str) -> None:
+        """追加（或覆盖）一张图片的描述
+
+        快照按行配对图片与描述，空描述或含换行的描述会让两份快照的行数对不上，因此直接拒绝。
+        """
+        if not description or not description.strip() or "\n" in description or "\r" in description:
+            raise ValueError(f"描述必须是非空的单行文本: {image_id}")
+        self._write({"op": "put", "id": image_id, "description": description})
+
+    def remove(self, image_id: str) -> None:
+        """删除一张图片的描述"""
+        self._write({"op": "remove", "id": image_id})
+
+    def flush(self) -> None:
+        """将已追加的记录落盘"""
+        with self._lock:
+            if self._fd is not None and self._unsynced:
+                os.fsync(self._fd)
+                self._unsynced = 0
+
+    @staticmethod
+    def _atomic_write_lines(path: str, lines: List[str]) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def compact(self) -> None:
+        """将当前记录写成新快照并清空日志"""
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+                self._unsynced = 0
+            # 先原子地写入完整记录，之后任何一步中断都可以据此恢复
+            self._atomic_write_lines(self.compact_file, [json.dumps([image_id, description], ensure_ascii=False)
+                                                         for image_id, description in self.records.items()])
+            self._atomic_write_lines(self.index_file, list(self.records.keys()))
+            self._atomic_write_lines(self.database_file, list(self.records.values()))
+            if os.path.exists(self.journal_file):
+                os.remove(self.journal_file)
+            os.remove(self.compact_file)
+            self._journal_records = 0
+
+    def close(self) -> None:
+        """关闭日志，必要时压缩为快照"""
+        if self._journal_records:
+            self.compact()
+        else:
+            self.flush()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+import hashlib
+import unicodedata
+from typing import Dict, List, Optional
+from rich import print
+from services.embedding_store import EmbeddingStore
+
+
+def normalize_text(text: str) -> str:
+    """规范化描述文本：统一全角/半角等字符形式并合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def text_key(model: str, text: str) -> str:
+    """embedding的内容地址：(模型, 规范化文本) 的哈希"""
+    return hashlib.blake2b(f"{model}\0{normalize_text(text)}".encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """以描述文本寻址的embedding缓存
+
+    向量保存在 EmbeddingStore 中，id 为 text_key(模型, 规范化描述)；image_keys.json 另外记录
+    图片 -> 文本键，以及每个文本键最近一次被库引用的时间。描述相同的图片共用一条向量，重命名与移动的图片
+    文本不变、直接命中，重新描述过的图片得到新的文本键；不再被引用超过 gc_max_age 秒的向量在保存前被回收，
+    切换回之前的库时仍可复用期限内的向量。
+    """
+    KEYS_FILE = "image_keys.json"
+    FORMAT_VERSION = 1
+
+    def __init__(self, store_dir: str, model: str, gc_max_age: float = 30 * 86400):
+        self.store_dir = store_dir
+        self.model = model
+        self.gc_max_age = gc_max_age
+        self.store = EmbeddingStore(store_dir, model)
+        self.image_keys: Dict[str, str] = {}
+        self.last_used: Dict[str, float] = {}
+        # 旧版存储以图片id为键，首次 update 时按当前描述换成文本键
+        self._legacy = False
+        self._keys_modified = False
+        self._store_modified = False
+
+    @property
+    def keys_path(self) -> str:
+        return os.path.join(self.store_dir, self.KEYS_FILE)
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def load(self) -> None:
+        """加载向量与映射，首次使用时从旧版pickle缓存或以图片id为键的存储迁移"""
+        if not self.store.load() and EmbeddingStore.has_pickle_files(self.store_dir):
+            print(f"正在迁移旧版embedding缓存: {self.store_dir}")
+            self.store = EmbeddingStore.migrate_pickle_dir(self.store_dir, self.model)
+        try:
+            with open(self.keys_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("format_version") != self.FORMAT_VERSION or data.get("model") != self.model:
+                raise ValueError("format changed")
+            self.image_keys = data["images"]
+            self.last_used = data["last_used"]
+        except (OSError, ValueError, KeyError):
+            self.image_keys, self.last_used = {}, {}
+            self._legacy = len(self.store) > 0
+
+    def update(self, image_ids: List[str], descriptions: List[str]) -> Dict[str, str]:
+        """按当前库的描述更新 图片 -> 文本键 的映射，返回缺少向量的 文本键 -> 描述（同一文本键只出现一次）"""
+        keys = [text_key(self.model, description) for description in descriptions]
+        if self._legacy:
+            # 旧版存储中的向量就是图片当前描述的向量，换成文本键；不在当前库中的旧id留给垃圾回收
+            legacy = {key: self.store.get(image_id) for image_id, key in zip(image_ids, keys)
+                      if image_id in self.store and key not in self.store}
+            if legacy:
+                self.store.add(list(legacy), [vector for vector in legacy.values()])
+            if self.store.remove([image_id for image_id in image_ids if image_id in self.store]) or legacy:
+                self._store_modified = True
+            self._legacy = False
+
+        image_keys = dict(zip(image_ids, keys))
+        if image_keys != self.image_keys:
+            self.image_keys = image_keys
+            self._keys_modified = True
+        # 引用时间精确到天即可，每天最多写回一次，避免每次启动都重写映射文件
+        now = time.time()
+        for key in set(keys):
+            if now - self.last_used.get(key, 0) > 86400:
+                self.last_used[key] = now
+                self._keys_modified = True
+        for key in self.store.ids:
+            if key not in self.last_used:
+                self.last_used[key] = now
+                self._keys_modified = True
+
+        missing = {}
+        for key, description in zip(keys, descriptions):
+            if key not in self.store and key not in missing:
+                missing[key] = description
+        return missing
+
+    def add(self, keys: List[str], vectors) -> None:
+        self.store.add(keys, vectors)
+        self._store_modified = True
+
+    def row_of(self, image_id: str) -> Optional[int]:
+        """图片对应的矩阵行号，没有向量时返回None"""
+        key = self.image_keys.get(image_id)
+        return None if key is None else self.store.id_to_row.get(key)
+
+    def collect_garbage(self) -> int:
+        """回收不再被引用且超过 gc_max_age 秒未被使用的向量，返回回收的数量"""
+        referenced = set(self.image_keys.values())
+        now = time.time()
+        stale = [key for key in self.store.ids
+                 if key not in referenced and now - self.last_used.get(key, now) > self.gc_max_age]
+        removed = self.store.remove(stale)
+        if removed:
+            self._store_modified = self._keys_modified = True
+        for key in stale:
+            self.last_used.pop(key, None)
+        return removed
+
+    def save(self) -> None:
+        """回收过期向量后原子地写入发生变化的部分"""
+        self.collect_garbage()
+        if self._store_modified:
+            self.store.save()
+            self._store_modified = False
+        if self._keys_modified or not os.path.exists(self.keys_path):
+            os.makedirs(self.store_dir, exist_ok=True)
+            tmp_path = self.keys_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"format_version": self.FORMAT_VERSION, "model": self.model,
+                           "images": self.image_keys, "last_used": self.last_used}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.keys_path)
+            self._keys_modified = False
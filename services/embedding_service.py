@@ -1,13 +1,17 @@
-import requests
 from config.settings import Config
 from typing import List
 import numpy as np
-from openai import OpenAI
+from services.client_pool import get_openai_client
+from services.metrics import record_usage, span
+
+
 class EmbeddingService:
-    def __init__(self, api_key=None, base_url=None, model=None):
+    def __init__(self, api_key=None, base_url=None, model=None, batch_size=None, max_batch_tokens=None):
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
+        self.batch_size = int(batch_size or Config.EMBEDDING_BATCH_SIZE)
+        self.max_batch_tokens = int(max_batch_tokens or Config.EMBEDDING_BATCH_TOKENS)
     
     @staticmethod
     def normalize_embedding(embedding: List[float]) -> np.ndarray:
@@ -15,9 +19,14 @@ class EmbeddingService:
         arr = np.array(embedding)
         return arr / np.linalg.norm(arr)
     
-    def get_embedding(self, text: str) -> np.ndarray:
-        # """获取文本嵌入并归一化"""
-        
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        """粗略估计文本的token数（中文约一字一token，按字符数保守估计）"""
+        return max(1, len(text))
+    
+    @property
+    def client(self):
+        """获取共享的keep-alive客户端"""
         if self.api_key is None:
             raise ValueError("Embedding API密钥未设置")
         
@@ -27,9 +36,40 @@ class EmbeddingService:
         if self.model is None:
             raise ValueError("Embedding API模型未设置")
         
-        client = OpenAI(api_key=self.api_key, base_url=self.base_url)
-        response = client.embeddings.create(
-            model=self.model,
-            input=text
-        )
-        return response.data[0].embedding
\ No newline at end of file
+        return get_openai_client(self.api_key, self.base_url)
+    
+    def split_batches(self, texts: List[str]) -> List[List[int]]:
+        """按批大小与token预算将输入切分为若干批，返回每批的下标"""
+        batches = []
+        batch, batch_tokens = [], 0
+        for i, text in enumerate(texts):
+            tokens = self.estimate_tokens(text)
+            if batch and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(i)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """批量获取文本嵌入，结果顺序与输入一致"""
+        client = self.client
+        embeddings = [None] * len(texts)
+        for batch in self.split_batches(texts):
+            with span("embedding_request", batch_size=len(batch)):
+                response = client.embeddings.create(
+                    model=self.model,
+                    input=[texts[i] for i in batch]
+                )
+            record_usage("embedding", response)
+            # 服务端返回的顺序不一定与输入一致，按index还原
+            for item in response.data:
+                embeddings[batch[item.index]] = item.embedding
+        return embeddings
+    
+    def get_embedding(self, text: str) -> np.ndarray:
+        # """获取文本嵌入并归一化"""
+        
+        return self.get_embeddings([text])[0]
@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import pickle
+import hashlib
+import numpy as np
+from typing import Dict, Iterable, List, Optional
+from rich import print
+
+
+class EmbeddingStore:
+    """单个embedding模型的紧凑存储：一个float32矩阵 + id表 + 头信息
+
+    目录结构：
+        embeddings.npy  归一化后的float32矩阵，形状为 (n, dim)，以 np.memmap 方式加载
+        ids.txt         id表，第i行对应矩阵第i行
+        header.json     模型名、维度、数量与校验和
+
+    三个文件不能一起原子替换，header.json 最后写入并记录id表与矩阵抽样行的校验和；
+    加载时核对这两项，保存中途崩溃留下的新旧文件混合会被识别为损坏，而不是让id与向量错位。
+    """
+    MATRIX_FILE = "embeddings.npy"
+    IDS_FILE = "ids.txt"
+    HEADER_FILE = "header.json"
+    FORMAT_VERSION = 1
+    # 加载时核对的矩阵抽样行数
+    SAMPLE_ROWS = 256
+
+    def __init__(self, store_dir: str, model: str):
+        self.store_dir = store_dir
+        self.model = model
+        self.dim: Optional[int] = None
+        self.ids: List[str] = []
+        self.id_to_row: Dict[str, int] = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._checksum_value: Optional[str] = None
+
+    @property
+    def matrix_path(self) -> str:
+        return os.path.join(self.store_dir, self.MATRIX_FILE)
+
+    @property
+    def ids_path(self) -> str:
+        return os.path.join(self.store_dir, self.IDS_FILE)
+
+    @property
+    def header_path(self) -> str:
+        return os.path.join(self.store_dir, self.HEADER_FILE)
+
+    def exists(self) -> bool:
+        """存储文件是否齐全"""
+        return all(os.path.exists(p) for p in (self.matrix_path, self.ids_path, self.header_path))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, item_id: str) -> bool:
+        return item_id in self.id_to_row
+
+    def get(self, item_id: str) -> Optional[np.ndarray]:
+        """获取某个id对应的向量（只读视图）"""
+        row = self.id_to_row.get(item_id)
+        if row is None:
+            return None
+        return self.matrix[row]
+
+    @staticmethod
+    def _checksum(ids: List[str], matrix: np.ndarray) -> str:
+        """计算id表与矩阵内容的校验和"""
+        digest = hashlib.sha256()
+        digest.update("\n".join(ids).encode("utf-8"))
+        digest.update(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def _sample_checksum(cls, ids: List[str], matrix: np.ndarray) -> str:
+        """id表与矩阵中均匀抽样的若干行的校验和，加载时只需读取少量数据"""
+        digest = hashlib.sha256()
+        digest.update("\n".join(ids).encode("utf-8"))
+        digest.update(repr(tuple(matrix.shape)).encode("ascii"))
+        if len(matrix):
+            rows = np.unique(np.linspace(0, len(matrix) - 1, min(len(matrix), cls.SAMPLE_ROWS)).astype(np.int64))
+            digest.update(np.ascontiguousarray(matrix[rows], dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        """按行归一化，零向量保持不变"""
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def load(self) -> bool:
+        """以内存映射方式加载存储，存储不存在或不一致时返回False"""
+        if not self.exists():
+            return False
+
+        with open(self.header_path, "r", encoding="utf-8") as f:
+            header = json.load(f)
+        with open(self.ids_path, "r", encoding="utf-8") as f:
+            ids = f.read().split("\n")
+        ids = ids[:header.get("count", 0)]
+        matrix = np.load(self.matrix_path, mmap_mode="r")
+
+        if header.get("model") != self.model:
+            print(f"embedding存储模型不匹配: {header.get('model')} != {self.model}")
+            return False
+        if matrix.ndim != 2 or matrix.shape[0] != len(ids) or matrix.shape[1] != header.get("dim"):
+            print(f"embedding存储已损坏: {self.store_dir}")
+            return False
+        sample_checksum = header.get("sample_checksum")
+        if sample_checksum is not None:
+            consistent = self._sample_checksum(ids, matrix) == sample_checksum
+        else:
+            # 旧版头信息没有抽样校验和，完整核对一次，下次保存后改用抽样校验
+            consistent = self._checksum(ids, matrix) == header.get("checksum")
+        if not consistent:
+            print(f"embedding存储的id表与矩阵不一致（可能在保存中途中断），将重新生成: {self.store_dir}")
+            return False
+
+        self.dim = header["dim"]
+        self.ids = ids
+        self.id_to_row = {item_id: row for row, item_id in enumerate(ids)}
+        self.matrix = matrix
+        self._checksum_value = header.get("checksum")
+        return True
+
+    def verify(self) -> bool:
+        """完整读取矩阵并核对校验和"""
+        return self._checksum(self.ids, self.matrix) == self._checksum_value
+
+    def add(self, ids: Iterable[str], vectors) -> None:
+        """添加或覆盖向量，写入前统一归一化为float32"""
+        ids = list(ids)
+        if not ids:
+            return
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"embedding维度不匹配: {vectors.shape[1]} != {self.dim}")
+
+        # 同一批次中重复的id以最后一次为准
+        pending = dict(zip(ids, vectors))
+        matrix = self.matrix if len(self.ids) else np.zeros((0, self.dim), dtype=np.float32)
+        new_ids, new_rows, overwrite = [], [], {}
+        for item_id, vector in pending.items():
+            row = self.id_to_row.get(item_id)
+            if row is None:
+                self.id_to_row[item_id] = len(self.ids) + len(new_ids)
+                new_ids.append(item_id)
+                new_rows.append(vector)
+            else:
+                overwrite[row] = vector
+
+        if overwrite:
+            # 内存映射是只读的，覆盖前先拷贝到内存
+            matrix = np.array(matrix, dtype=np.float32)
+            for row, vector in overwrite.items():
+                matrix[row] = vector
+        if new_rows:
+            matrix = np.concatenate([matrix, np.stack(new_rows)], axis=0)
+        self.ids.extend(new_ids)
+        self.matrix = matrix
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """删除若干id对应的向量，返回实际删除的数量"""
+        drop = {self.id_to_row[i] for i in ids if i in self.id_to_row}
+        if not drop:
+            return 0
+        keep = [row for row in range(len(self.ids)) if row not in drop]
+        self.ids = [self.ids[row] for row in keep]
+        self.matrix = np.array(self.matrix[keep], dtype=np.float32)
+        self.id_to_row = {item_id: row for row, item_id in enumerate(self.ids)}
+        return len(drop)
+
+    def save(self) -> None:
+        """原子地写入矩阵、id表与头信息"""
+        os.makedirs(self.store_dir, exist_ok=True)
+        matrix = np.ascontiguousarray(self.matrix, dtype=np.float32)
+        if self.dim is None:
+            self.dim = matrix.shape[1] if matrix.ndim == 2 else 0
+        header = {
+            "format_version": self.FORMAT_VERSION,
+            "model": self.model,
+            "dim": self.dim,
+            "count": len(self.ids),
+            "dtype": "float32",
+            "normalized": True,
+            "checksum": self._checksum(self.ids, matrix),
+            "sample_checksum": self._sample_checksum(self.ids, matrix),
+        }
+
+        # 先写临时文件再重命名，头信息最后落盘，避免读到不完整的存储
+        tmp_matrix = self.matrix_path + ".tmp.npy"
+        np.save(tmp_matrix, matrix)
+        os.replace(tmp_matrix, self.matrix_path)
+        tmp_ids = self.ids_path + ".tmp"
+        with open(tmp_ids, "w", encoding="utf-8") as f:
+            f.write("\n".join(self.ids))
+        os.replace(tmp_ids, self.ids_path)
+        tmp_header = self.header_path + ".tmp"
+        with open(tmp_header, "w", encoding="utf-8") as f:
+            json.dump(header, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_header, self.header_path)
+
+        self._checksum_value = header["checksum"]
+        # 重新以内存映射方式打开，释放内存中的副本
+        self.matrix = np.load(self.matrix_path, mmap_mode="r")
+
+    @staticmethod
+    def has_pickle_files(pickle_dir: str) -> bool:
+        """目录中是否存在旧版逐图片pickle缓存"""
+        if not os.path.isdir(pickle_dir):
+            return False
+        with os.scandir(pickle_dir) as entries:
+            return any(entry.name.endswith(".pkl") for entry in entries)
+
+    @classmethod
+    def migrate_pickle_dir(cls, pickle_dir: str, model: str, store_dir: Optional[str] = None) -> "EmbeddingStore":
+        """将旧版 <image>.pkl 逐图片缓存一次性迁移为紧凑存储"""
+        store = cls(store_dir or pickle_dir, model)
+        ids, vectors = [], []
+        with os.scandir(pickle_dir) as entries:
+            names = sorted(entry.name for entry in entries if entry.name.endswith(".pkl"))
+        for name in names:
+            try:
+                with open(os.path.join(pickle_dir, name), "rb") as f:
+                    vectors.append(np.asarray(pickle.load(f), dtype=np.float32))
+                ids.append(name[:-len(".pkl")])
+            except Exception as e:
+                print(f"迁移embedding缓存失败 ({name}): {e}")
+        if ids:
+            store.add(ids, np.stack(vectors))
+        store.save()
+        return store
+
+
+if __name__ == "__main__":
+    # 用法: python -m services.embedding_store <pickle目录> <模型名>
+    store = EmbeddingStore.migrate_pickle_dir(sys.argv[1], sys.argv[2])
+    print(f"已迁移 {len(store)} 条embedding到 {store.store_dir}")
@@ -0,0 +1,245 @@
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, Tuple
+from config.settings import Config
+from services.metrics import span
+
+if TYPE_CHECKING:
+    from services.catalog_reader import CatalogReader
+    from services.image_description_database import ImageDescriptionDatabase
+    from services.image_search import ImageSearch
+
+# 进程级共享的表情包库与搜索引擎，所有会话与页面复用同一份内存索引
+# 构建所需的numpy、openai等较重的模块在第一次构建时才导入，页面导入本模块不会拖慢首屏
+_registry_lock = threading.Lock()
+_key_locks: Dict[tuple, threading.Lock] = {}
+_databases: Dict[tuple, Tuple[tuple, "ImageDescriptionDatabase"]] = {}
+_search_engines: Dict[tuple, Tuple["ImageDescriptionDatabase", "ImageSearch"]] = {}
+_catalog_readers: Dict[tuple, "CatalogReader"] = {}
+
+# 后台预热：构建在单个后台线程中串行执行，页面只查询Future的状态
+_warmup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chatmeme-warmup")
+# 预热键 -> [构建结束时的库指纹（构建中为None）, Future, 失败后允许重试的时间]
+_warmups: Dict[tuple, list] = {}
+
+
+def _get_key_lock(key: tuple) -> threading.Lock:
+    """获取某个配置对应的构建锁，保证同一配置只会被构建一次"""
+    with _registry_lock:
+        lock = _key_locks.get(key)
+        if lock is None:
+            lock = _key_locks[key] = threading.Lock()
+        return lock
+
+
+def _evict_stale(keep_key: tuple = None) -> None:
+    """清理已被取代的表情包库与不再使用的构建锁，调用方需持有 _registry_lock
+
+    没有被任何搜索引擎引用的表情包库（keep_key 对应的除外）已被新配置取代；
+    构建锁在对应的库与引擎都被清理、且没有正在进行的构建时一并删除。
+    """
+    referenced = {id(database) for database, _ in _search_engines.values()}
+    for key in [k for k, (_, database) in _databases.items() if k != keep_key and id(database) not in referenced]:
+        del _databases[key]
+    for key in [k for k, lock in _key_locks.items()
+                if k[0] in ("database", "search") and k not in _databases and k not in _search_engines
+                and not lock.locked()]:
+        del _key_locks[key]
+
+
+def library_fingerprint(local_image_folder: str = None,
+                        web_url_file: str = None,
+                        database_file: str = None,
+                        index_file: str = None) -> tuple:
+    """根据磁盘上表情包库的状态生成指纹，库发生变化时指纹随之变化"""
+    paths = (
+        local_image_folder or Config.LOCAL_IMAGE_FOLDER,
+        web_url_file or Config.WEB_URL_FILE,
+        database_file or Config.DATABASE_FILE,
+        index_file or Config.INDEX_FILE,
+    )
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append((path, None, None))
+    return tuple(fingerprint)
+
+
+def get_image_description_database(image_describe_api_key=None,
+                                   image_describe_base_url=None,
+                                   image_describe_model=None,
+                                   image_describe_request_delay=None) -> "ImageDescriptionDatabase":
+    """获取进程内共享的表情包描述数据库，仅在配置或磁盘上的库变化时重建"""
+    from services.image_description_database import ImageDescriptionDatabase
+    config_key = (
+        image_describe_api_key or Config.IMAGE_DESCRIBE_API_KEY,
+        image_describe_base_url or Config.IMAGE_DESCRIBE_BASE_URL,
+        image_describe_model or Config.IMAGE_DESCRIBE_MODEL,
+        float(image_describe_request_delay or Config.IMAGE_DESCRIBE_REQUEST_DELAY),
+    )
+    key = ("database",) + config_key
+    with _get_key_lock(key):
+        cached = _databases.get(key)
+        if cached is not None and cached[0] == library_fingerprint():
+            return cached[1]
+
+        database = ImageDescriptionDatabase(
+            local_image_folder=Config.LOCAL_IMAGE_FOLDER,
+            web_url_file=Config.WEB_URL_FILE,
+            database_file=Config.DATABASE_FILE,
+            index_file=Config.INDEX_FILE,
+            image_describe_api_key=config_key[0],
+            image_describe_base_url=config_key[1],
+            image_describe_model=config_key[2],
+            image_describe_request_delay=config_key[3],
+        )
+        database.construct_image_description_database()
+        # 构建过程可能会写入数据库文件，因此在构建完成后再记录指纹
+        fingerprint = library_fingerprint()
+        with _registry_lock:
+            _databases[key] = (fingerprint, database)
+            _evict_stale(keep_key=key)
+        return database
+
+
+def get_image_search(image_describe_api_key=None,
+                     image_describe_base_url=None,
+                     image_describe_model=None,
+                     image_describe_request_delay=None,
+                     search_api_key=None,
+                     search_model=None,
+                     search_base_url=None,
+                     use_embedding_search=False,
+                     search_mode=None,
+                     use_query_understanding=None,
+                     embedding_api_key=None,
+                     embedding_base_url=None,
+                     embedding_model=None) -> "ImageSearch":
+    """获取进程内共享的搜索引擎，按生效配置缓存，仅在配置或磁盘上的库变化时重建"""
+    from services.image_search import ImageSearch
+    database = get_image_description_database(
+        image_describe_api_key=image_describe_api_key,
+        image_describe_base_url=image_describe_base_url,
+        image_describe_model=image_describe_model,
+        image_describe_request_delay=image_describe_request_delay,
+    )
+    key = (
+        "search",
+        id(database),
+        search_api_key or Config.SEARCH_API_KEY,
+        search_model or Config.SEARCH_MODEL,
+        search_base_url or Config.SEARCH_BASE_URL,
+        search_mode or ("embedding" if use_embedding_search else "llm"),
+        use_query_understanding if use_query_understanding is not None else Config.USE_QUERY_UNDERSTANDING,
+        embedding_api_key or Config.EMBEDDING_API_KEY,
+        embedding_base_url or Config.EMBEDDING_BASE_URL,
+        embedding_model or Config.EMBEDDING_MODEL,
+    )
+    with _get_key_lock(key):
+        cached = _search_engines.get(key)
+        if cached is not None:
+            return cached[1]
+
+        search_engine = ImageSearch(
+            image_describe_api_key=image_describe_api_key,
+            image_describe_base_url=image_describe_base_url,
+            image_describe_model=image_describe_model,
+            image_describe_request_delay=image_describe_request_delay,
+            search_api_key=search_api_key,
+            search_model=search_model,
+            search_base_url=search_base_url,
+            use_embedding_search=use_embedding_search,
+            search_mode=search_mode,
+            use_query_understanding=use_query_understanding,
+            embedding_api_key=embedding_api_key,
+            embedding_base_url=embedding_base_url,
+            embedding_model=embedding_model,
+            image_description_database=database,
+        )
+        # 旧数据库对应的引擎已失效，清理掉以释放内存
+        with _registry_lock:
+            for stale_key in [k for k in _search_engines if k[2:] == key[2:]]:
+                del _search_engines[stale_key]
+            _search_engines[key] = (database, search_engine)
+            _evict_stale()
+        return search_engine
+
+
+def get_catalog_reader(database_file: str = None, index_file: str = None,
+                       local_image_folder: str = None) -> "CatalogReader":
+    """获取进程内共享的只读表情包目录，快照变化时自动重新加载；只读取快照，不会构建数据库"""
+    from services.catalog_reader import CatalogReader
+    key = (
+        database_file or Config.DATABASE_FILE,
+        index_file or Config.INDEX_FILE,
+        local_image_folder or Config.LOCAL_IMAGE_FOLDER,
+    )
+    with _get_key_lock(("catalog",) + key):
+        reader = _catalog_readers.get(key)
+        if reader is None:
+            reader = _catalog_readers[key] = CatalogReader(*key)
+        else:
+            reader.refresh()
+        return reader
+
+
+def _warm_up(name: str, build: Callable, kwargs: dict, retry_failed: bool = False) -> Future:
+    """在后台线程中构建，返回对应的Future
+
+    同一配置的构建进行中、或已完成且磁盘上的库没有变化时复用同一个Future；
+    库发生变化后重新提交构建，页面在此期间显示预热状态。失败的构建在库变化、距失败超过
+    WARMUP_RETRY_BACKOFF 秒或 retry_failed 为True时重新提交，避免一次临时错误让引擎一直不可用。
+    """
+    key = (name,) + tuple(sorted(kwargs.items()))
+
+    def run():
+        try:
+            with span("warmup", target=name):
+                result = build(**kwargs)
+        except BaseException:
+            entry[2] = time.monotonic() + Config.WARMUP_RETRY_BACKOFF
+            raise
+        finally:
+            # 构建可能写入数据库文件，因此在构建结束后再记录指纹
+            entry[0] = library_fingerprint()
+        return result
+
+    with _registry_lock:
+        cached = _warmups.get(key)
+        if cached is not None:
+            fingerprint, future, retry_at = cached
+            if not future.done():
+                return future
+            if fingerprint == library_fingerprint():
+                if future.exception() is None:
+                    return future
+                if not retry_failed and time.monotonic() < retry_at:
+                    return future
+        entry = [None, None, 0.0]
+        entry[1] = _warmup_executor.submit(run)
+        _warmups[key] = entry
+        return entry[1]
+
+
+def warm_up_image_description_database(retry_failed: bool = False, **kwargs) -> Future:
+    """在后台构建表情包描述数据库，参数同 get_image_description_database"""
+    return _warm_up("database", get_image_description_database, kwargs, retry_failed)
+
+
+def warm_up_image_search(retry_failed: bool = False, **kwargs) -> Future:
+    """在后台构建搜索引擎（包括表情包库与索引），参数同 get_image_search"""
+    return _warm_up("search", get_image_search, kwargs, retry_failed)
+
+
+def clear():
+    """清空进程内缓存的表情包库、搜索引擎与预热结果"""
+    with _registry_lock:
+        _databases.clear()
+        _search_engines.clear()
+        _catalog_readers.clear()
+        _warmups.clear()
@@ -1,26 +1,65 @@
-import requests
-import base64
 import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from config.settings import Config
-from typing import List
-import numpy as np
-from openai import OpenAI
+from typing import Callable, Iterator, List, Optional, Tuple
+from services.client_pool import get_openai_client
+from services.image_payload import ImagePayloadCache
+from services.rate_limiter import TokenBucket
+from services.metrics import record_usage, registry, span
+
+RATE_LIMIT_WAIT_SECONDS = registry.histogram(
+    "chatmeme_rate_limit_wait_seconds", "Time spent waiting for the image describe rate limiter")
+PAYLOAD_BYTES = registry.counter(
+    "chatmeme_image_payload_bytes_total", "Image bytes before (original) and after (sent) preprocessing")
+
+
+class DescribeStats:
+    """描述请求的累计统计：调用次数、原图与实际上传的字节数、预处理与请求耗时"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.preprocess_seconds = 0.0
+        self.request_seconds = 0.0
+
+    def add(self, original_bytes: int, sent_bytes: int, preprocess_seconds: float, request_seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.original_bytes += original_bytes
+            self.sent_bytes += sent_bytes
+            self.preprocess_seconds += preprocess_seconds
+            self.request_seconds += request_seconds
+
+    def summary(self) -> str:
+        if not self.calls:
+            return "没有描述请求"
+        saved = 1 - self.sent_bytes / self.original_bytes if self.original_bytes else 0.0
+        return (f"{self.calls} 次描述请求：上传 {self.sent_bytes / 1e6:.2f} MB（原图 {self.original_bytes / 1e6:.2f} MB，"
+                f"节省 {saved:.0%}），平均预处理 {self.preprocess_seconds / self.calls * 1000:.0f} ms、"
+                f"请求 {self.request_seconds / self.calls:.2f} s")
 
 class ImageDescribeService:
-    def __init__(self, api_key=None, base_url=None, model=None, request_delay=None):
+    def __init__(self, api_key=None, base_url=None, model=None, request_delay=None, max_workers=None, burst=None):
         self.api_key = api_key or Config.IMAGE_DESCRIBE_API_KEY
         self.base_url = base_url or Config.IMAGE_DESCRIBE_BASE_URL
         self.model = model or Config.IMAGE_DESCRIBE_MODEL
         self.local_image_folder = Config.LOCAL_IMAGE_FOLDER
         self.request_delay = float(request_delay or Config.IMAGE_DESCRIBE_REQUEST_DELAY)
-        self.last_request_time = 0
-    
-    @staticmethod
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            encoded_string = base64.b64encode(image_file.read()).decode("utf-8")
-        return encoded_string
+        self.max_workers = int(max_workers or Config.IMAGE_DESCRIBE_MAX_WORKERS)
+        # 所有并发worker共享同一个令牌桶，整体请求速率不超过 1 / request_delay
+        self.rate_limiter = TokenBucket.from_delay(self.request_delay, burst or Config.IMAGE_DESCRIBE_BURST)
+        self.detail = Config.IMAGE_DESCRIBE_DETAIL
+        # 本地图片先缩放并重新编码，按内容哈希缓存预处理结果
+        self.payload_cache = ImagePayloadCache(
+            cache_dir=Config.IMAGE_PAYLOAD_CACHE_DIR,
+            max_edge=Config.IMAGE_PAYLOAD_MAX_EDGE,
+            image_format=Config.IMAGE_PAYLOAD_FORMAT,
+            quality=Config.IMAGE_PAYLOAD_QUALITY,
+        )
+        self.stats = DescribeStats()
     
     @staticmethod
     def check_image_url_type(image_url: str) -> str:
@@ -30,16 +69,9 @@ class ImageDescribeService:
         else:
             return "image_file"
     
-    def describe_image(self, image_url: str) -> str:
-        """描述图片"""
-        # 实现速率限制
-        current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        if time_since_last_request < self.request_delay:
-            sleep_time = self.request_delay - time_since_last_request
-            print(f"等待 {sleep_time:.2f} 秒以遵守API速率限制...")
-            time.sleep(sleep_time)
-        
+    @property
+    def client(self):
+        """获取共享的keep-alive客户端"""
         if self.api_key is None:
             raise ValueError("图像描述API密钥未设置")
 
@@ -49,28 +81,35 @@ class ImageDescribeService:
         if self.model is None:
             raise ValueError("图像描述API模型未设置")
         
-        client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        return get_openai_client(self.api_key, self.base_url)
+    
+    def describe_image(self, image_url: str) -> str:
+        """描述图片"""
+        client = self.client
+        
+        # 实现速率限制
+        RATE_LIMIT_WAIT_SECONDS.observe(self.rate_limiter.acquire())
         
         image_type = self.check_image_url_type(image_url)
         
+        start = time.perf_counter()
         if image_type == "image_url":
-            image = image_url
-            message_image_url = {
-                "type": "image_url",
-                "image_url": {
-                    "url": image,
-                    "detail": "high",  
-                },
-            }
+            # 未能缓存到本地的网络图片由模型服务自行下载
+            url, original_bytes, sent_bytes = image_url, 0, 0
         else:
-            image = self.encode_image(image_url)
-            message_image_url = {
-                "type": "image_url",
-                "image_url": {
-                    "url": f'data:image/jpeg;base64,{image}',
-                    "detail": "high",
-                },
-            }
+            with span("image_payload"):
+                payload = self.payload_cache.get(image_url)
+            url, original_bytes, sent_bytes = payload.data_url(), payload.original_bytes, len(payload.data)
+            PAYLOAD_BYTES.inc(original_bytes, kind="original")
+            PAYLOAD_BYTES.inc(sent_bytes, kind="sent")
+        preprocess_seconds = time.perf_counter() - start
+        message_image_url = {
+            "type": "image_url",
+            "image_url": {
+                "url": url,
+                "detail": self.detail,
+            },
+        }
         
         messages = [
             {"role": "system", "content": "你是表情包识别专家，擅长识别表情包中的人物、文字，并描述这张表情包的含义。"},
@@ -86,14 +125,51 @@ class ImageDescribeService:
             },
         ]
         
-        description = client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            temperature=0.5,
-        )
-        self.last_request_time = time.time()
+        start = time.perf_counter()
+        with span("image_describe_request"):
+            description = client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.5,
+            )
+        self.stats.add(original_bytes, sent_bytes, preprocess_seconds, time.perf_counter() - start)
+        record_usage("image_describe", description)
         return description.choices[0].message.content
     
+    def describe_images(self, image_urls: List[str],
+                        progress_callback: Optional[Callable[[int, int], None]] = None
+                        ) -> Iterator[Tuple[str, Optional[str], Optional[Exception]]]:
+        """并发描述多张图片，按输入顺序逐个产出 (image_url, description, error)
+        
+        最多 max_workers 个请求同时进行，progress_callback(已完成数, 总数) 在调用方线程中回调。
+        模型返回空内容时视为失败，description 为去掉换行后的单行文本。
+        """
+        total = len(image_urls)
+        if total == 0:
+            return
+        # 配置错误时直接抛出，而不是让每张图片都失败一次
+        self.client
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.describe_image, image_url): i for i, image_url in enumerate(image_urls)}
+            results = {}
+            next_index = 0
+            for done, future in enumerate(as_completed(futures), 1):
+                try:
+                    description = " ".join((future.result() or "").split())
+                    if not description:
+                        raise ValueError("视觉模型返回了空的描述")
+                    results[futures[future]] = (description, None)
+                except Exception as e:
+                    results[futures[future]] = (None, e)
+                if progress_callback is not None:
+                    progress_callback(done, total)
+                # 按输入顺序产出已完成的结果
+                while next_index in results:
+                    description, error = results.pop(next_index)
+                    yield image_urls[next_index], description, error
+                    next_index += 1
+    
     
 if __name__ == "__main__":
     image_describe = ImageDescribeService()
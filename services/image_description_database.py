@@ -1,9 +1,18 @@
 from services.image_describe import ImageDescribeService
+from services.description_journal import DescriptionJournal
+from services.library_manifest import LibraryChanges, LibraryManifest
+from services.metrics import registry, span
+from services.perceptual_hash import PerceptualHashStore, find_duplicates, save_duplicates
+from services.web_image_cache import get_web_image_cache
 import os
-import time
+from typing import Callable, Dict, List, Optional
 from config.settings import Config
 from rich import print
-from openai import OpenAI
+
+DESCRIBED_IMAGES = registry.counter("chatmeme_described_images_total", "Images described while building the database")
+DUPLICATE_IMAGES = registry.counter("chatmeme_duplicate_images_total", "Near-duplicate images that reused a description")
+
+
 class ImageDescriptionDatabase:
     def __init__(self, local_image_folder: str, web_url_file: str, database_file: str, index_file: str,
                  image_describe_api_key=None,
@@ -16,29 +25,68 @@ class ImageDescriptionDatabase:
         self.image_describe_request_delay = float(image_describe_request_delay)
         
         self._client = None
+        self._image_describe = None
+        
+        self.database_file = database_file
+        self.index_file = index_file
+        self.journal = DescriptionJournal(
+            journal_file=os.path.splitext(database_file)[0] + ".journal",
+            database_file=database_file,
+            index_file=index_file,
+            fsync_every=Config.DESCRIPTION_JOURNAL_FSYNC_EVERY,
+            compact_every=Config.DESCRIPTION_JOURNAL_COMPACT_EVERY
+        )
         
         self.local_image_folder = local_image_folder
         self.local_image_list = []
+        self.manifest = LibraryManifest(
+            manifest_file=os.path.join(os.path.dirname(database_file), "manifest.json"),
+            image_folder=local_image_folder,
+            extensions=Config.IMAGE_EXTENSIONS
+        )
+        self.library_changes = LibraryChanges()
         self.load_local_image_folder()
         
+        database_dir = os.path.dirname(database_file)
+        self.perceptual_hashes = PerceptualHashStore(os.path.join(database_dir, "perceptual_hashes.json"))
+        self.duplicates_file = os.path.join(database_dir, "duplicates.json")
+        # 近似重复的图片 -> 代表图片
+        self.duplicates: Dict[str, str] = {}
+        
         self.web_url_file = web_url_file
         self.web_url_list = []
         self.load_web_url_file()
         
         self.image_url_list = self.web_url_list + self.local_image_list
         
-        self.database_file = database_file
-        self.index_file = index_file
-        
     @property
     def client(self):
         """懒加载OpenAI客户端"""
         if self._client is None:
             if not self.image_describe_api_key:
                 raise ValueError("图像描述API密钥未设置")
+            from openai import OpenAI
             self._client = OpenAI(api_key=self.image_describe_api_key, base_url=self.image_describe_base_url)
         return self._client
     
+    @property
+    def image_describe(self) -> ImageDescribeService:
+        """懒加载图像描述服务"""
+        if self._image_describe is None:
+            self._image_describe = ImageDescribeService(
+                api_key=self.image_describe_api_key,
+                base_url=self.image_describe_base_url,
+                model=self.image_describe_model,
+                request_delay=self.image_describe_request_delay
+            )
+        return self._image_describe
+    
+    def resolve_image_path(self, image_path: str) -> str:
+        """网络图片使用本地缓存（尚未缓存时使用URL），本地图片拼接为完整路径"""
+        if image_path.startswith("http"):
+            return get_web_image_cache().resolve(image_path)
+        return os.path.join(self.local_image_folder, image_path)
+    
     def load_web_url_file(self):
         if os.path.exists(self.web_url_file):
             with open(self.web_url_file, "r") as f:
@@ -49,82 +97,127 @@ class ImageDescriptionDatabase:
             self.web_url_list = []
             
     def load_local_image_folder(self):
-        if os.path.exists(self.local_image_folder):
-            for file in os.listdir(self.local_image_folder):
-                if file.endswith(".jpg") or file.endswith(".png"):
-                    self.local_image_list.append(file)
-        else:
-            self.local_image_list = []
+        """扫描本地图片目录（含子目录），并与清单对比得到新增、修改、移动与删除的图片"""
+        with span("library_scan"):
+            self.local_image_list, self.library_changes = self.manifest.update()
+    
+    def _apply_library_changes(self, records: Dict[str, str]):
+        """根据清单变化更新描述日志：移动的图片沿用原描述，已删除的图片移出数据库"""
+        for old_path, new_path in self.library_changes.moved:
+            if old_path in records and new_path not in records:
+                self.journal.append(new_path, records[old_path])
+                self.journal.remove(old_path)
+        
+        # 图片目录存在时，移除磁盘上已不存在的本地图片
+        if os.path.isdir(self.local_image_folder):
+            current = set(self.image_url_list)
+            for image_path in [p for p in records if not p.startswith("http") and p not in current]:
+                self.journal.remove(image_path)
+    
+    def _describe_new_images(self, image_paths: List[str],
+                             progress_callback: Optional[Callable[[int, int], None]] = None) -> List[str]:
+        """并发描述新图片，并按输入顺序追加写入描述日志，返回描述失败的图片"""
+        full_paths = [self.resolve_image_path(image_path) for image_path in image_paths]
+        results = self.image_describe.describe_images(full_paths, progress_callback)
+        failed = []
+        for image_path, (_, description, error) in zip(image_paths, results):
+            if error is not None:
+                print(f"描述图片失败 ({image_path}): {error}")
+                DESCRIBED_IMAGES.inc(result="failed")
+                failed.append(image_path)
+                continue
+            DESCRIBED_IMAGES.inc(result="ok")
+            # 描述按行存储，去掉其中的换行
+            self.journal.append(image_path, " ".join(description.split()))
+        return failed
     
-    def construct_image_description_database(self):
+    def _local_images(self) -> Dict[str, tuple]:
+        """库中已在本地的图片的 图片id -> (内容哈希, 本地路径)，尚未下载的网络图片不参与去重"""
+        images = {}
+        web_cache = get_web_image_cache()
+        for url in self.web_url_list:
+            path = web_cache.cached_path(url)
+            if path is not None:
+                images[url] = (web_cache.entries[url]["hash"], path)
+        for image_path in self.local_image_list:
+            entry = self.manifest.entries.get(image_path)
+            if entry is not None:
+                images[image_path] = (entry["hash"], os.path.join(self.local_image_folder, image_path))
+        return images
+    
+    def _find_duplicates(self, records: Dict[str, str], new_images: List[str]) -> Dict[str, str]:
+        """按感知哈希为整个库划分近似重复，返回 重复图片 -> 代表图片
+        
+        已有描述的图片排在新图片之前，新图片优先归入已描述过的代表图片，可以直接沿用其描述。
+        """
+        with span("perceptual_hash"):
+            hashes = self.perceptual_hashes.get_many(self._local_images())
+        pending = set(new_images)
+        described = [image_path for image_path in self.image_url_list if image_path in records and image_path not in pending]
+        return find_duplicates(described + new_images, hashes, Config.DEDUP_MAX_DISTANCE)
+    
+    def _reuse_descriptions(self, image_paths: List[str], duplicates: Dict[str, str]) -> List[str]:
+        """为代表图片已有描述的重复图片追加同样的描述，返回代表图片还没有描述的图片"""
+        remaining = []
+        for image_path in image_paths:
+            description = self.journal.records.get(duplicates[image_path])
+            if description is None:
+                remaining.append(image_path)
+                continue
+            DUPLICATE_IMAGES.inc()
+            self.journal.append(image_path, description)
+        return remaining
+    
+    def construct_image_description_database(self, progress_callback: Optional[Callable[[int, int], None]] = None):
         # print(f"Constructing image description database...")
         
-        # load database
-        if os.path.exists(self.database_file):
-            # print(f"Loading database from {self.database_file}")
-            with open(self.database_file, "r") as f:
-                description_list = [line.strip() for line in f.readlines()]
-                # remove empty lines
-                description_list = [line for line in description_list if line]
-        else:
-            description_list = []
-            
-        # print(f"Database loaded: {len(description_list)} descriptions")
+        # 读取database.txt/index.txt快照并重放上次构建中断时留下的日志
+        with span("journal_load"):
+            records = self.journal.load()
+        # print(f"Database loaded: {len(records)} descriptions")
         
-        # load index
-        if os.path.exists(self.index_file):
-            # print(f"Loading index from {self.index_file}")
-            with open(self.index_file, "r") as f:
-                index_list = [line.strip() for line in f.readlines()]
-                # remove empty lines
-                index_list = [line for line in index_list if line]
-        else:
-            index_list = []
-
-        # print(f"Index loaded: {len(index_list)} images")
-
-        if len(index_list) != len(description_list):
-            # 已有的数据库描述和图片对应不上，需要重新构造数据库   
-            # print(f"Reconstructing database...")
-            for image_path in self.image_url_list:
-                # print(f"Describing image: {image_path}")
-                description = self.image_describe.describe_image(os.path.join(self.local_image_folder, image_path))
-                description_list.append(description)
-                index_list.append(image_path)
-                
-                # 将描述和图片路径写入数据库和索引
-                with open(self.database_file, "w") as f:
-                    for description in description_list:
-                        f.write(description + "\n")
-                with open(self.index_file, "w") as f:
-                    for image_path in index_list:
-                        f.write(image_path + "\n")
-                
-            # print(f"Database reconstructed: {len(description_list)} descriptions")
-
-        else:
-            # 已有一份数据库描述和图片路径，需要检查是否存在缺失的描述
-            # print(f"Database already exists: {len(description_list)} descriptions")
-            # 检查现有的图片路径是否存在于index_list中，如果不存在，创建描述并添加进数据库
-            for image_path in self.image_url_list:
-                if image_path not in index_list: 
-                    # print(f"Describing image: {image_path}")
-                    description = self.image_describe.describe_image(os.path.join(self.local_image_folder, image_path))
-                    description_list.append(description)
-                    index_list.append(image_path)
-                    
-                    # 将描述和图片路径写入数据库和索引  
-                    with open(self.database_file, "w") as f:
-                        for description in description_list:
-                            f.write(description + "\n")
-                    with open(self.index_file, "w") as f:
-                        for image_path in index_list:
-                            f.write(image_path + "\n")
-            
-            # print(f"Database updated: {len(description_list)} descriptions")
-                    
-        self.database_list = description_list
-        self.index_list = index_list
+        self._apply_library_changes(records)
+        
+        # 并发下载（或重新校验）网络图片到本地缓存，描述、缩略图与显示都读取本地文件
+        if self.web_url_list:
+            with span("web_image_fetch", count=len(self.web_url_list)):
+                get_web_image_cache().fetch_many(self.web_url_list)
+        
+        # 检查现有的图片路径是否存在于数据库中，不存在的以及内容被修改过的图片并发创建描述并追加到日志
+        new_images = [image_path for image_path in self.image_url_list if image_path not in records]
+        new_images += [image_path for image_path in self.library_changes.changed if image_path in records]
+        
+        # 近似重复的新图片沿用代表图片的描述，只有代表图片需要请求视觉模型
+        duplicates = self._find_duplicates(records, new_images) if Config.DEDUP_ENABLED else {}
+        reused = self._reuse_descriptions([image_path for image_path in new_images if image_path in duplicates], duplicates)
+        to_describe = [image_path for image_path in new_images if image_path not in duplicates]
+        try:
+            failed = []
+            if to_describe:
+                # print(f"Describing {len(to_describe)} images...")
+                with span("describe_new_images", count=len(to_describe)):
+                    failed = self._describe_new_images(to_describe, progress_callback)
+                print(self.image_describe.stats.summary())
+            # 代表图片在本次构建中才描述的重复图片，代表图片描述失败时一同视为失败
+            failed += self._reuse_descriptions(reused, duplicates)
+            if failed:
+                # 描述失败的图片在清单中保留旧状态，下次构建时重新识别
+                self.manifest.revert(failed)
+            # 变化已写入日志后才更新清单，中途失败时下次构建仍能识别到这些变化
+            self.manifest.save()
+        except ValueError as e:
+            # 图像描述API未配置时不阻塞加载，已有的描述照常可用
+            print(f"跳过 {len(new_images)} 张新图片的描述: {e}")
+        finally:
+            # 将日志压缩为新的快照；即使构建被中断，已完成的描述也不会丢失
+            with span("journal_compact"):
+                self.journal.close()
+        # print(f"Database updated: {len(records)} descriptions")
                     
+        self.database_list = list(self.journal.records.values())
+        self.index_list = list(self.journal.records.keys())
         
-        
\ No newline at end of file
+        records = self.journal.records
+        self.duplicates = {image_path: canonical for image_path, canonical in duplicates.items()
+                           if image_path in records and canonical in records}
+        save_duplicates(self.duplicates_file, self.duplicates)
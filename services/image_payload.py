@@ -0,0 +1,101 @@
+import io
+import os
+import base64
+import hashlib
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+# 输出格式 -> (Pillow格式名, MIME类型, 扩展名)
+PAYLOAD_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", ".jpg"),
+    "webp": ("WEBP", "image/webp", ".webp"),
+    "png": ("PNG", "image/png", ".png"),
+}
+# 视觉模型可以直接接收的原图格式（GIF仅限静态图）
+SOURCE_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+MIME_EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/webp": ".webp", "image/gif": ".gif"}
+
+
+class ImagePayload(NamedTuple):
+    data: bytes
+    mime_type: str
+    original_bytes: int
+
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+def encode_payload(content: bytes, max_edge: int, image_format: str = "webp", quality: int = 80) -> Tuple[bytes, str]:
+    """将原图缩放到最长边不超过 max_edge 并重新编码，返回 (图片数据, MIME类型)
+
+    动图取中间一帧作为代表帧；原图是静态的、尺寸已足够小且比重新编码的结果更小时直接使用原图。
+    """
+    from PIL import Image, ImageOps
+    pil_format, mime_type, _ = PAYLOAD_FORMATS[image_format]
+    with Image.open(io.BytesIO(content)) as image:
+        source_format = image.format
+        animated = getattr(image, "is_animated", False)
+        if animated:
+            image.seek(image.n_frames // 2)
+        fits = max(image.size) <= max_edge
+        image.draft("RGB", (max_edge, max_edge))
+        frame = ImageOps.exif_transpose(image)
+        has_alpha = frame.mode in ("RGBA", "LA", "PA") or "transparency" in frame.info
+        frame = frame.convert("RGBA" if has_alpha else "RGB")
+    frame.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    if has_alpha and pil_format == "JPEG":
+        background = Image.new("RGB", frame.size, (255, 255, 255))
+        background.paste(frame, mask=frame.getchannel("A"))
+        frame = background
+
+    buffer = io.BytesIO()
+    frame.save(buffer, format=pil_format, quality=quality, optimize=pil_format != "WEBP")
+    data = buffer.getvalue()
+    if not animated and fits and source_format in SOURCE_MIME_TYPES and len(content) <= len(data):
+        return content, SOURCE_MIME_TYPES[source_format]
+    return data, mime_type
+
+
+class ImagePayloadCache:
+    """以内容哈希为键缓存预处理后的图片，同一张图片重复描述时不再解码与编码
+
+    缓存文件名由原图内容哈希与预处理参数组成，扩展名即发送时使用的格式。
+    """
+    def __init__(self, cache_dir: str, max_edge: int = 1024, image_format: str = "webp", quality: int = 80):
+        if image_format not in PAYLOAD_FORMATS:
+            raise ValueError(f"不支持的图片格式: {image_format}，可选: {', '.join(PAYLOAD_FORMATS)}")
+        self.cache_dir = cache_dir
+        self.max_edge = max_edge
+        self.image_format = image_format
+        self.quality = quality
+
+    def _cache_stem(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2],
+                            f"{digest}_{self.max_edge}_{self.image_format}_{self.quality}")
+
+    def _load(self, stem: str) -> Optional[Tuple[bytes, str]]:
+        for mime_type, extension in MIME_EXTENSIONS.items():
+            try:
+                with open(stem + extension, "rb") as f:
+                    return f.read(), mime_type
+            except OSError:
+                continue
+        return None
+
+    def get(self, image_path: str) -> ImagePayload:
+        """读取本地图片并返回预处理后的数据，命中缓存时只需读取原图计算哈希"""
+        with open(image_path, "rb") as f:
+            content = f.read()
+        stem = self._cache_stem(hashlib.blake2b(content, digest_size=16).hexdigest())
+        cached = self._load(stem)
+        if cached is not None:
+            return ImagePayload(cached[0], cached[1], len(content))
+
+        data, mime_type = encode_payload(content, self.max_edge, self.image_format, self.quality)
+        path = stem + MIME_EXTENSIONS[mime_type]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return ImagePayload(data, mime_type, len(content))
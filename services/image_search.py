@@ -1,12 +1,30 @@
 import os
+import re
+import time
+import contextvars
 import numpy as np
-import pickle
-from typing import Optional, List, Dict
-from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional, List
 from rich import print
 from config.settings import Config
+from services.client_pool import get_openai_client
 from services.embedding_service import EmbeddingService
+from services.embedding_cache import EmbeddingCache
+from services.embedding_store import EmbeddingStore
+from services.similarity import normalize
+from services.vector_index import build_vector_index
+from services.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from services.query_cache import get_query_cache, normalize_query
+from services.metrics import API_REQUESTS, record_stage, record_usage, span
 from services.image_description_database import ImageDescriptionDatabase
+from services.search_modes import HYBRID_RETRIEVERS, SEARCH_MODES
+
+# 查询理解提示词，修改提示词时需要同步更新版本号，使旧的缓存结果失效
+QUERY_UNDERSTANDING_PROMPT_VERSION = 1
+QUERY_UNDERSTANDING_PROMPT = "你是一个了解各种表情包（meme）的专家。请帮助用户理解他们的查询意图，描述他们可能感兴趣的smeme的含义。"
+
+# LLM排序结果的一行：`1-索引-推荐原因`，容忍全角连字符与多余空白
+RESULT_LINE_PATTERN = re.compile(r"^\s*\d+\s*[-－—]\s*(\d+)\s*[-－—:：]\s*(.+)$")
 
 
 class ImageSearch:
@@ -19,10 +37,12 @@ class ImageSearch:
                  search_model=None,
                  search_base_url=None,
                  use_embedding_search=False,
+                 search_mode=None,
                  use_query_understanding=None,
                  embedding_api_key=None,
                  embedding_base_url=None,
-                 embedding_model=None):
+                 embedding_model=None,
+                 image_description_database: Optional[ImageDescriptionDatabase] = None):
         self.local_image_folder = Config.LOCAL_IMAGE_FOLDER
         self.web_url_file = Config.WEB_URL_FILE
         self.database_file = Config.DATABASE_FILE
@@ -36,30 +56,64 @@ class ImageSearch:
         self.search_api_key = search_api_key or Config.SEARCH_API_KEY
         self.search_model = search_model or Config.SEARCH_MODEL
         self.search_base_url = search_base_url or Config.SEARCH_BASE_URL
-        self.use_embedding_search = use_embedding_search
+        # 未指定搜索模式时沿用旧的 use_embedding_search 开关
+        self.search_mode = search_mode or ("embedding" if use_embedding_search else "llm")
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"未知的搜索模式: {self.search_mode}")
+        self.hybrid_candidates = int(Config.HYBRID_CANDIDATES)
+        self.hybrid_retriever = Config.HYBRID_RETRIEVER
+        if self.hybrid_retriever not in HYBRID_RETRIEVERS:
+            raise ValueError(f"未知的混合搜索召回方式: {self.hybrid_retriever}")
+        retriever = self.hybrid_retriever if self.search_mode == "hybrid" else self.search_mode
+        self.use_embedding_search = retriever in ("embedding", "fusion")
+        self.use_lexical_search = retriever in ("bm25", "fusion")
+        self.shard_token_budget = int(Config.SHARD_TOKEN_BUDGET)
+        self.shard_count = int(Config.SHARD_COUNT)
+        self.shard_max_workers = int(Config.SHARD_MAX_WORKERS)
+        self.shard_top_k = int(Config.SHARD_TOP_K)
         self.use_query_understanding = use_query_understanding if use_query_understanding is not None else Config.USE_QUERY_UNDERSTANDING
         
-        self.image_description_database = ImageDescriptionDatabase(
-            local_image_folder=self.local_image_folder,
-            web_url_file=self.web_url_file,
-            database_file=self.database_file,
-            index_file=self.index_file,
-            image_describe_api_key=self.image_describe_api_key,
-            image_describe_base_url=self.image_describe_base_url,
-            image_describe_model=self.image_describe_model,
-            image_describe_request_delay=self.image_describe_request_delay
-        )
-        self.image_description_database.construct_image_description_database()
+        if image_description_database is None:
+            # 未传入共享的数据库时自行构建
+            image_description_database = ImageDescriptionDatabase(
+                local_image_folder=self.local_image_folder,
+                web_url_file=self.web_url_file,
+                database_file=self.database_file,
+                index_file=self.index_file,
+                image_describe_api_key=self.image_describe_api_key,
+                image_describe_base_url=self.image_describe_base_url,
+                image_describe_model=self.image_describe_model,
+                image_describe_request_delay=self.image_describe_request_delay
+            )
+            image_description_database.construct_image_description_database()
+        self.image_description_database = image_description_database
+        
+        # 参与检索的库中位置：折叠近似重复时只保留每组的代表图片
+        self.collapse_duplicates = Config.COLLAPSE_DUPLICATES
+        duplicates = image_description_database.duplicates if self.collapse_duplicates else {}
+        self.search_positions = [i for i, idx in enumerate(image_description_database.index_list)
+                                 if idx not in duplicates]
         
         self._client = None
+        self.query_cache = get_query_cache()
         
+        self.embedding_model = embedding_model or Config.EMBEDDING_MODEL
         if self.use_embedding_search:
             self.embedding_service = EmbeddingService(
                 api_key=embedding_api_key or Config.EMBEDDING_API_KEY,
                 base_url=embedding_base_url or Config.EMBEDDING_BASE_URL,
-                model=embedding_model or Config.EMBEDDING_MODEL
+                model=self.embedding_model
+            )
+            self.embedding_store = self._load_or_create_embeddings()
+            self.vector_index = build_vector_index(
+                self.embedding_store,
+                kind=Config.VECTOR_INDEX,
+                nlist=Config.IVF_NLIST,
+                nprobe=Config.IVF_NPROBE,
+                min_vectors=Config.IVF_MIN_VECTORS
             )
-            self.embeddings_cache = self._load_or_create_embeddings()
+        if self.use_lexical_search:
+            self.lexical_index = self._load_or_create_lexical_index()
 
     @property
     def client(self):
@@ -67,127 +121,435 @@ class ImageSearch:
         if self._client is None:
             if not self.search_api_key:
                 raise ValueError("搜索API密钥未设置")
-            self._client = OpenAI(api_key=self.search_api_key, base_url=self.search_base_url)
+            self._client = get_openai_client(self.search_api_key, self.search_base_url)
         return self._client
 
+    def _image_path(self, image_id: str) -> str:
+        """将库中的图片id转换为可展示的路径或URL"""
+        return self.image_description_database.resolve_image_path(image_id)
+
     def _get_embedding_dir(self) -> str:
-        """获取当前embedding模型的缓存目录"""
-        model_name = Config.EMBEDDING_MODEL.replace('/', '_')
+        """获取当前embedding模型的存储目录"""
+        model_name = self.embedding_model.replace('/', '_')
         embedding_dir = os.path.join(Config.EMBEDDING_DATABASE_DIR, model_name)
         os.makedirs(embedding_dir, exist_ok=True)
         return embedding_dir
 
-    def _get_embedding_path(self, image_id: str) -> str:
-        """获取特定图片的embedding缓存文件路径"""
-        return os.path.join(self._get_embedding_dir(), f"{image_id}.pkl")
-
-    def _load_or_create_embeddings(self) -> Dict[str, np.ndarray]:
-        """加载或创建embeddings缓存"""
-        embeddings = {}
-        embedding_dir = self._get_embedding_dir()
+    def _load_or_create_embeddings(self) -> EmbeddingStore:
+        """加载embedding缓存，只为缓存中没有的描述文本请求embedding，并建立图片到矩阵行的映射"""
+        cache = EmbeddingCache(self._get_embedding_dir(), self.embedding_model, gc_max_age=Config.EMBEDDING_GC_MAX_AGE)
+        cache.load()
         
-        for desc, idx in zip(self.image_description_database.database_list, 
-                           self.image_description_database.index_list):
-            embedding_path = self._get_embedding_path(idx)
-            
-            # 尝试加载现有的embedding
-            if os.path.exists(embedding_path):
-                try:
-                    with open(embedding_path, 'rb') as f:
-                        embeddings[idx] = pickle.load(f)
-                    continue
-                except Exception as e:
-                    print(f"加载embedding缓存失败 [{idx}]: {e}")
-            
-            # 如果加载失败或文件不存在，创建新的embedding
+        # 按描述文本寻址：重命名、移动与近似重复的图片直接命中，重新描述过的图片得到新的文本键
+        index_list = self.image_description_database.index_list
+        database_list = self.image_description_database.database_list
+        missing = list(cache.update([index_list[i] for i in self.search_positions],
+                                    [database_list[i] for i in self.search_positions]).items())
+        
+        # 缓存中不存在的文本按批请求embedding，每批一次请求
+        for batch in self.embedding_service.split_batches([text for _, text in missing]):
             try:
-                embedding = self.embedding_service.get_embedding(desc)
-                embeddings[idx] = embedding
-                # 保存新生成的embedding
-                with open(embedding_path, 'wb') as f:
-                    pickle.dump(embedding, f)
+                embeddings = self.embedding_service.get_embeddings([missing[i][1] for i in batch])
+                cache.add([missing[i][0] for i in batch], embeddings)
             except Exception as e:
-                print(f"生成embedding失败 [{idx}]: {e}")
+                print(f"生成embedding失败 ({missing[batch[0]][1][:20]} 等{len(batch)}项): {e}")
+        cache.save()
+        self.embedding_cache = cache
+        store = cache.store
         
-        return embeddings
+        # 仅对当前库中参与检索的图片打分：记录每张图片在库中的位置与在矩阵中的行号
+        rows = [cache.row_of(index_list[i]) for i in self.search_positions]
+        self.embedding_positions = np.array([i for i, row in zip(self.search_positions, rows) if row is not None],
+                                            dtype=np.int64)
+        self.embedding_ids = [index_list[i] for i in self.embedding_positions]
+        self.embedding_rows = np.array([row for row in rows if row is not None], dtype=np.int64)
+        # 描述相同的图片共用一行：按行号排序的 embedding_ids 下标，以及每一行在其中的起止位置
+        self._row_order = np.argsort(self.embedding_rows, kind="stable")
+        self._row_starts = np.searchsorted(self.embedding_rows[self._row_order], np.arange(len(store) + 1))
+        return store
 
-    def _cosine_similarity(self, a: np.ndarray, b: np.ndarray) -> float:
-        """计算余弦相似度"""
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    def _load_or_create_lexical_index(self) -> LexicalIndex:
+        """加载BM25索引并与参与检索的图片同步，只对新增或变化的图片重新分词"""
+        lexical_index = LexicalIndex(Config.LEXICAL_INDEX_DIR)
+        lexical_index.load()
+        index_list = self.image_description_database.index_list
+        database_list = self.image_description_database.database_list
+        if lexical_index.sync([index_list[i] for i in self.search_positions],
+                              [database_list[i] for i in self.search_positions]):
+            lexical_index.save()
+        # BM25索引中的行号 -> 库中位置
+        self.lexical_positions = np.array(self.search_positions, dtype=np.int64)
+        return lexical_index
 
-    def _embedding_search(self, query: str, top_k: int = 5) -> tuple[List[str], List[str]]:
-        """使用embedding进行搜索"""
-        if self.use_query_understanding:
-            # 使用chat模型理解查询
-            messages = [
-                {"role": "system", "content": "你是一个了解各种表情包（meme）的专家。请帮助用户理解他们的查询意图，描述他们可能感兴趣的smeme的含义。"},
-                {"role": "user", "content": query}
-            ]
-            
+    def _lexical_search(self, query: str, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """BM25检索，返回 (库中位置, 得分)"""
+        with span("bm25_search"):
+            rows, scores = self.lexical_index.search(query, top_k)
+        return self.lexical_positions[rows], scores
+
+    def _embedding_top_k(self, query_embedding, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """通过向量索引检索最相似的top_k张图片，返回 (embedding_ids中的下标, 相似度)"""
+        # 存储中的向量已归一化，只需归一化查询向量；多取出不被当前库引用的行数，保证过滤后仍有top_k条
+        counts = np.diff(self._row_starts)
+        extra = int(np.count_nonzero(counts == 0))
+        with span("vector_search", index=self.vector_index.name):
+            rows, scores = self.vector_index.search(normalize(query_embedding), top_k + extra)
+        return self._expand_rows(counts, rows, scores, top_k)
+
+    def _embedding_top_k_many(self, query_embeddings: np.ndarray, top_k: int) -> List[tuple[np.ndarray, np.ndarray]]:
+        """批量版本的 _embedding_top_k，query_embeddings 的每一行为一个查询向量"""
+        counts = np.diff(self._row_starts)
+        extra = int(np.count_nonzero(counts == 0))
+        # 与 _embedding_top_k 相同地逐个归一化，保证同一查询得到完全相同的向量
+        query_embeddings = np.stack([normalize(embedding) for embedding in query_embeddings])
+        with span("vector_search", index=self.vector_index.name, count=len(query_embeddings)):
+            results = self.vector_index.search_many(query_embeddings, top_k + extra)
+        return [self._expand_rows(counts, rows, scores, top_k) for rows, scores in results]
+
+    def _expand_rows(self, counts: np.ndarray, rows: np.ndarray, scores: np.ndarray,
+                     top_k: int) -> tuple[np.ndarray, np.ndarray]:
+        """把检索到的矩阵行展开为引用它的所有图片，跳过不被当前库引用的行"""
+        keep = counts[rows] > 0
+        rows, scores = rows[keep], scores[keep]
+        indices = [self._row_order[self._row_starts[row]:self._row_starts[row + 1]] for row in rows[:top_k]]
+        indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+        return indices[:top_k], np.repeat(scores[:top_k], counts[rows[:top_k]])[:top_k]
+
+    def _understand_query(self, query: str, persist: bool = True) -> str:
+        """使用chat模型理解查询，结果按 (搜索模型, 提示词版本, 查询) 缓存，persist 为False时只写入内存层"""
+        cache_key = ("rewrite", self.search_model, QUERY_UNDERSTANDING_PROMPT_VERSION, normalize_query(query))
+        rewritten = self.query_cache.get(cache_key)
+        if rewritten is not None:
+            return rewritten
+        
+        messages = [
+            {"role": "system", "content": QUERY_UNDERSTANDING_PROMPT},
+            {"role": "user", "content": query}
+        ]
+        
+        with span("query_understanding"):
             response = self.client.chat.completions.create(
                 model=self.search_model,
                 messages=messages,
                 temperature=0.3
             )
-            
-            query = response.choices[0].message.content
-            print(f"Query understanding: {query}")
+        record_usage("search", response)
         
-        # 获取query的embedding
-        query_embedding = self.embedding_service.get_embedding(query)
+        rewritten = response.choices[0].message.content
+        print(f"Query understanding: {rewritten}")
+        self.query_cache.set(cache_key, rewritten, persist)
+        return rewritten
+
+    def _get_query_embedding(self, query: str, persist: bool = True) -> np.ndarray:
+        """获取查询的embedding，结果按 (embedding模型, 规范化查询) 缓存，persist 为False时只写入内存层"""
+        cache_key = ("embedding", self.embedding_model, normalize_query(query))
+        embedding = self.query_cache.get(cache_key)
+        if embedding is None:
+            with span("query_embedding"):
+                embedding = normalize(self.embedding_service.get_embedding(query))
+            self.query_cache.set(cache_key, embedding, persist)
+        return embedding
+
+    def _get_query_embeddings(self, queries: List[str], persist: bool = True) -> np.ndarray:
+        """批量获取多个查询的embedding：命中缓存的直接使用，其余按规范化的查询去重后合并为批量请求
+
+        新的embedding在一个事务中写入查询缓存，persist 为False时只写入内存层。
+        """
+        keys = [("embedding", self.embedding_model, normalize_query(query)) for query in queries]
+        embeddings = [self.query_cache.get(key) for key in keys]
+        missing = {}
+        for query, key, embedding in zip(queries, keys, embeddings):
+            if embedding is None:
+                missing.setdefault(key, query)
+        if missing:
+            with span("query_embedding", count=len(missing)):
+                vectors = self.embedding_service.get_embeddings(list(missing.values()))
+            fetched = {key: normalize(vector) for key, vector in zip(missing, vectors)}
+            self.query_cache.set_many(fetched.items(), persist)
+            embeddings = [fetched[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        if not embeddings:
+            return np.zeros((0, self.embedding_store.dim), dtype=np.float32)
+        return np.stack(embeddings).astype(np.float32, copy=False)
+
+    def _embedding_results(self, top_indices: np.ndarray, scores: np.ndarray) -> tuple[List[str], List[str]]:
+        result_images = [self._image_path(self.embedding_ids[i]) for i in top_indices]
+        result_reasons = [f"相似度: {score:.2f}" for score in scores]
+        return result_images, result_reasons
+
+    def _embedding_search(self, query: str, top_k: int = 5, persist: bool = True) -> tuple[List[str], List[str]]:
+        """使用embedding进行搜索"""
+        if self.use_query_understanding:
+            query = self._understand_query(query, persist)
         
-        # 计算相似度
-        similarities = []
-        for idx, embedding in self.embeddings_cache.items():
-            sim = self._cosine_similarity(query_embedding, embedding)
-            similarities.append((idx, sim))
+        # 获取query的embedding
+        query_embedding = self._get_query_embedding(query, persist)
         
-        # 排序获取top_k
-        similarities.sort(key=lambda x: x[1], reverse=True)
-        top_k_results = similarities[:top_k]
+        # 通过向量索引获取top_k
+        top_indices, scores = self._embedding_top_k(query_embedding, top_k)
         
         # 准备返回结果
-        result_images = [os.path.join(self.local_image_folder, idx) for idx, _ in top_k_results]
-        result_reasons = [f"相似度: {sim:.2f}" for _, sim in top_k_results]
-        
-        return result_images, result_reasons
+        return self._embedding_results(top_indices, scores)
         
-    def search(self, query: str, top_k: int = 5) -> tuple[List[str], List[str]]:
-        """搜索接口，支持两种搜索模式"""
-        if self.use_embedding_search:
-            return self._embedding_search(query, top_k)
+    def _llm_rank_messages(self, query: str, candidate_positions: List[int], top_k: int) -> List[dict]:
+        """构造LLM排序的提示词，编号为候选列表内的局部编号（从1开始）"""
+        database_list = self.image_description_database.database_list
+        database_str = ""
+        for i, position in enumerate(candidate_positions):
+            database_str += f"{i+1}. {database_list[position]}\n"
+
+        return [
+            {"role": "system", "content": "You are a helpful assistant that can find the most relevant meme from the database to match the query."},
+            {"role": "user", "content": f"问题: {query}\n数据库: {database_str}\n请返回{top_k}个最相关表情包的索引。注意输出格式需要格式化为如下的格式：\n1-索引-推荐原因\n..."}
+        ]
+
+    @staticmethod
+    def _parse_result_line(line: str, num_candidates: int) -> Optional[tuple[int, str]]:
+        """容错地解析一行 `1-索引-推荐原因`，返回 (局部编号, 推荐原因)，无法解析时返回None"""
+        match = RESULT_LINE_PATTERN.match(line.replace("*", ""))
+        if match is None:
+            return None
+        index = int(match.group(1))
+        if not 1 <= index <= num_candidates:
+            return None
+        return index, match.group(2).strip()
+
+    def _llm_rank_positions(self, query: str, candidate_positions: List[int], top_k: int) -> tuple[List[int], List[str]]:
+        """将候选描述交给LLM排序，返回最相关的top_k个库中位置及推荐原因
         
-        else:
-            # 原有的基于LLM的搜索逻辑
-            database_list = self.image_description_database.database_list
-            database_str = ""
-            for i, description in enumerate(database_list):
-                database_str += f"{i+1}. {description}\n"
-
-            messages = [
-                {"role": "system", "content": "You are a helpful assistant that can find the most relevant meme from the database to match the query."},
-                {"role": "user", "content": f"问题: {query}\n数据库: {database_str}\n请返回{top_k}个最相关表情包的索引。注意输出格式需要格式化为如下的格式：\n1-索引-推荐原因\n..."}
-            ]
-            
+        提示词中的编号是候选列表内的局部编号，解析后映射回库中的原始位置；格式错误的行会被跳过。
+        """
+        with span("llm_generation", candidates=len(candidate_positions)):
             response = self.client.chat.completions.create(
                 model=self.search_model,
-                messages=messages,
+                messages=self._llm_rank_messages(query, candidate_positions, top_k),
                 temperature=0.5
             )
+        record_usage("search", response)
+        
+        response_content = response.choices[0].message.content or ""
+        result_position_list = []
+        result_reason_list = []
+        with span("llm_parse"):
+            for line in response_content.split("\n"):
+                parsed = self._parse_result_line(line, len(candidate_positions))
+                if parsed is None or candidate_positions[parsed[0] - 1] in result_position_list:
+                    continue
+                result_position_list.append(candidate_positions[parsed[0] - 1])
+                result_reason_list.append(parsed[1])
+        
+        return result_position_list[:top_k], result_reason_list[:top_k]
+
+    def _llm_rank_stream(self, query: str, candidate_positions: List[int], top_k: int) -> Iterator[tuple[str, str]]:
+        """流式地让LLM排序，每解析出完整的一行就产出 (图片路径, 推荐原因)"""
+        start = time.perf_counter()
+        stream = self.client.chat.completions.create(
+            model=self.search_model,
+            messages=self._llm_rank_messages(query, candidate_positions, top_k),
+            temperature=0.5,
+            stream=True
+        )
+        API_REQUESTS.inc(service="search")
+        
+        index_list = self.image_description_database.index_list
+        seen = set()
+        buffer = ""
+        
+        def parse_lines(lines):
+            for line in lines:
+                parsed = self._parse_result_line(line, len(candidate_positions))
+                if parsed is None or parsed[0] in seen or len(seen) >= top_k:
+                    continue
+                seen.add(parsed[0])
+                yield self._image_path(index_list[candidate_positions[parsed[0] - 1]]), parsed[1]
+        
+        # 只统计等待模型输出的时间，不包含调用方在两次产出之间渲染结果的时间
+        waited = 0.0
+        first_chunk = True
+        chunks = iter(stream)
+        while True:
+            wait_start = time.perf_counter()
+            chunk = next(chunks, None)
+            waited += time.perf_counter() - wait_start
+            if first_chunk:
+                record_stage("llm_first_token", start, time.perf_counter() - start)
+                first_chunk = False
+            if chunk is None:
+                break
+            if not chunk.choices:
+                continue
+            buffer += chunk.choices[0].delta.content or ""
+            # 只解析已经完整的行，最后一段留到下一个chunk
+            *lines, buffer = buffer.split("\n")
+            yield from parse_lines(lines)
+        record_stage("llm_generation", start, waited, candidates=len(candidate_positions))
+        yield from parse_lines([buffer])
+
+    def _llm_rank(self, query: str, candidate_positions: List[int], top_k: int) -> tuple[List[str], List[str]]:
+        """将候选描述交给LLM排序，返回最相关的top_k张图片及推荐原因"""
+        positions, reasons = self._llm_rank_positions(query, candidate_positions, top_k)
+        index_list = self.image_description_database.index_list
+        return [self._image_path(index_list[position]) for position in positions], reasons
+
+    def _make_shards(self, positions: List[int]) -> List[List[int]]:
+        """按token预算（或指定的分片数）将若干库中位置划分为分片"""
+        if self.shard_count > 0:
+            shard_size = max(1, -(-len(positions) // self.shard_count))
+            return [positions[i:i + shard_size] for i in range(0, len(positions), shard_size)]
+        
+        database_list = self.image_description_database.database_list
+        shards, shard, shard_tokens = [], [], 0
+        for position in positions:
+            tokens = EmbeddingService.estimate_tokens(database_list[position])
+            if shard and shard_tokens + tokens > self.shard_token_budget:
+                shards.append(shard)
+                shard, shard_tokens = [], 0
+            shard.append(position)
+            shard_tokens += tokens
+        if shard:
+            shards.append(shard)
+        return shards
+
+    def _sharded_llm_candidates(self, query: str, top_k: int = 5) -> List[int]:
+        """分片LLM搜索的归并阶段：各分片并发选出局部top-k，再对胜出者进行合并轮次，直到剩下一个分片"""
+        positions = list(self.search_positions)
+        shard_top_k = max(top_k, self.shard_top_k)
+        shards = self._make_shards(positions)
+        
+        # 锦标赛式归并：每一轮的胜出者仍放不进一个分片时继续分片，直到只剩一个分片
+        with ThreadPoolExecutor(max_workers=self.shard_max_workers) as executor:
+            while len(shards) > 1:
+                # 每个任务在当前上下文的副本中运行，分片的耗时也会记入本次查询
+                futures = [executor.submit(contextvars.copy_context().run, self._llm_rank_positions,
+                                           query, shard, shard_top_k) for shard in shards]
+                winners, seen = [], set()
+                for future in futures:
+                    try:
+                        shard_positions, _ = future.result()
+                    except Exception as e:
+                        print(f"分片搜索失败: {e}")
+                        continue
+                    for position in shard_positions:
+                        if position not in seen:
+                            seen.add(position)
+                            winners.append(position)
+                if not winners:
+                    raise RuntimeError("所有分片搜索均失败")
+                next_shards = self._make_shards(winners)
+                if len(next_shards) >= len(shards):
+                    # 胜出者数量无法继续收敛时，直接在全部胜出者上做最终排序
+                    next_shards = [winners]
+                shards = next_shards
+        
+        return shards[0]
+
+    def _sharded_llm_search(self, query: str, top_k: int = 5) -> tuple[List[str], List[str]]:
+        """分片LLM搜索：在最后剩下的分片上进行最终排序"""
+        return self._llm_rank(query, self._sharded_llm_candidates(query, top_k), top_k)
+
+    def _embedding_candidates(self, query: str, top_k: int, persist: bool = True) -> List[int]:
+        """用embedding召回最相似的top_k个库中位置"""
+        candidate_query = self._understand_query(query, persist) if self.use_query_understanding else query
+        top_indices, _ = self._embedding_top_k(self._get_query_embedding(candidate_query, persist), top_k)
+        return [int(self.embedding_positions[i]) for i in top_indices]
+
+    def _bm25_search(self, query: str, top_k: int = 5) -> tuple[List[str], List[str]]:
+        """本地BM25关键词搜索，不需要任何远程调用"""
+        positions, scores = self._lexical_search(query, top_k)
+        index_list = self.image_description_database.index_list
+        result_images = [self._image_path(index_list[p]) for p in positions]
+        result_reasons = [f"BM25: {score:.2f}" for score in scores]
+        return result_images, result_reasons
+
+    def _fused_candidates(self, query: str, top_k: int, persist: bool = True) -> List[tuple[int, float]]:
+        """用RRF融合BM25与embedding两路召回，返回 (库中位置, 融合得分)"""
+        depth = max(top_k, self.hybrid_candidates)
+        lexical_positions, _ = self._lexical_search(query, depth)
+        rankings = [lexical_positions.tolist(), self._embedding_candidates(query, depth, persist)]
+        with span("rank_fusion"):
+            return reciprocal_rank_fusion(rankings)[:top_k]
+
+    def _fusion_search(self, query: str, top_k: int = 5, persist: bool = True) -> tuple[List[str], List[str]]:
+        """融合搜索：BM25与embedding排序按倒数排名融合"""
+        fused = self._fused_candidates(query, top_k, persist)
+        index_list = self.image_description_database.index_list
+        result_images = [self._image_path(index_list[p]) for p, _ in fused]
+        result_reasons = [f"融合得分: {score:.4f}" for _, score in fused]
+        return result_images, result_reasons
+
+    def _hybrid_candidates(self, query: str, top_k: int = 5, persist: bool = True) -> List[int]:
+        """混合搜索的召回阶段：按配置用embedding、BM25或两者融合选出候选的库中位置"""
+        depth = max(top_k, self.hybrid_candidates)
+        if self.hybrid_retriever == "bm25":
+            return self._lexical_search(query, depth)[0].tolist()
+        if self.hybrid_retriever == "fusion":
+            return [position for position, _ in self._fused_candidates(query, depth, persist)]
+        return self._embedding_candidates(query, depth, persist)
+
+    def _hybrid_search(self, query: str, top_k: int = 5, persist: bool = True) -> tuple[List[str], List[str]]:
+        """两阶段搜索：先在本地召回候选，再只把候选交给LLM重排并给出推荐原因"""
+        return self._llm_rank(query, self._hybrid_candidates(query, top_k, persist), top_k)
+        
+    def search(self, query: str, top_k: int = 5) -> tuple[List[str], List[str]]:
+        """搜索接口，支持LLM、分片LLM、Embedding、BM25、融合与混合搜索模式"""
+        with span("search", mode=self.search_mode):
+            return self._search(query, top_k)
+
+    def search_many(self, queries: List[str], top_k: int = 5,
+                    persist: bool = True) -> List[tuple[List[str], List[str]]]:
+        """批量搜索，结果与逐个调用 search 相同（矩阵乘法的舍入可能使分数几乎相等的结果交换位置）
+        
+        embedding模式下查询的embedding合并为少数几次批量请求，全部查询与库中向量的打分由分块的矩阵乘法完成；
+        其他使用embedding召回的模式预先批量获取查询的embedding，再逐个搜索。
+        persist 为False时查询理解与查询embedding都不写入磁盘缓存，适合几乎不会重复的离线批量任务。
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        with span("search_many", mode=self.search_mode, count=len(queries)):
+            if self.search_mode != "embedding":
+                if self.use_embedding_search:
+                    # 预先批量获取并写入缓存，逐个搜索时直接命中
+                    rewritten = queries
+                    if self.use_query_understanding:
+                        rewritten = [self._understand_query(query, persist) for query in queries]
+                    self._get_query_embeddings(rewritten, persist)
+                return [self._search(query, top_k, persist) for query in queries]
             
-            response_content = response.choices[0].message.content
-            response_list = response_content.split("\n")
-            result_index_list = []
-            result_reason_list = []
-            for i in response_list:
-                print(i)
-                index = int(i.split("-")[1])
-                reason = i.split("-")[2]
-                result_index_list.append(index)
-                result_reason_list.append(reason)
-            
-            index_list = self.image_description_database.index_list
-            result_image_list = [os.path.join(self.local_image_folder, index_list[i-1]) for i in result_index_list]
-            
-            return result_image_list, result_reason_list
-        
\ No newline at end of file
+            if self.use_query_understanding:
+                queries = [self._understand_query(query, persist) for query in queries]
+            query_embeddings = self._get_query_embeddings(queries, persist)
+            return [self._embedding_results(top_indices, scores)
+                    for top_indices, scores in self._embedding_top_k_many(query_embeddings, top_k)]
+
+    def _search(self, query: str, top_k: int = 5, persist: bool = True) -> tuple[List[str], List[str]]:
+        if self.search_mode == "embedding":
+            return self._embedding_search(query, top_k, persist)
+        
+        if self.search_mode == "bm25":
+            return self._bm25_search(query, top_k)
+        
+        if self.search_mode == "fusion":
+            return self._fusion_search(query, top_k, persist)
+        
+        if self.search_mode == "hybrid":
+            return self._hybrid_search(query, top_k, persist)
+        
+        if self.search_mode == "sharded_llm":
+            return self._sharded_llm_search(query, top_k)
+        
+        # 原有的基于LLM的搜索逻辑：把整个库交给LLM
+        return self._llm_rank(query, list(self.search_positions), top_k)
+
+    def search_stream(self, query: str, top_k: int = 5) -> Iterator[tuple[str, str]]:
+        """流式搜索接口，逐个产出 (图片路径, 推荐原因)
+        
+        LLM参与最终排序的模式会在LLM输出每一行后立即产出对应结果，其余模式一次性产出全部结果。
+        """
+        if self.search_mode in ("embedding", "bm25", "fusion"):
+            yield from zip(*self.search(query, top_k))
+        elif self.search_mode == "hybrid":
+            yield from self._llm_rank_stream(query, self._hybrid_candidates(query, top_k), top_k)
+        elif self.search_mode == "sharded_llm":
+            yield from self._llm_rank_stream(query, self._sharded_llm_candidates(query, top_k), top_k)
+        else:
+            yield from self._llm_rank_stream(query, list(self.search_positions), top_k)
@@ -0,0 +1,228 @@
+import io
+import os
+import re
+import hashlib
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Tuple
+from urllib.parse import unquote, urlparse
+from services.similarity import top_k_indices
+
+# 连续的文字/数字片段，Python的 \w 同时覆盖中文
+TOKEN_PATTERN = re.compile(r"\w+")
+NGRAM_SIZES = (2, 3)
+
+
+def tokenize(text: str) -> List[str]:
+    """将文本切分为字符二元组与三元组，单字片段保留为单字"""
+    tokens = []
+    for run in TOKEN_PATTERN.findall(text.lower()):
+        if len(run) == 1:
+            tokens.append(run)
+            continue
+        for n in NGRAM_SIZES:
+            tokens.extend(run[i:i + n] for i in range(len(run) - n + 1))
+    return tokens
+
+
+def caption_of(image_id: str) -> str:
+    """从图片id中取出文件名作为配文，本地图片与网络图片的文件名往往就是表情包上的文字"""
+    path = urlparse(image_id).path if image_id.startswith(("http://", "https://")) else image_id
+    return os.path.splitext(os.path.basename(unquote(path)))[0]
+
+
+class _FieldPostings:
+    """单个字段的倒排表：按词排列的文档号与预先计算好的BM25得分"""
+    def __init__(self, offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray):
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+
+
+class LexicalIndex:
+    """基于字符n-gram倒排表与BM25打分的本地关键词检索
+
+    对配文（文件名）与描述两个字段分别建倒排表，文档号即图片在库中的位置。
+    每篇文档的词频以文档为主序（CSR）保存在单个npz文件中，并记录内容摘要；
+    重新加载时只对新增或内容变化的图片分词，倒排表由文档词频向量化地重建。
+    """
+    FIELDS = ("caption", "description")
+    FIELD_WEIGHTS = {"caption": 2.0, "description": 1.0}
+    K1 = 1.2
+    B = 0.75
+    INDEX_FILE = "lexical_index.npz"
+    FORMAT_VERSION = 1
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        self.ids: List[str] = []
+        self.vocab: List[str] = []
+        self.term_to_id: Dict[str, int] = {}
+        self.digests = np.zeros(0, dtype=np.uint64)
+        # 字段 -> (文档偏移, 词id, 词频)，文档主序
+        self.doc_terms: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {
+            field: self._empty_field() for field in self.FIELDS
+        }
+        self.postings: Dict[str, _FieldPostings] = {}
+
+    @staticmethod
+    def _empty_field() -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.index_dir, self.INDEX_FILE)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @staticmethod
+    def _digest(image_id: str, description: str) -> int:
+        digest = hashlib.blake2b(f"{image_id}\n{description}".encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    @staticmethod
+    def _join(lines: List[str]) -> np.ndarray:
+        return np.frombuffer("\n".join(lines).encode("utf-8"), dtype=np.uint8)
+
+    @staticmethod
+    def _split(data: np.ndarray, count: int) -> List[str]:
+        return data.tobytes().decode("utf-8").split("\n")[:count] if count else []
+
+    def load(self) -> bool:
+        """加载已保存的索引，不存在或格式不兼容时返回False"""
+        if not os.path.exists(self.index_path):
+            return False
+        with np.load(self.index_path) as data:
+            if int(data["format_version"]) != self.FORMAT_VERSION:
+                return False
+            self.ids = self._split(data["ids"], int(data["num_docs"]))
+            self.vocab = self._split(data["vocab"], int(data["num_terms"]))
+            self.digests = data["digests"]
+            for field in self.FIELDS:
+                self.doc_terms[field] = (data[f"{field}_offsets"], data[f"{field}_terms"],
+                                         data[f"{field}_tfs"].astype(np.float32))
+        self.term_to_id = {term: i for i, term in enumerate(self.vocab)}
+        self._build_postings()
+        return True
+
+    def save(self) -> None:
+        """原子地写入单个压缩的npz文件"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        arrays = {
+            "format_version": np.array(self.FORMAT_VERSION),
+            "num_docs": np.array(len(self.ids)),
+            "num_terms": np.array(len(self.vocab)),
+            "ids": self._join(self.ids),
+            "vocab": self._join(self.vocab),
+            "digests": self.digests,
+        }
+        for field in self.FIELDS:
+            offsets, terms, tfs = self.doc_terms[field]
+            arrays[f"{field}_offsets"] = offsets
+            arrays[f"{field}_terms"] = terms
+            # 词频以uint16保存，与词id一起压缩存储
+            arrays[f"{field}_tfs"] = np.minimum(tfs, np.iinfo(np.uint16).max).astype(np.uint16)
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, **arrays)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, self.index_path)
+
+    def _field_text(self, field: str, image_id: str, description: str) -> str:
+        return caption_of(image_id) if field == "caption" else description
+
+    def sync(self, image_ids: List[str], descriptions: List[str]) -> bool:
+        """与库对齐，文档号与库中位置一致；只对新增或变化的图片分词，返回是否有变化"""
+        digests = np.array([self._digest(i, d) for i, d in zip(image_ids, descriptions)], dtype=np.uint64)
+        if self.ids == list(image_ids) and np.array_equal(self.digests, digests):
+            return False
+
+        saved_rows = {image_id: row for row, image_id in enumerate(self.ids)}
+        vocab = list(self.vocab)
+        term_to_id = dict(self.term_to_id)
+        new_fields = {}
+        for field in self.FIELDS:
+            offsets, terms, tfs = self.doc_terms[field]
+            doc_terms, doc_tfs = [], []
+            for image_id, description, digest in zip(image_ids, descriptions, digests):
+                row = saved_rows.get(image_id)
+                if row is not None and self.digests[row] == digest:
+                    doc_terms.append(terms[offsets[row]:offsets[row + 1]])
+                    doc_tfs.append(tfs[offsets[row]:offsets[row + 1]])
+                    continue
+                counts = Counter(tokenize(self._field_text(field, image_id, description)))
+                ids = []
+                for term in counts:
+                    if term not in term_to_id:
+                        term_to_id[term] = len(vocab)
+                        vocab.append(term)
+                    ids.append(term_to_id[term])
+                doc_terms.append(np.array(ids, dtype=np.int32))
+                doc_tfs.append(np.array(list(counts.values()), dtype=np.float32))
+            lengths = [len(t) for t in doc_terms]
+            new_fields[field] = (
+                np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+                np.concatenate(doc_terms).astype(np.int32) if doc_terms else np.zeros(0, dtype=np.int32),
+                np.concatenate(doc_tfs).astype(np.float32) if doc_tfs else np.zeros(0, dtype=np.float32),
+            )
+
+        # 丢弃已不再出现的词，重新编号使词表保持紧凑
+        used = np.unique(np.concatenate([new_fields[f][1] for f in self.FIELDS]))
+        remap = np.full(len(vocab), -1, dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        self.vocab = [vocab[i] for i in used]
+        self.term_to_id = {term: i for i, term in enumerate(self.vocab)}
+        self.doc_terms = {field: (offsets, remap[terms], tfs) for field, (offsets, terms, tfs) in new_fields.items()}
+        self.ids = list(image_ids)
+        self.digests = digests
+        self._build_postings()
+        return True
+
+    def _build_postings(self) -> None:
+        """由文档主序的词频向量化地构建倒排表，并预先计算每个(词, 文档)的BM25得分"""
+        num_docs = len(self.ids)
+        num_terms = len(self.vocab)
+        for field in self.FIELDS:
+            offsets, terms, tfs = self.doc_terms[field]
+            doc_ids = np.repeat(np.arange(num_docs, dtype=np.int32), np.diff(offsets))
+            doc_len = np.bincount(doc_ids, weights=tfs, minlength=num_docs)
+            avg_len = doc_len.mean() if num_docs and doc_len.mean() > 0 else 1.0
+            df = np.bincount(terms, minlength=num_terms)
+            idf = np.log1p((num_docs - df + 0.5) / (df + 0.5))
+            norm = self.K1 * (1 - self.B + self.B * doc_len[doc_ids] / avg_len)
+            weights = self.FIELD_WEIGHTS[field] * idf[terms] * tfs * (self.K1 + 1) / (tfs + norm)
+
+            order = np.argsort(terms, kind="stable")
+            self.postings[field] = _FieldPostings(
+                np.concatenate([[0], np.cumsum(df)]).astype(np.int64),
+                doc_ids[order],
+                weights[order].astype(np.float32),
+            )
+
+    def search(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回BM25得分最高的k个文档号（sync时传入的顺序）及其得分（降序），没有命中时返回空数组"""
+        query_terms = Counter(self.term_to_id[t] for t in tokenize(query) if t in self.term_to_id)
+        docs, weights = [], []
+        for postings in self.postings.values():
+            for term, count in query_terms.items():
+                start, end = postings.offsets[term], postings.offsets[term + 1]
+                docs.append(postings.docs[start:end])
+                weights.append(postings.weights[start:end] * count)
+        if not docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        matched, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights))
+        top = top_k_indices(scores, k)
+        return matched[top].astype(np.int64), scores[top]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """倒数排名融合（RRF）：按 sum(1 / (k + 名次)) 合并多个排序，返回 (文档, 得分) 降序列表"""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            fused[doc] = fused.get(doc, 0.0) + 1.0 / (k + rank)
+    # 得分相同时按首次出现的顺序，保证结果确定
+    return sorted(fused.items(), key=lambda item: -item[1])
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Tuple
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+
+
+@dataclass
+class LibraryChanges:
+    """一次扫描得到的表情包库变化"""
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    moved: List[Tuple[str, str]] = field(default_factory=list)  # (旧路径, 新路径)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.changed or self.moved or self.removed)
+
+
+class LibraryManifest:
+    """以内容哈希为键的本地表情包清单，用于增量识别新增、修改、移动与删除的图片
+
+    清单记录每张图片（相对路径）的哈希、大小与修改时间；大小与修改时间未变时直接沿用旧哈希，
+    只有新文件或被修改过的文件才需要重新计算哈希。
+    """
+    def __init__(self, manifest_file: str, image_folder: str, extensions=IMAGE_EXTENSIONS):
+        self.manifest_file = manifest_file
+        self.image_folder = image_folder
+        # 扩展名不区分大小写，统一为带点的小写形式
+        self.extensions = tuple("." + ext.strip().lower().lstrip(".") for ext in extensions if ext.strip())
+        self.entries: Dict[str, dict] = {}
+        self.previous_entries: Dict[str, dict] = {}
+        self.load()
+
+    def load(self) -> None:
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def save(self) -> None:
+        """原子地写入清单，内容未变化时跳过"""
+        if self.entries == self.previous_entries and os.path.exists(self.manifest_file):
+            return
+        os.makedirs(os.path.dirname(self.manifest_file) or ".", exist_ok=True)
+        tmp_path = self.manifest_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_file)
+
+    @staticmethod
+    def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+        """流式计算文件内容哈希"""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _walk(self, folder: str) -> Iterator[os.DirEntry]:
+        """用 os.scandir 流式遍历图片文件，支持子目录"""
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._walk(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(self.extensions):
+                    yield entry
+
+    def list_images(self) -> List[str]:
+        """只列出图片的相对路径，不读取文件内容"""
+        if not os.path.isdir(self.image_folder):
+            return []
+        return [os.path.relpath(entry.path, self.image_folder).replace(os.sep, "/")
+                for entry in self._walk(self.image_folder)]
+
+    def scan(self) -> Dict[str, dict]:
+        """扫描图片目录，返回 相对路径 -> {hash, size, mtime_ns}"""
+        scanned = {}
+        if not os.path.isdir(self.image_folder):
+            return scanned
+        for entry in self._walk(self.image_folder):
+            image_id = os.path.relpath(entry.path, self.image_folder).replace(os.sep, "/")
+            stat = entry.stat()
+            old = self.entries.get(image_id)
+            if old is not None and old["size"] == stat.st_size and old["mtime_ns"] == stat.st_mtime_ns:
+                file_hash = old["hash"]
+            else:
+                file_hash = self.file_hash(entry.path)
+            scanned[image_id] = {"hash": file_hash, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        return scanned
+
+    def diff(self, scanned: Dict[str, dict]) -> LibraryChanges:
+        """对比旧清单与扫描结果，划分新增、修改、移动与删除"""
+        changes = LibraryChanges()
+        removed = {image_id: entry["hash"] for image_id, entry in self.entries.items() if image_id not in scanned}
+        removed_by_hash: Dict[str, List[str]] = {}
+        for image_id, file_hash in removed.items():
+            removed_by_hash.setdefault(file_hash, []).append(image_id)
+
+        for image_id, entry in scanned.items():
+            old = self.entries.get(image_id)
+            if old is None:
+                # 内容与某个已删除的文件相同，视为重命名/移动
+                candidates = removed_by_hash.get(entry["hash"])
+                if candidates:
+                    old_id = candidates.pop()
+                    del removed[old_id]
+                    changes.moved.append((old_id, image_id))
+                else:
+                    changes.added.append(image_id)
+            elif old["hash"] != entry["hash"]:
+                changes.changed.append(image_id)
+        changes.removed = list(removed)
+        return changes
+
+    def update(self) -> Tuple[List[str], LibraryChanges]:
+        """扫描并与旧清单对比，返回 (当前图片列表, 变化)；需调用 save() 才会持久化"""
+        scanned = self.scan()
+        changes = self.diff(scanned)
+        self.previous_entries, self.entries = self.entries, scanned
+        return list(scanned), changes
+
+    def revert(self, image_ids: List[str]) -> None:
+        """将若干图片恢复为扫描前的清单状态，使其在下次扫描时仍被识别为变化"""
+        for image_id in image_ids:
+            if image_id in self.previous_entries:
+                self.entries[image_id] = self.previous_entries[image_id]
+            else:
+                self.entries.pop(image_id, None)
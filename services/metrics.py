@@ -0,0 +1,264 @@
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from config.settings import Config
+
+# 阶段耗时的默认分桶（秒），覆盖本地检索的亚毫秒级到LLM生成的数十秒
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._lock = threading.Lock()
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type_name = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, value: float = 1.0, **labels) -> None:
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return super().render() + [f"{self.name}{_format_labels(k)} {v:g}" for k, v in items]
+
+
+class Gauge(Counter):
+    """可增可减的瞬时值，如进行中的请求数"""
+    type_name = "gauge"
+
+    def dec(self, value: float = 1.0, **labels) -> None:
+        self.inc(-value, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+
+class Histogram(_Metric):
+    """固定分桶的直方图"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text)
+        self.buckets = tuple(sorted(buckets))
+        # 标签 -> [各分桶计数（不累计）..., +Inf计数, 总和]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(_label_key(labels))
+        return sum(state[:-1]) if state else 0
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        lines = super().render()
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {state[-1]:g}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """进程内的指标注册表，可导出为Prometheus文本格式"""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help_text: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, **kwargs)
+            return metric
+
+    def counter(self, name: str, help_text: str = "") -> Counter:
+        return self._get_or_create(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str = "") -> Gauge:
+        return self._get_or_create(Gauge, name, help_text)
+
+    def histogram(self, name: str, help_text: str = "", buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram("chatmeme_stage_seconds", "Duration of each pipeline stage in seconds")
+STAGE_IN_FLIGHT = registry.gauge("chatmeme_stage_in_flight", "Number of pipeline stages currently running")
+STAGE_ERRORS = registry.counter("chatmeme_stage_errors_total", "Number of pipeline stages that raised an exception")
+API_REQUESTS = registry.counter("chatmeme_api_requests_total", "Remote API calls by service")
+API_RETRIES = registry.counter("chatmeme_api_retries_total", "HTTP retries issued by the OpenAI client")
+API_TOKENS = registry.counter("chatmeme_api_tokens_total", "Tokens reported by remote APIs")
+CACHE_REQUESTS = registry.counter("chatmeme_cache_requests_total", "Cache lookups by cache and result")
+
+
+class QueryTrace:
+    """一次查询的各阶段耗时，用于页面上的调试面板"""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: List[dict] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, start: float, duration: float, labels: dict, error: Optional[str]) -> None:
+        with self._lock:
+            self.spans.append(dict(labels, stage=stage, offset_ms=(start - self.start) * 1000,
+                                   duration_ms=duration * 1000, error=error))
+
+    @property
+    def total_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+
+_current_trace: contextvars.ContextVar[Optional[QueryTrace]] = contextvars.ContextVar("chatmeme_trace", default=None)
+
+
+@contextmanager
+def trace() -> Iterator[QueryTrace]:
+    """在当前上下文中记录一次查询的全部阶段"""
+    query_trace = QueryTrace()
+    token = _current_trace.set(query_trace)
+    try:
+        yield query_trace
+    finally:
+        _current_trace.reset(token)
+
+
+def record_stage(stage: str, start: float, duration: float, **labels) -> None:
+    """记录一段已经结束的阶段，用于无法用 with 包住的耗时（如流式生成中累计的等待时间）"""
+    if not Config.METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(duration, stage=stage)
+    query_trace = _current_trace.get()
+    if query_trace is not None:
+        query_trace.add(stage, start, duration, labels, None)
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[None]:
+    """计时一个阶段：记录耗时直方图、进行中的数量与异常次数，并写入当前查询的调试记录"""
+    if not Config.METRICS_ENABLED:
+        yield
+        return
+    STAGE_IN_FLIGHT.inc(stage=stage)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        STAGE_ERRORS.inc(stage=stage, error=error)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_IN_FLIGHT.dec(stage=stage)
+        STAGE_SECONDS.observe(duration, stage=stage)
+        query_trace = _current_trace.get()
+        if query_trace is not None:
+            query_trace.add(stage, start, duration, labels, error)
+
+
+def record_usage(service: str, response) -> None:
+    """记录一次API调用及其返回的token用量"""
+    API_REQUESTS.inc(service=service)
+    usage = getattr(response, "usage", None)
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            API_TOKENS.inc(tokens, service=service, kind=kind)
+
+
+def count_http_request(request) -> None:
+    """httpx请求钩子：OpenAI客户端重试时会带上 x-stainless-retry-count 头"""
+    retry_count = request.headers.get("x-stainless-retry-count")
+    if retry_count and retry_count != "0":
+        API_RETRIES.inc(host=request.url.host)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    """在后台线程中提供 /metrics，端口为0时不启动；重复调用只会启动一次"""
+    global _server
+    port = Config.METRICS_PORT if port is None else port
+    host = host or Config.METRICS_HOST
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
@@ -0,0 +1,209 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+from rich import print
+
+# pHash：将图片缩小为 64x64 灰度图做二维DCT，取左上角 16x16 个低频系数与其中位数比较，得到256位哈希；
+# 同一画面配不同字幕的表情包在 8x8 的哈希中几乎没有差别，需要更多的系数才能区分
+IMAGE_SIZE = 64
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+_HASH_WORDS = HASH_BITS // 64
+# DCT-II 基的前 HASH_SIZE 行
+_DCT = np.cos(np.pi * (2 * np.arange(IMAGE_SIZE)[None, :] + 1) * np.arange(HASH_SIZE)[:, None] / (2 * IMAGE_SIZE))
+# 缩小后的灰度图明暗差小于该值时视为纯色图片，哈希只反映噪声，不参与去重
+MIN_CONTRAST = 8
+
+if hasattr(np, "bitwise_count"):
+    def popcount(values: np.ndarray) -> np.ndarray:
+        return np.bitwise_count(values)
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values: np.ndarray) -> np.ndarray:
+        values = np.ascontiguousarray(values, dtype=np.uint64)
+        return _POPCOUNT_TABLE[values.view(np.uint8)].reshape(values.shape + (8,)).sum(axis=-1)
+
+
+def _grayscale(path: str) -> np.ndarray:
+    """解码并缩小为 IMAGE_SIZE x IMAGE_SIZE 的灰度图，动图取第一帧，透明背景铺成白色"""
+    from PIL import Image
+    with Image.open(path) as image:
+        if getattr(image, "is_animated", False):
+            image.seek(0)
+        # JPEG可以直接按缩小的尺寸解码
+        image.draft("RGB", (IMAGE_SIZE * 2, IMAGE_SIZE * 2))
+        frame = image.convert("RGBA")
+    background = Image.new("RGBA", frame.size, (255, 255, 255, 255))
+    frame = Image.alpha_composite(background, frame).convert("L")
+    return np.asarray(frame.resize((IMAGE_SIZE, IMAGE_SIZE), Image.Resampling.LANCZOS, reducing_gap=2.0),
+                      dtype=np.float32)
+
+
+def phash_many(paths: Sequence[str], max_workers: int = 0) -> List[Optional[int]]:
+    """计算若干图片的pHash（HASH_BITS 位整数），无法解码或接近纯色的图片为None
+
+    解码与缩小在线程池中进行，DCT、取中位数与打包在全部灰度图上一次性向量化完成。
+    """
+    if not paths:
+        return []
+    pixels = np.zeros((len(paths), IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32)
+    valid = np.zeros(len(paths), dtype=bool)
+
+    def load(i: int) -> None:
+        try:
+            pixels[i] = _grayscale(paths[i])
+            valid[i] = True
+        except Exception as e:
+            print(f"计算感知哈希失败 ({paths[i]}): {e}")
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 1)) as executor:
+        list(executor.map(load, range(len(paths))))
+
+    valid &= np.ptp(pixels.reshape(len(paths), -1), axis=1) >= MIN_CONTRAST
+    coefficients = np.einsum("ki,nij,lj->nkl", _DCT, pixels, _DCT).reshape(len(paths), -1)
+    # 直流分量只反映整体亮度，不参与中位数
+    median = np.median(coefficients[:, 1:], axis=1, keepdims=True)
+    packed = np.packbits(coefficients > median, axis=1)
+    return [int.from_bytes(row.tobytes(), "big") if ok else None for row, ok in zip(packed, valid)]
+
+
+def _words(value: int) -> np.ndarray:
+    """把哈希拆成 uint64 数组，便于向量化计算汉明距离"""
+    return np.frombuffer(value.to_bytes(HASH_BITS // 8, "big"), dtype=">u8").astype(np.uint64)
+
+
+class PerceptualHashIndex:
+    """按汉明距离查找近似哈希的索引（multi-index hashing）
+
+    哈希切成 max_distance + 1 段，每段建立 段值 -> 条目 的哈希表。汉明距离不超过 max_distance 的
+    两个哈希至少有一段完全相同（抽屉原理），查询时只需取出各段精确命中的候选，再用向量化的popcount验证距离，
+    不必与库中每个哈希逐一比较。
+    """
+    def __init__(self, max_distance: int = 16):
+        self.max_distance = max_distance
+        bounds = np.linspace(0, HASH_BITS, min(max_distance + 1, HASH_BITS) + 1).astype(int).tolist()
+        # 每一段的 (右移位数, 掩码)
+        self._bands = [(HASH_BITS - stop, (1 << (stop - start)) - 1) for start, stop in zip(bounds[:-1], bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._bands]
+        self.keys: List[str] = []
+        # 每行一个哈希的 uint64 数组，容量不足时翻倍
+        self._matrix = np.zeros((16, _HASH_WORDS), dtype=np.uint64)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def add(self, key: str, value: int) -> None:
+        row = len(self.keys)
+        if row == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+        self._matrix[row] = _words(value)
+        self.keys.append(key)
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            table.setdefault((value >> shift) & mask, []).append(row)
+
+    def query(self, value: int) -> List[Tuple[str, int]]:
+        """距离不超过 max_distance 的条目，按 (距离, 加入顺序) 排序"""
+        rows = set()
+        for table, (shift, mask) in zip(self._tables, self._bands):
+            rows.update(table.get((value >> shift) & mask, ()))
+        if not rows:
+            return []
+        rows = np.fromiter(sorted(rows), dtype=np.int64, count=len(rows))
+        distances = popcount(self._matrix[rows] ^ _words(value)).sum(axis=1, dtype=np.int64)
+        keep = distances <= self.max_distance
+        rows, distances = rows[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return [(self.keys[rows[i]], int(distances[i])) for i in order]
+
+    def nearest(self, value: int) -> Optional[str]:
+        matches = self.query(value)
+        return matches[0][0] if matches else None
+
+
+class PerceptualHashStore:
+    """以内容哈希为键缓存图片的感知哈希，内容不变的图片不再重新解码
+
+    无法解码或接近纯色的图片记为null，内容不变时同样不再重试；哈希尺寸变化后全部重新计算。
+    """
+    def __init__(self, store_file: str):
+        self.store_file = store_file
+        self.hashes: Dict[str, Optional[int]] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.store_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("hash_size") != HASH_SIZE:
+                raise ValueError("hash size changed")
+            self.hashes = {digest: None if value is None else int(value, 16) for digest, value in data["hashes"].items()}
+        except (OSError, ValueError, KeyError):
+            self.hashes = {}
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.store_file) or ".", exist_ok=True)
+        tmp_path = self.store_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"hash_size": HASH_SIZE,
+                       "hashes": {digest: None if value is None else f"{value:x}" for digest, value in self.hashes.items()}}, f)
+        os.replace(tmp_path, self.store_file)
+
+    def get_many(self, images: Dict[str, Tuple[str, str]]) -> Dict[str, int]:
+        """images 为 图片id -> (内容哈希, 本地路径)，返回可用于去重的图片的 图片id -> 感知哈希"""
+        missing = {}
+        for digest, path in images.values():
+            if digest not in self.hashes:
+                missing.setdefault(digest, path)
+        if missing:
+            self.hashes.update(zip(missing, phash_many(list(missing.values()))))
+            self.save()
+        return {image_id: self.hashes[digest] for image_id, (digest, _) in images.items()
+                if self.hashes[digest] is not None}
+
+
+def find_duplicates(image_ids: Sequence[str], hashes: Dict[str, int], max_distance: int) -> Dict[str, str]:
+    """按顺序把图片归入代表图片，返回 重复图片 -> 代表图片
+
+    与某个代表图片的距离不超过 max_distance 的图片记为它的重复，否则自身成为新的代表图片；
+    只与代表图片比较，簇不会沿着一串彼此相似的图片无限延伸。
+    """
+    index = PerceptualHashIndex(max_distance)
+    duplicates = {}
+    for image_id in image_ids:
+        value = hashes.get(image_id)
+        if value is None:
+            continue
+        canonical = index.nearest(value)
+        if canonical is None:
+            index.add(image_id, value)
+        else:
+            duplicates[image_id] = canonical
+    return duplicates
+
+
+def duplicate_clusters(duplicates: Dict[str, str]) -> Dict[str, List[str]]:
+    """代表图片 -> 它的重复图片，按重复数从多到少排列"""
+    clusters: Dict[str, List[str]] = {}
+    for image_id, canonical in duplicates.items():
+        clusters.setdefault(canonical, []).append(image_id)
+    return dict(sorted(clusters.items(), key=lambda item: -len(item[1])))
+
+
+def load_duplicates(path: str) -> Dict[str, str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_duplicates(path: str, duplicates: Dict[str, str]) -> None:
+    """原子地写入 重复图片 -> 代表图片"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(duplicates, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
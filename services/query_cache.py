@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from config.settings import Config
+from services.metrics import CACHE_REQUESTS
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本：合并空白并转为小写"""
+    return " ".join(query.split()).lower()
+
+
+class QueryCache:
+    """有界的LRU + TTL查询缓存，可选SQLite磁盘层
+
+    内存层按最近使用淘汰，超过TTL的条目视为失效；磁盘层在进程重启后仍然有效，
+    命中磁盘层的条目会被提升回内存层。磁盘层每写入 PRUNE_EVERY 条清理一次：删除过期的条目，
+    超过 disk_max_rows 行时删除最久未使用的条目。键为元组，如 ("embedding", 模型, 规范化查询)。
+    """
+    PRUNE_EVERY = 256
+
+    def __init__(self, max_size: int = 1024, ttl: float = 86400, db_file: Optional[str] = None,
+                 disk_max_rows: int = 100000):
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.db_file = db_file
+        self.disk_max_rows = int(disk_max_rows)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 磁盘层单独加锁，写入与清理时不阻塞内存层的读取
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_file:
+            os.makedirs(os.path.dirname(db_file) or ".", exist_ok=True)
+            self._db = sqlite3.connect(db_file, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_cache "
+                "(key TEXT PRIMARY KEY, value BLOB, created_at REAL, accessed_at REAL)"
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(query_cache)")]
+            if "accessed_at" not in columns:
+                # 旧版磁盘层没有最近使用时间，以写入时间代替
+                self._db.execute("ALTER TABLE query_cache ADD COLUMN accessed_at REAL")
+                self._db.execute("UPDATE query_cache SET accessed_at = created_at")
+            self._db.execute("CREATE INDEX IF NOT EXISTS query_cache_created_at ON query_cache (created_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS query_cache_accessed_at ON query_cache (accessed_at)")
+            self._db.commit()
+            with self._db_lock:
+                self._prune()
+
+    @staticmethod
+    def _make_key(key: tuple) -> str:
+        return json.dumps(list(key), ensure_ascii=False)
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl > 0 and time.time() - created_at > self.ttl
+
+    def _remember(self, key: str, value: Any, created_at: float) -> None:
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def get(self, key: tuple) -> Optional[Any]:
+        """读取缓存，未命中或已过期时返回None"""
+        cache_key = self._make_key(key)
+        with self._lock:
+            item = self._memory.get(cache_key)
+            if item is not None:
+                if not self._expired(item[1]):
+                    self._memory.move_to_end(cache_key)
+                    self.hits += 1
+                    CACHE_REQUESTS.inc(cache=key[0], result="hit")
+                    return item[0]
+                del self._memory[cache_key]
+
+        row = None
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM query_cache WHERE key = ?", (cache_key,)
+                ).fetchone()
+                if row is not None and not self._expired(row[1]):
+                    # 提升回内存层后一般不会再次读取磁盘层，每个条目每个进程最多更新一次使用时间
+                    self._db.execute("UPDATE query_cache SET accessed_at = ? WHERE key = ?", (time.time(), cache_key))
+                    self._db.commit()
+        with self._lock:
+            if row is not None and not self._expired(row[1]):
+                value = pickle.loads(row[0])
+                self._remember(cache_key, value, row[1])
+                self.hits += 1
+                self.disk_hits += 1
+                CACHE_REQUESTS.inc(cache=key[0], result="disk_hit")
+                return value
+
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=key[0], result="miss")
+            return None
+
+    def _prune(self) -> None:
+        """删除磁盘层中过期与超出行数上限的条目，调用方持有 _db_lock"""
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM query_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        if self.disk_max_rows > 0:
+            excess = self._db.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0] - self.disk_max_rows
+            if excess > 0:
+                self._db.execute(
+                    "DELETE FROM query_cache WHERE key IN "
+                    "(SELECT key FROM query_cache ORDER BY accessed_at LIMIT ?)", (excess,)
+                )
+        self._db.commit()
+        self._writes_since_prune = 0
+
+    def set(self, key: tuple, value: Any, persist: bool = True) -> None:
+        """写入缓存，persist 为False时只写入内存层"""
+        self.set_many([(key, value)], persist)
+
+    def set_many(self, items: Iterable[Tuple[tuple, Any]], persist: bool = True) -> None:
+        """批量写入缓存，磁盘层在一个事务中写入"""
+        created_at = time.time()
+        rows = [(self._make_key(key), value) for key, value in items]
+        with self._lock:
+            for cache_key, value in rows:
+                self._remember(cache_key, value, created_at)
+        if self._db is None or not persist or not rows:
+            return
+        with self._db_lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO query_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    [(cache_key, pickle.dumps(value), created_at, created_at) for cache_key, value in rows]
+                )
+            self._writes_since_prune += len(rows)
+            if self._writes_since_prune >= self.PRUNE_EVERY:
+                self._prune()
+
+    def stats(self) -> Dict[str, int]:
+        """命中/未命中计数"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "size": len(self._memory),
+            }
+
+
+_query_cache: Optional[QueryCache] = None
+_query_cache_lock = threading.Lock()
+
+
+def get_query_cache() -> QueryCache:
+    """获取进程内共享的查询缓存"""
+    global _query_cache
+    if _query_cache is None:
+        with _query_cache_lock:
+            if _query_cache is None:
+                _query_cache = QueryCache(
+                    max_size=Config.QUERY_CACHE_SIZE,
+                    ttl=Config.QUERY_CACHE_TTL,
+                    db_file=Config.QUERY_CACHE_FILE or None,
+                    disk_max_rows=Config.QUERY_CACHE_DISK_MAX_ROWS
+                )
+    return _query_cache
@@ -0,0 +1,42 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """线程安全的令牌桶限速器，供多个并发worker共享
+
+    rate 为每秒补充的令牌数，capacity 为桶容量（允许的突发请求数）；
+    rate <= 0 时不限速。
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = float(rate)
+        self.capacity = max(1.0, float(capacity))
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_delay(cls, request_delay: float, capacity: float = 1.0) -> "TokenBucket":
+        """根据相邻请求的最小间隔（秒）构造限速器"""
+        request_delay = float(request_delay or 0)
+        return cls(rate=1.0 / request_delay if request_delay > 0 else 0, capacity=capacity)
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """阻塞直到获得令牌，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait_time = (tokens - self._tokens) / self.rate
+            time.sleep(wait_time)
+            waited += wait_time
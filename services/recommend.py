@@ -0,0 +1,132 @@
+import sys
+import json
+import time
+import argparse
+from collections import deque
+from contextlib import redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, Iterator, List, Tuple
+from rich import print
+from config.settings import Config
+from services.engine_registry import get_image_search
+from services.search_modes import SEARCH_MODES
+
+if TYPE_CHECKING:
+    from services.image_search import ImageSearch
+
+
+def _parse_message(line: str, field: str) -> Tuple[dict, str]:
+    """解析一行聊天记录：JSON对象取 field 字段，JSON字符串或无法解析的行整行作为消息"""
+    try:
+        record = json.loads(line)
+    except ValueError:
+        record = line
+    if not isinstance(record, dict):
+        record = {field: record if isinstance(record, str) else line}
+    text = record.get(field)
+    return record, text.strip() if isinstance(text, str) else ""
+
+
+def _recommend_chunk(engine: "ImageSearch", lines: List[str], field: str, top_k: int) -> Tuple[List[str], int]:
+    """为一块消息批量搜索，返回 (输出行, 失败的消息数)"""
+    messages = [_parse_message(line, field) for line in lines]
+    texts = [text for _, text in messages if text]
+    try:
+        # 聊天记录中的消息几乎不会重复，查询embedding不写入磁盘缓存
+        results = iter(engine.search_many(texts, top_k, persist=False))
+        error = None
+    except Exception as e:
+        results, error = None, f"搜索失败: {e}"
+
+    output, failed = [], 0
+    for record, text in messages:
+        if not text:
+            record["error"] = f"缺少消息文本（{field}）"
+        elif error is not None:
+            record["error"] = error
+        else:
+            images, reasons = next(results)
+            record["memes"] = [{"image": image, "reason": reason} for image, reason in zip(images, reasons)]
+        failed += "error" in record
+        output.append(json.dumps(record, ensure_ascii=False) + "\n")
+    return output, failed
+
+
+def recommend_lines(engine: "ImageSearch", lines: Iterable[str], field: str = "text", top_k: int = 5,
+                    chunk_size: int = 256, workers: int = 4, stats: dict = None) -> Iterator[str]:
+    """流式地为每条消息推荐表情包，按输入顺序产出JSONL行
+
+    输入按 chunk_size 条一块交给 search_many，最多 workers 块并行、2 * workers 块在内存中，
+    内存占用与输入文件的大小无关。stats 中累计已处理与失败的消息数。
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("messages", 0)
+    stats.setdefault("failed", 0)
+    lines = (line for line in lines if line.strip())
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while True:
+            chunk = list(islice(lines, chunk_size))
+            if chunk:
+                pending.append((len(chunk), executor.submit(_recommend_chunk, engine, chunk, field, top_k)))
+            while pending and (len(pending) >= 2 * workers or not chunk):
+                count, future = pending.popleft()
+                output, failed = future.result()
+                stats["messages"] += count
+                stats["failed"] += failed
+                yield from output
+            if not chunk:
+                break
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为JSONL聊天记录中的每条消息批量推荐表情包，结果按输入顺序写为JSONL")
+    parser.add_argument("input", nargs="?", default="-", help="输入的JSONL文件，- 表示标准输入")
+    parser.add_argument("-o", "--output", default="-", help="输出的JSONL文件，- 表示标准输出")
+    parser.add_argument("--field", default="text", help="消息文本所在的字段")
+    parser.add_argument("--mode", default=Config.SEARCH_MODE, choices=list(SEARCH_MODES), help="搜索模式")
+    parser.add_argument("--top-k", type=int, default=5, help="每条消息推荐的表情包数")
+    parser.add_argument("--chunk-size", type=int, default=256, help="每次批量搜索的消息数")
+    parser.add_argument("--workers", type=int, default=4, help="并行搜索的块数")
+    args = parser.parse_args()
+
+    # 构建引擎与搜索过程中的提示输出到标准错误，标准输出只写结果
+    stdout = sys.stdout
+    with redirect_stdout(sys.stderr):
+        engine = get_image_search(search_mode=args.mode)
+        if args.input == "-":
+            sys.stdin.reconfigure(encoding="utf-8")
+            source = sys.stdin
+        else:
+            source = open(args.input, "r", encoding="utf-8")
+        if args.output == "-":
+            stdout.reconfigure(encoding="utf-8")
+            sink = stdout
+        else:
+            sink = open(args.output, "w", encoding="utf-8")
+
+        stats = {}
+        start = last_report = time.perf_counter()
+        try:
+            for line in recommend_lines(engine, source, args.field, args.top_k, max(1, args.chunk_size),
+                                        max(1, args.workers), stats):
+                sink.write(line)
+                now = time.perf_counter()
+                if now - last_report >= 5:
+                    last_report = now
+                    print(f"已处理 {stats['messages']} 条消息，{stats['messages'] / (now - start):.1f} 条/秒")
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if sink is not stdout:
+                sink.close()
+            else:
+                sink.flush()
+        seconds = time.perf_counter() - start
+        print(f"完成：{stats['messages']} 条消息（失败 {stats['failed']} 条），耗时 {seconds:.1f} 秒，"
+              f"{stats['messages'] / max(seconds, 1e-9):.1f} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+# 搜索模式相关的常量，单独放在不依赖numpy/openai的轻量模块中，页面导入时不会拖慢首屏
+
+# 搜索模式：名称 -> 展示名称
+SEARCH_MODES = {
+    "llm": "LLM搜索",
+    "sharded_llm": "分片LLM搜索（大规模库）",
+    "embedding": "Embedding搜索",
+    "hybrid": "混合搜索（召回 + LLM重排）",
+    "bm25": "BM25关键词搜索（本地）",
+    "fusion": "融合搜索（BM25 + Embedding）",
+}
+# 需要加载embedding的搜索模式
+EMBEDDING_SEARCH_MODES = ("embedding", "hybrid", "fusion")
+# 混合搜索召回阶段可用的检索方式
+HYBRID_RETRIEVERS = ("embedding", "bm25", "fusion")
+# search_many 不需要逐个查询调用远程模型的模式：查询embedding批量请求、打分由矩阵乘法一次完成，或完全在本地检索
+BATCH_SEARCH_MODES = ("embedding", "bm25")
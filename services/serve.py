@@ -0,0 +1,456 @@
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import mimetypes
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from rich import print
+from config.settings import Config
+from services.engine_registry import warm_up_image_search
+from services.metrics import registry
+from services.search_modes import BATCH_SEARCH_MODES, SEARCH_MODES
+
+if TYPE_CHECKING:
+    from services.image_search import ImageSearch
+
+SERVE_REQUESTS = registry.counter("chatmeme_serve_requests_total", "HTTP service requests by route and status")
+SERVE_SECONDS = registry.histogram("chatmeme_serve_request_seconds", "HTTP service request duration by route")
+SERVE_IN_FLIGHT = registry.gauge("chatmeme_serve_in_flight", "Jobs admitted by the HTTP service and not yet finished")
+
+# 请求体大小上限与keep-alive连接的空闲超时（秒）
+MAX_BODY_BYTES = 1 << 20
+KEEPALIVE_TIMEOUT = 15
+
+
+class HTTPError(Exception):
+    """以指定状态码结束请求，message 作为JSON响应中的 error 字段"""
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None,
+                 payload: Optional[dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+        self.payload = payload if payload is not None else {"error": message}
+
+
+class _MemeCatalog:
+    """某个搜索引擎对应的 图片id -> 库中位置，以及搜索结果路径 -> 图片id"""
+    def __init__(self, engine: "ImageSearch"):
+        database = engine.image_description_database
+        self.engine = engine
+        self.positions = {image_id: i for i, image_id in enumerate(database.index_list)}
+        self.path_to_id = {engine._image_path(image_id): image_id for image_id in database.index_list}
+
+    def image_id(self, path: str) -> str:
+        return self.path_to_id.get(path, path)
+
+
+class SearchService:
+    """无界面的HTTP搜索服务
+
+    所有请求共用同一个预热好的 ImageSearch（同一份内存索引）。事件循环只负责收发HTTP，搜索与远程调用
+    在有界的线程池中进行，共用进程级的OpenAI客户端连接池；已接收而未完成的任务超过
+    max_workers + max_pending 时直接返回503，单个任务超过 request_timeout 秒返回504。
+    磁盘上的库变化后在后台重建引擎，重建完成前继续使用旧引擎。
+    """
+    def __init__(self, search_mode: Optional[str] = None, max_workers: Optional[int] = None,
+                 max_pending: Optional[int] = None, request_timeout: Optional[float] = None,
+                 max_batch: Optional[int] = None, max_top_k: Optional[int] = None):
+        self.search_mode = search_mode or Config.SEARCH_MODE
+        if self.search_mode not in SEARCH_MODES:
+            raise ValueError(f"未知的搜索模式: {self.search_mode}")
+        self.max_workers = max(1, int(max_workers or Config.SERVE_MAX_WORKERS))
+        self.max_pending = max(0, int(Config.SERVE_MAX_PENDING if max_pending is None else max_pending))
+        self.request_timeout = float(request_timeout or Config.SERVE_REQUEST_TIMEOUT)
+        self.max_batch = max(1, int(max_batch or Config.SERVE_MAX_BATCH))
+        self.max_top_k = max(1, int(max_top_k or Config.SERVE_MAX_TOP_K))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="chatmeme-serve")
+        self.in_flight = 0
+        self._engine: Optional["ImageSearch"] = None
+        self._engine_error: Optional[BaseException] = None
+        self._catalog: Optional[_MemeCatalog] = None
+        self._catalog_lock = threading.Lock()
+        self._routes = {
+            ("GET", "health"): self.health,
+            ("GET", "metrics"): self.metrics,
+            ("POST", "reload"): self.reload,
+            ("GET", "search"): self.search,
+            ("POST", "search"): self.search,
+            ("POST", "search/batch"): self.search_batch,
+            ("GET", "memes"): self.meme,
+            ("GET", "memes/image"): self.meme_image,
+        }
+
+    def _current_engine(self, retry_failed: bool = False) -> Optional["ImageSearch"]:
+        """最近一次构建成功的引擎；库变化或失败的构建超过重试间隔时触发后台重建"""
+        future = warm_up_image_search(retry_failed=retry_failed, search_mode=self.search_mode)
+        if future.done():
+            error = future.exception()
+            if error is None:
+                self._engine, self._engine_error = future.result(), None
+            else:
+                self._engine_error = error
+        else:
+            self._engine_error = None
+        return self._engine
+
+    def _require_engine(self) -> "ImageSearch":
+        engine = self._current_engine()
+        if engine is None:
+            if self._engine_error is not None:
+                raise HTTPError(503, f"搜索引擎加载失败: {self._engine_error}",
+                                {"Retry-After": str(int(Config.WARMUP_RETRY_BACKOFF))})
+            raise HTTPError(503, "搜索引擎加载中，请稍后重试", {"Retry-After": "1"})
+        return engine
+
+    def _meme_catalog(self, engine: "ImageSearch") -> _MemeCatalog:
+        """在工作线程中按需为当前引擎建立id映射"""
+        with self._catalog_lock:
+            if self._catalog is None or self._catalog.engine is not engine:
+                self._catalog = _MemeCatalog(engine)
+            return self._catalog
+
+    def _admit(self, count: int = 1) -> None:
+        if self.in_flight + count > self.max_workers + self.max_pending:
+            raise HTTPError(503, "服务繁忙，请稍后重试", {"Retry-After": "1"})
+        self.in_flight += count
+        SERVE_IN_FLIGHT.inc(count)
+
+    def _release(self, future: asyncio.Future) -> None:
+        # 超时的任务仍在线程中运行，直到真正结束才释放名额
+        self.in_flight -= 1
+        SERVE_IN_FLIGHT.dec()
+        if not future.cancelled():
+            future.exception()
+
+    def _submit(self, fn, *args) -> asyncio.Future:
+        """在线程池中运行，调用前须先 _admit；排队超过超时时间的任务不再执行"""
+        deadline = time.monotonic() + self.request_timeout
+
+        def run():
+            if time.monotonic() > deadline:
+                raise TimeoutError("排队超时")
+            return fn(*args)
+
+        future = asyncio.get_running_loop().run_in_executor(self.executor, contextvars.copy_context().run, run)
+        future.add_done_callback(self._release)
+        return future
+
+    async def _wait(self, future: asyncio.Future):
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.request_timeout)
+        except (asyncio.TimeoutError, TimeoutError):
+            raise HTTPError(504, f"请求超过 {self.request_timeout:g} 秒未完成")
+
+    async def _call(self, fn, *args):
+        self._admit()
+        return await self._wait(self._submit(fn, *args))
+
+    def _search_job(self, engine: "ImageSearch", query: str, top_k: int) -> dict:
+        start = time.perf_counter()
+        images, reasons = engine.search(query, top_k)
+        return self._format_results(engine, query, images, reasons, start)
+
+    def _search_many_job(self, engine: "ImageSearch", queries: List[str], top_k: int) -> List[dict]:
+        start = time.perf_counter()
+        return [self._format_results(engine, query, images, reasons, start)
+                for query, (images, reasons) in zip(queries, engine.search_many(queries, top_k))]
+
+    def _format_results(self, engine: "ImageSearch", query: str, images: List[str], reasons: List[str],
+                        start: float) -> dict:
+        catalog = self._meme_catalog(engine)
+        database = engine.image_description_database
+        results = []
+        for image, reason in zip(images, reasons):
+            image_id = catalog.image_id(image)
+            position = catalog.positions.get(image_id)
+            results.append({
+                "id": image_id,
+                "reason": reason,
+                "description": database.database_list[position] if position is not None else None,
+                "image": f"/memes/{quote(image_id, safe='')}/image",
+            })
+        return {"query": query, "results": results, "took_ms": (time.perf_counter() - start) * 1000}
+
+    def _meme_job(self, engine: "ImageSearch", image_id: str) -> dict:
+        position = self._meme_catalog(engine).positions.get(image_id)
+        if position is None:
+            raise HTTPError(404, f"表情包不存在: {image_id}")
+        database = engine.image_description_database
+        return {
+            "id": image_id,
+            "description": database.database_list[position],
+            "duplicate_of": database.duplicates.get(image_id),
+            "image": f"/memes/{quote(image_id, safe='')}/image",
+        }
+
+    def _meme_image_job(self, engine: "ImageSearch", image_id: str) -> Tuple[bytes, str]:
+        if image_id not in self._meme_catalog(engine).positions:
+            raise HTTPError(404, f"表情包不存在: {image_id}")
+        path = engine._image_path(image_id)
+        if path.startswith("http"):
+            # 尚未缓存的网络图片交给客户端直接下载
+            raise HTTPError(302, "图片尚未缓存", {"Location": path})
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except OSError:
+            raise HTTPError(404, f"图片文件不存在: {image_id}")
+        return content, mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    def _top_k(self, value) -> int:
+        try:
+            top_k = int(value)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "top_k 必须是整数")
+        if not 1 <= top_k <= self.max_top_k:
+            raise HTTPError(400, f"top_k 须在 1 到 {self.max_top_k} 之间")
+        return top_k
+
+    @staticmethod
+    def _json_body(body: bytes) -> dict:
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "请求体不是合法的JSON")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "请求体须为JSON对象")
+        return data
+
+    async def health(self, params, body, args) -> dict:
+        engine = self._current_engine()
+        payload = {
+            "status": "ok" if engine is not None else ("error" if self._engine_error is not None else "loading"),
+            "mode": self.search_mode,
+            "in_flight": self.in_flight,
+            "capacity": self.max_workers + self.max_pending,
+        }
+        if engine is not None:
+            payload["images"] = len(engine.image_description_database.index_list)
+            payload["searchable"] = len(engine.search_positions)
+        elif self._engine_error is not None:
+            payload["error"] = str(self._engine_error)
+        if engine is None:
+            raise HTTPError(503, payload["status"], {"Retry-After": "1"}, payload)
+        return payload
+
+    async def reload(self, params, body, args) -> dict:
+        """立即重新构建失败的引擎，不等待重试间隔；引擎正常时只检查库是否变化"""
+        engine = self._current_engine(retry_failed=True)
+        return {"status": "ok" if engine is not None else "loading", "mode": self.search_mode}
+
+    async def metrics(self, params, body, args) -> Tuple[bytes, str]:
+        return registry.render_prometheus().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+
+    async def search(self, params, body, args) -> dict:
+        data = self._json_body(body) if body else {}
+        query = data.get("query", params.get("q", [""])[-1])
+        if not isinstance(query, str) or not query.strip():
+            raise HTTPError(400, "缺少查询内容（q 或 query）")
+        top_k = self._top_k(data.get("top_k", params.get("top_k", [5])[-1]))
+        engine = self._require_engine()
+        return dict(await self._call(self._search_job, engine, query.strip(), top_k), mode=self.search_mode)
+
+    async def search_batch(self, params, body, args) -> dict:
+        data = self._json_body(body)
+        queries = data.get("queries")
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+            raise HTTPError(400, "queries 须为非空的字符串列表")
+        if len(queries) > self.max_batch:
+            raise HTTPError(413, f"一次最多 {self.max_batch} 个查询")
+        top_k = self._top_k(data.get("top_k", 5))
+        engine = self._require_engine()
+        queries = [query.strip() for query in queries]
+        start = time.perf_counter()
+        if engine.search_mode in BATCH_SEARCH_MODES and not engine.use_query_understanding:
+            # 不需要逐个调用远程模型时，整批交给 search_many 在一个任务中完成
+            self._admit()
+            try:
+                results = await self._wait(self._submit(self._search_many_job, engine, queries, top_k))
+            except Exception as e:
+                message = e.message if isinstance(e, HTTPError) else f"搜索失败: {e}"
+                results = [{"query": query, "error": message} for query in queries]
+            return {"mode": self.search_mode, "results": results, "took_ms": (time.perf_counter() - start) * 1000}
+
+        # 整批一起准入，避免只执行了一部分就被拒绝
+        self._admit(len(queries))
+        futures = [self._submit(self._search_job, engine, query, top_k) for query in queries]
+        results = []
+        for query, outcome in zip(queries, await asyncio.gather(*(self._wait(f) for f in futures),
+                                                                 return_exceptions=True)):
+            if isinstance(outcome, HTTPError):
+                results.append({"query": query, "error": outcome.message})
+            elif isinstance(outcome, BaseException):
+                results.append({"query": query, "error": f"搜索失败: {outcome}"})
+            else:
+                results.append(outcome)
+        return {"mode": self.search_mode, "results": results, "took_ms": (time.perf_counter() - start) * 1000}
+
+    async def meme(self, params, body, args) -> dict:
+        return await self._call(self._meme_job, self._require_engine(), args[0])
+
+    async def meme_image(self, params, body, args) -> Tuple[bytes, str]:
+        return await self._call(self._meme_image_job, self._require_engine(), args[0])
+
+    def _route(self, method: str, path: str) -> Tuple[str, Callable, List[str]]:
+        """返回 (路由名, 处理函数, 路径参数)；图片id中的 / 需要编码为 %2F"""
+        segments = [unquote(segment) for segment in path.strip("/").split("/")]
+        args = []
+        if segments[0] == "memes" and len(segments) in (2, 3) and segments[1]:
+            args = [segments[1]]
+            route = "memes" if len(segments) == 2 else f"memes/{segments[2]}"
+        else:
+            route = "/".join(segments)
+        handler = self._routes.get((method, route))
+        if handler is None and any(key[1] == route for key in self._routes):
+            raise HTTPError(405, f"不支持的方法: {method}")
+        if handler is None:
+            raise HTTPError(404, f"未知的路径: {path}")
+        return route, handler, args
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        """处理一个请求，返回 (状态码, 响应头, 响应体)"""
+        start = time.perf_counter()
+        url = urlsplit(target)
+        route = "unknown"
+        headers: Dict[str, str] = {}
+        try:
+            route, handler, args = self._route(method, url.path)
+            result = await handler(parse_qs(url.query), body, args)
+            status = 200
+            if isinstance(result, tuple):
+                content, headers["Content-Type"] = result
+            else:
+                content = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                headers["Content-Type"] = "application/json; charset=utf-8"
+        except HTTPError as e:
+            status = e.status
+            headers.update(e.headers)
+            content = json.dumps(e.payload, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json; charset=utf-8"
+        except Exception as e:
+            # 远程模型等上游服务出错
+            status = 502
+            content = json.dumps({"error": f"搜索失败: {e}"}, ensure_ascii=False).encode("utf-8")
+            headers["Content-Type"] = "application/json; charset=utf-8"
+        if Config.METRICS_ENABLED:
+            SERVE_REQUESTS.inc(route=route, status=str(status))
+            SERVE_SECONDS.observe(time.perf_counter() - start, route=route)
+        return status, headers, content
+
+    @staticmethod
+    async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, str, Dict[str, str], bytes]]:
+        line = await reader.readline()
+        if not line.strip():
+            return None
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            raise HTTPError(400, "无法解析请求行")
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HTTPError(411, "请使用 Content-Length 发送请求体")
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Content-Length 无效")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, f"请求体超过 {MAX_BODY_BYTES} 字节")
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method.upper(), target, version, headers, body
+
+    @staticmethod
+    def _response(status: int, headers: Dict[str, str], content: bytes, keep_alive: bool) -> bytes:
+        lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+                 f"Content-Length: {len(content)}",
+                 f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + content
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), KEEPALIVE_TIMEOUT)
+                except HTTPError as e:
+                    body = json.dumps({"error": e.message}, ensure_ascii=False).encode("utf-8")
+                    writer.write(self._response(e.status, {"Content-Type": "application/json; charset=utf-8"},
+                                                body, keep_alive=False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, version, headers, body = request
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                status, response_headers, content = await self.dispatch(method, target, body)
+                writer.write(self._response(status, response_headers, content, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start_server(self, host: str, port: int) -> asyncio.AbstractServer:
+        """开始预热搜索引擎并监听端口，port为0时自动选择空闲端口"""
+        self._current_engine()
+        return await asyncio.start_server(self._handle_connection, host, port, backlog=1024)
+
+    async def serve_forever(self, host: str, port: int) -> None:
+        server = await self.start_server(host, port)
+        address = server.sockets[0].getsockname()
+        print(f"ChatMeme搜索服务已启动: http://{address[0]}:{address[1]}（{SEARCH_MODES[self.search_mode]}）")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        async with server:
+            await stop.wait()
+        self.close()
+        print("ChatMeme搜索服务已停止")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatMeme HTTP搜索服务")
+    parser.add_argument("--host", default=Config.SERVE_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVE_PORT)
+    parser.add_argument("--mode", default=Config.SEARCH_MODE, choices=list(SEARCH_MODES), help="搜索模式")
+    parser.add_argument("--workers", type=int, default=Config.SERVE_MAX_WORKERS, help="同时执行的搜索数")
+    parser.add_argument("--max-pending", type=int, default=Config.SERVE_MAX_PENDING, help="排队等待的搜索数上限")
+    parser.add_argument("--timeout", type=float, default=Config.SERVE_REQUEST_TIMEOUT, help="单个请求的超时（秒）")
+    args = parser.parse_args()
+
+    service = SearchService(search_mode=args.mode, max_workers=args.workers, max_pending=args.max_pending,
+                            request_timeout=args.timeout)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    # 后台预热线程可能仍在构建，不等待其结束
+    sys.stdout.flush()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
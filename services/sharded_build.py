@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+from typing import Dict, List, Optional, Tuple
+from rich import print
+from config.settings import Config
+from services.description_journal import DescriptionJournal
+from services.embedding_cache import EmbeddingCache
+from services.embedding_store import EmbeddingStore
+from services.library_manifest import LibraryManifest
+from services.metrics import span
+
+# 分片构建：每个分片（可以在不同的机器上）只描述按图片id哈希分到自己的图片，把描述与embedding写到独立的分片目录；
+# 全部分片完成后由 merge 校验并合并进正式的描述数据库与embedding存储
+FORMAT_VERSION = 1
+SHARD_FILE = "shard.json"
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """解析 i/N（i 从0开始）"""
+    try:
+        shard, num_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"分片格式应为 i/N: {value}")
+    if num_shards < 1 or not 0 <= shard < num_shards:
+        raise argparse.ArgumentTypeError(f"分片编号须满足 0 <= i < N: {value}")
+    return shard, num_shards
+
+
+def shard_of(image_id: str, num_shards: int) -> int:
+    """图片所属的分片：图片id（本地图片的相对路径或网络图片的URL）的哈希对分片数取模，在任何机器上都相同"""
+    digest = hashlib.blake2b(image_id.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def shard_dir(output_dir: str, shard: int, num_shards: int) -> str:
+    return os.path.join(output_dir, f"shard-{shard:04d}-of-{num_shards:04d}")
+
+
+def _embedding_dir(root: str, model: str) -> str:
+    return os.path.join(root, model.replace("/", "_"))
+
+
+def _write_json(path: str, data: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def open_journal(database_file: str, index_file: str) -> DescriptionJournal:
+    """描述数据库对应的描述日志，日志文件与数据库同名、扩展名为 .journal"""
+    return DescriptionJournal(
+        journal_file=os.path.splitext(database_file)[0] + ".journal",
+        database_file=database_file,
+        index_file=index_file,
+        fsync_every=Config.DESCRIPTION_JOURNAL_FSYNC_EVERY,
+        compact_every=Config.DESCRIPTION_JOURNAL_COMPACT_EVERY
+    )
+
+
+def library_image_ids(local_image_folder: str, web_url_file: str) -> List[str]:
+    """库中全部图片的id：网络图片的URL与本地图片的相对路径，只列目录、不读取图片内容"""
+    image_ids = []
+    if os.path.exists(web_url_file):
+        with open(web_url_file, "r") as f:
+            image_ids = [line.strip() for line in f if line.strip()]
+    image_ids += LibraryManifest(manifest_file="", image_folder=local_image_folder,
+                                 extensions=Config.IMAGE_EXTENSIONS).list_images()
+    return list(dict.fromkeys(image_ids))
+
+
+class ShardBuilder:
+    """构建一个分片：描述属于该分片的新图片，并为描述生成embedding
+
+    输出目录中的 database.txt / index.txt 与正式数据库格式相同，由描述日志写入，中断后重新运行同一分片会从日志继续，
+    已完成的描述不会重复请求；embedding 以描述文本寻址保存在 embedding/<模型>/。全部完成后写入 shard.json，
+    merge 只接受有 shard.json 的分片。正式数据库中已有描述的图片不会再次描述。
+    """
+    def __init__(self, output_dir: str, shard: int, num_shards: int, with_embeddings: bool = True):
+        self.shard = shard
+        self.num_shards = num_shards
+        self.shard_dir = shard_dir(output_dir, shard, num_shards)
+        self.with_embeddings = with_embeddings
+        self.local_image_folder = Config.LOCAL_IMAGE_FOLDER
+        self.web_url_file = Config.WEB_URL_FILE
+        self.journal = open_journal(os.path.join(self.shard_dir, "database.txt"),
+                                    os.path.join(self.shard_dir, "index.txt"))
+
+    def image_ids(self) -> List[str]:
+        """属于本分片的图片"""
+        return [image_id for image_id in library_image_ids(self.local_image_folder, self.web_url_file)
+                if shard_of(image_id, self.num_shards) == self.shard]
+
+    def _describe(self, image_ids: List[str]) -> List[str]:
+        """并发描述并写入分片的描述日志，返回描述失败的图片"""
+        from services.image_describe import ImageDescribeService
+        from services.web_image_cache import get_web_image_cache
+        urls = [image_id for image_id in image_ids if image_id.startswith("http")]
+        if urls:
+            with span("web_image_fetch", count=len(urls)):
+                get_web_image_cache().fetch_many(urls)
+        full_paths = [get_web_image_cache().resolve(image_id) if image_id.startswith("http")
+                      else os.path.join(self.local_image_folder, image_id) for image_id in image_ids]
+
+        describe_service = ImageDescribeService()
+        failed = []
+
+        def report(done: int, total: int) -> None:
+            if done % 100 == 0 or done == total:
+                print(f"分片 {self.shard}/{self.num_shards}：已描述 {done}/{total}")
+
+        with span("describe_new_images", count=len(image_ids)):
+            results = describe_service.describe_images(full_paths, report)
+            for image_id, (_, description, error) in zip(image_ids, results):
+                if error is not None:
+                    print(f"描述图片失败 ({image_id}): {error}")
+                    failed.append(image_id)
+                    continue
+                self.journal.append(image_id, " ".join(description.split()))
+        print(describe_service.stats.summary())
+        return failed
+
+    def _embed(self, records: Dict[str, str]) -> int:
+        """为分片中的描述生成embedding，返回生成失败的描述数"""
+        from services.embedding_service import EmbeddingService
+        embedding_service = EmbeddingService(api_key=Config.EMBEDDING_API_KEY, base_url=Config.EMBEDDING_BASE_URL,
+                                             model=Config.EMBEDDING_MODEL)
+        cache = EmbeddingCache(_embedding_dir(os.path.join(self.shard_dir, "embedding"), Config.EMBEDDING_MODEL),
+                               Config.EMBEDDING_MODEL, gc_max_age=Config.EMBEDDING_GC_MAX_AGE)
+        cache.load()
+        missing = list(cache.update(list(records), list(records.values())).items())
+        failed = 0
+        for batch in embedding_service.split_batches([text for _, text in missing]):
+            try:
+                embeddings = embedding_service.get_embeddings([missing[i][1] for i in batch])
+                cache.add([missing[i][0] for i in batch], embeddings)
+            except Exception as e:
+                print(f"生成embedding失败 ({missing[batch[0]][1][:20]} 等{len(batch)}项): {e}")
+                failed += len(batch)
+        cache.save()
+        return failed
+
+    def build(self) -> dict:
+        os.makedirs(self.shard_dir, exist_ok=True)
+        shard_file = os.path.join(self.shard_dir, SHARD_FILE)
+        if os.path.exists(shard_file):
+            # 重新运行时先作废旧的完成标记，中途失败的分片不会被合并
+            os.remove(shard_file)
+        start = time.perf_counter()
+        records = self.journal.load()
+        image_ids = self.image_ids()
+        # 正式数据库中已有描述的图片（包括尚未压缩进快照的日志记录）不再描述，只需合并尚未描述的部分；
+        # 各分片只读地读取正式数据库，中断的压缩与残缺的日志留给 merge 修复
+        described = open_journal(Config.DATABASE_FILE, Config.INDEX_FILE).load(read_only=True)
+        to_describe = [image_id for image_id in image_ids if image_id not in records and image_id not in described]
+        print(f"分片 {self.shard}/{self.num_shards}：{len(image_ids)} 张图片，{len(to_describe)} 张需要描述")
+        try:
+            failed = self._describe(to_describe) if to_describe else []
+        finally:
+            self.journal.close()
+        records = self.journal.records
+
+        embedding_failed = self._embed(records) if self.with_embeddings and records else 0
+        summary = {
+            "format_version": FORMAT_VERSION,
+            "shard": self.shard,
+            "num_shards": self.num_shards,
+            "describe_model": Config.IMAGE_DESCRIBE_MODEL,
+            "embedding_model": Config.EMBEDDING_MODEL if self.with_embeddings else None,
+            "images": len(records),
+            "failed": failed,
+            "embedding_failed": embedding_failed,
+            "seconds": time.perf_counter() - start,
+            "finished_at": time.time(),
+        }
+        if failed or embedding_failed:
+            print(f"分片 {self.shard}/{self.num_shards} 未完成：{len(failed)} 张图片描述失败，"
+                  f"{embedding_failed} 条embedding失败，请重新运行该分片")
+        else:
+            _write_json(shard_file, summary)
+            print(f"分片 {self.shard}/{self.num_shards} 完成：{len(records)} 条描述，耗时 {summary['seconds']:.1f} 秒")
+        return summary
+
+
+class PartialDatabase:
+    """一个已完成分片的输出"""
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, SHARD_FILE), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        self.shard = self.header["shard"]
+        self.num_shards = self.header["num_shards"]
+        self.embedding_model = self.header.get("embedding_model")
+        self.records: Dict[str, str] = {}
+
+    def load_records(self) -> List[str]:
+        """读取描述并校验，返回发现的问题"""
+        journal = open_journal(os.path.join(self.path, "database.txt"), os.path.join(self.path, "index.txt"))
+        if os.path.exists(journal.journal_file) or os.path.exists(journal.compact_file):
+            # 完成的分片在写入 shard.json 前已压缩，遗留的日志说明分片在完成后被修改过
+            return ["存在未压缩的描述日志，分片可能在完成后被修改"]
+        self.records = journal.load()
+        problems = []
+        if len(self.records) != self.header.get("images"):
+            # 快照的两个文件行数不一致时 load 会忽略快照，也在这里报出
+            problems.append(f"描述数与 {SHARD_FILE} 不一致: {len(self.records)} != {self.header.get('images')}")
+        foreign = [image_id for image_id in self.records if shard_of(image_id, self.num_shards) != self.shard]
+        if foreign:
+            problems.append(f"{len(foreign)} 张图片不属于该分片，如 {foreign[0]}")
+        return problems
+
+    def embedding_store(self) -> Optional[EmbeddingStore]:
+        if self.embedding_model is None:
+            return None
+        store = EmbeddingStore(_embedding_dir(os.path.join(self.path, "embedding"), self.embedding_model),
+                               self.embedding_model)
+        return store if store.load() else None
+
+
+def merge_partials(partial_dirs: List[str], allow_incomplete: bool = False, overwrite: bool = False) -> dict:
+    """校验并把分片输出合并进正式的描述数据库与embedding存储
+
+    先校验全部分片（完成标记、格式、分片数与模型一致、图片确实属于该分片、embedding校验和），
+    任何一项不通过都不写入；同一分片出现多次时取最后完成的一份。描述通过正式数据库的描述日志合并，
+    默认只加入正式数据库中还没有的图片，正式数据库中的描述可能比分片更新，overwrite 为True时才用分片的描述覆盖；
+    embedding 按文本键去重后追加到正式存储。
+    """
+    partials = {}
+    for path in partial_dirs:
+        if not os.path.exists(os.path.join(path, SHARD_FILE)):
+            raise ValueError(f"分片未完成或不是分片目录: {path}")
+        partial = PartialDatabase(path)
+        if partial.header.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"分片格式版本不匹配: {path}")
+        previous = partials.get(partial.shard)
+        if previous is not None:
+            newer = max(previous, partial, key=lambda p: p.header["finished_at"])
+            print(f"分片 {partial.shard} 重复出现，使用 {newer.path}")
+            partial = newer
+        partials[partial.shard] = partial
+    if not partials:
+        raise ValueError("没有可合并的分片")
+
+    partials = [partials[shard] for shard in sorted(partials)]
+    for field in ("num_shards", "describe_model", "embedding_model"):
+        values = {partial.header.get(field) for partial in partials}
+        if len(values) > 1:
+            raise ValueError(f"分片的 {field} 不一致: {sorted(map(str, values))}")
+    num_shards = partials[0].num_shards
+    missing = sorted(set(range(num_shards)) - {partial.shard for partial in partials})
+    if missing and not allow_incomplete:
+        raise ValueError(f"缺少 {len(missing)} 个分片: {missing[:20]}")
+
+    problems = []
+    stores = []
+    with span("shard_validate", count=len(partials)):
+        for partial in partials:
+            problems += [f"{partial.path}: {problem}" for problem in partial.load_records()]
+            store = partial.embedding_store()
+            if partial.embedding_model is not None:
+                if store is None:
+                    problems.append(f"{partial.path}: embedding存储缺失")
+                elif not store.verify():
+                    problems.append(f"{partial.path}: embedding校验和不匹配")
+            stores.append(store)
+    if problems:
+        raise ValueError("分片校验失败:\n" + "\n".join(problems))
+
+    # 合并描述：追加到描述日志，最后压缩为新的快照
+    journal = open_journal(Config.DATABASE_FILE, Config.INDEX_FILE)
+    records = journal.load()
+    added = updated = kept = 0
+    with span("shard_merge_descriptions"):
+        try:
+            for partial in partials:
+                for image_id, description in partial.records.items():
+                    current = records.get(image_id)
+                    if current == description:
+                        continue
+                    if current is not None and not overwrite:
+                        kept += 1
+                        continue
+                    added += current is None
+                    updated += current is not None
+                    journal.append(image_id, description)
+        finally:
+            journal.close()
+
+    summary = {"shards": len(partials), "num_shards": num_shards, "missing_shards": missing,
+               "added": added, "updated": updated, "kept": kept, "images": len(journal.records)}
+
+    model = partials[0].embedding_model
+    if model is not None:
+        with span("shard_merge_embeddings"):
+            os.makedirs(Config.EMBEDDING_DATABASE_DIR, exist_ok=True)
+            cache = EmbeddingCache(_embedding_dir(Config.EMBEDDING_DATABASE_DIR, model), model,
+                                   gc_max_age=Config.EMBEDDING_GC_MAX_AGE)
+            cache.load()
+            # 先按当前库建立 图片 -> 文本键 的映射（同时完成旧版存储的迁移），再只追加缺少的文本键
+            missing_keys = cache.update(list(journal.records), list(journal.records.values()))
+            merged = 0
+            for store in stores:
+                keys = [key for key in store.ids if key in missing_keys and key not in cache.store]
+                if keys:
+                    cache.add(keys, store.matrix[[store.id_to_row[key] for key in keys]])
+                    merged += len(keys)
+            cache.save()
+        summary["embedding_model"] = model
+        summary["embeddings_added"] = merged
+        summary["embeddings_missing"] = len([key for key in missing_keys if key not in cache.store])
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片构建表情包描述数据库：各分片独立描述并生成embedding，最后合并")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="构建一个分片")
+    build_parser.add_argument("--shard", type=parse_shard, required=True, help="分片编号 i/N，i 从0开始")
+    build_parser.add_argument("--output", default=Config.BUILD_SHARDS_DIR, help="分片输出的根目录")
+    build_parser.add_argument("--skip-embeddings", action="store_true", help="只生成描述，不生成embedding")
+    merge_parser = subparsers.add_parser("merge", help="校验并合并已完成的分片")
+    merge_parser.add_argument("partials", nargs="*", help="分片目录，默认为输出根目录下的全部分片")
+    merge_parser.add_argument("--output", default=Config.BUILD_SHARDS_DIR, help="分片输出的根目录")
+    merge_parser.add_argument("--allow-incomplete", action="store_true", help="允许缺少部分分片")
+    merge_parser.add_argument("--overwrite", action="store_true", help="用分片的描述覆盖正式数据库中已有的描述")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        shard, num_shards = args.shard
+        summary = ShardBuilder(args.output, shard, num_shards, with_embeddings=not args.skip_embeddings).build()
+        if summary["failed"] or summary["embedding_failed"]:
+            raise SystemExit(1)
+        return
+
+    partial_dirs = args.partials
+    if not partial_dirs and os.path.isdir(args.output):
+        partial_dirs = sorted(os.path.join(args.output, name) for name in os.listdir(args.output)
+                              if name.startswith("shard-"))
+    try:
+        summary = merge_partials(partial_dirs, allow_incomplete=args.allow_incomplete, overwrite=args.overwrite)
+    except ValueError as e:
+        print(f"合并失败: {e}")
+        raise SystemExit(1)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
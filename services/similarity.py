@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def normalize(vector) -> np.ndarray:
+    """将向量归一化为float32单位向量，零向量保持不变"""
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm > 0 else arr
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """取分数最高的k个下标（降序）
+
+    先用 argpartition 做部分选择，再只对候选集排序；分数相同时按下标升序，
+    保证结果是确定的。
+    """
+    n = scores.shape[0]
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        # 把与第k名分数相同的元素都纳入候选，避免边界处的并列被随机截断
+        kth_score = scores[np.argpartition(-scores, k - 1)[:k]].min()
+        candidates = np.flatnonzero(scores >= kth_score)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """对二维分数矩阵的每一行取分数最高的k个下标（降序），结果与逐行调用 top_k_indices 一致"""
+    m, n = scores.shape
+    k = min(k, n)
+    if k <= 0:
+        return np.zeros((m, 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), (m, n))
+    order = np.lexsort((candidates, -np.take_along_axis(scores, candidates, axis=1)), axis=-1)
+    top = np.take_along_axis(candidates, order, axis=1)
+    if k < n:
+        # 第k名的分数有并列时，按 top_k_indices 的规则取下标较小者；并列很少见，逐行处理即可
+        kth_scores = np.take_along_axis(scores, top[:, -1:], axis=1)
+        for i in np.flatnonzero(np.count_nonzero(scores >= kth_scores, axis=1) > k):
+            top[i] = top_k_indices(scores[i], k)
+    return top
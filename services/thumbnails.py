@@ -0,0 +1,177 @@
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+from rich import print
+from config.settings import Config
+from services.library_manifest import LibraryManifest
+from services.metrics import CACHE_REQUESTS
+
+# 缩略图格式 -> (Pillow格式名, 扩展名)
+THUMBNAIL_FORMATS = {"webp": ("WEBP", "webp"), "jpeg": ("JPEG", "jpg")}
+
+
+def _render_thumbnails(source: str, outputs: List[Tuple[int, str]], image_format: str, quality: int) -> int:
+    """在工作进程中解码一次原图，依次写出各尺寸的缩略图，返回写出的总字节数
+
+    动图只取第一帧作为封面；JPEG不支持透明，透明背景铺成白色。
+    """
+    from PIL import Image, ImageOps
+    pil_format = THUMBNAIL_FORMATS[image_format][0]
+    with Image.open(source) as image:
+        if getattr(image, "is_animated", False):
+            image.seek(0)
+        largest = max(size for size, _ in outputs)
+        # JPEG可以直接按缩小的尺寸解码，省去大部分解码时间
+        image.draft("RGB", (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        image = image.convert("RGBA" if has_alpha else "RGB")
+    if has_alpha and pil_format == "JPEG":
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+
+    written = 0
+    # 从大到小生成，小尺寸由上一个尺寸缩放得到
+    for size, path in sorted(outputs, reverse=True):
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        image.save(tmp_path, format=pil_format, quality=quality)
+        os.replace(tmp_path, path)
+        written += os.path.getsize(path)
+    return written
+
+
+class ThumbnailCache:
+    """以内容哈希为键的磁盘缩略图缓存
+
+    每张本地图片按 THUMBNAIL_SIZES 生成多个尺寸（最长边像素），存放在 <缓存目录>/<哈希前两位>/<哈希>_<尺寸>.<扩展名>；
+    图片内容不变时缩略图一直有效，重命名或移动也不需要重新生成。缺失的缩略图由进程池并行生成，
+    网络图片与无法解码的图片直接返回原图。
+    """
+    def __init__(self, cache_dir: str, sizes: Sequence[int], image_format: str = "webp",
+                 quality: int = 75, max_workers: int = 0):
+        if image_format not in THUMBNAIL_FORMATS:
+            raise ValueError(f"不支持的缩略图格式: {image_format}，可选: {', '.join(THUMBNAIL_FORMATS)}")
+        self.cache_dir = cache_dir
+        self.sizes = tuple(sorted(set(sizes)))
+        self.image_format = image_format
+        self.quality = quality
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # 原图路径 -> (大小, 修改时间, 内容哈希)，文件未变化时不重复计算哈希
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+        # 内容哈希 -> 生成中的Future，避免同一张图片被重复提交
+        self._pending: Dict[str, Future] = {}
+        # 无法解码的图片的内容哈希，内容不变时不再重试
+        self._failed = set()
+
+    def size_for(self, width: Optional[int] = None) -> int:
+        """不小于显示宽度的最小尺寸，未指定宽度时使用最大尺寸"""
+        if width is None:
+            return self.sizes[-1]
+        return next((size for size in self.sizes if size >= width), self.sizes[-1])
+
+    def thumbnail_path(self, digest: str, size: int) -> str:
+        extension = THUMBNAIL_FORMATS[self.image_format][1]
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}_{size}.{extension}")
+
+    def _digest(self, path: str) -> Optional[str]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._digests.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        digest = LibraryManifest.file_hash(path)
+        self._digests[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        return digest
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def _submit(self, digest: str, source: str) -> Future:
+        """提交一张图片的全部尺寸，已在生成中时返回同一个Future"""
+        with self._lock:
+            future = self._pending.get(digest)
+            if future is not None:
+                return future
+            outputs = [(size, self.thumbnail_path(digest, size)) for size in self.sizes]
+            args = (source, outputs, self.image_format, self.quality)
+            if self.max_workers > 0:
+                future = self._get_executor().submit(_render_thumbnails, *args)
+            else:
+                future = Future()
+                try:
+                    future.set_result(_render_thumbnails(*args))
+                except Exception as e:
+                    future.set_exception(e)
+            self._pending[digest] = future
+        future.add_done_callback(lambda _: self._pending.pop(digest, None))
+        return future
+
+    def _misses(self, images: Sequence[str], size: int,
+                record: bool = True) -> Tuple[List[Optional[str]], Dict[str, str]]:
+        """返回每张图片的哈希（网络图片或文件不存在时为None）与缺失缩略图的 哈希 -> 原图"""
+        digests, misses = [], {}
+        for image in images:
+            digest = None if image.startswith(("http://", "https://")) else self._digest(image)
+            digests.append(digest)
+            if digest is None or digest in self._failed:
+                continue
+            hit = os.path.exists(self.thumbnail_path(digest, size))
+            if record:
+                CACHE_REQUESTS.inc(cache="thumbnail", result="hit" if hit else "miss")
+            if not hit:
+                misses.setdefault(digest, image)
+        return digests, misses
+
+    def get_many(self, images: Sequence[str], width: Optional[int] = None) -> List[str]:
+        """返回每张图片用于显示的路径：缩略图，或无法生成缩略图时的原图"""
+        size = self.size_for(width)
+        digests, misses = self._misses(images, size)
+        futures = {digest: self._submit(digest, source) for digest, source in misses.items()}
+        for digest, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"生成缩略图失败 ({misses[digest]}): {e}")
+                self._failed.add(digest)
+        return [image if digest is None or digest in self._failed else self.thumbnail_path(digest, size)
+                for image, digest in zip(images, digests)]
+
+    def get(self, image: str, width: Optional[int] = None) -> str:
+        return self.get_many([image], width)[0]
+
+    def prefetch(self, images: Sequence[str]) -> None:
+        """在后台为若干图片生成缩略图，不等待结果（如预先生成下一页）"""
+        if self.max_workers <= 0:
+            return
+        _, misses = self._misses(images, self.sizes[-1], record=False)
+        for digest, source in misses.items():
+            self._submit(digest, source)
+
+
+_cache: Optional[ThumbnailCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    """进程内共享的缩略图缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ThumbnailCache(
+                cache_dir=Config.THUMBNAIL_DIR,
+                sizes=Config.THUMBNAIL_SIZES,
+                image_format=Config.THUMBNAIL_FORMAT,
+                quality=Config.THUMBNAIL_QUALITY,
+                max_workers=Config.THUMBNAIL_WORKERS,
+            )
+        return _cache
@@ -0,0 +1,229 @@
+import os
+import json
+import numpy as np
+from typing import List, Tuple
+from rich import print
+from services.embedding_store import EmbeddingStore
+from services.similarity import top_k_indices, top_k_rows
+
+
+class ExactIndex:
+    """精确检索：对存储中的全部向量打分，是近似索引的兜底与基准"""
+    name = "exact"
+    # 批量检索时分数矩阵的元素数上限（float32约64MB），查询按块与全部向量相乘
+    SCORE_BLOCK = 1 << 24
+
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """返回分数最高的k个存储行号及其分数（降序）"""
+        if len(self.store) == 0:
+            # 空存储的矩阵没有维度信息，无法与查询相乘
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = self.store.matrix @ query
+        rows = top_k_indices(scores, k)
+        return rows, scores[rows]
+
+    def search_many(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """多个查询一起打分：每块查询与全部向量做一次矩阵乘法，返回每个查询的 (行号, 分数)"""
+        if len(self.store) == 0:
+            return [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)) for _ in range(len(queries))]
+        chunk_size = max(1, self.SCORE_BLOCK // max(1, len(self.store)))
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            scores = np.asarray(queries[start:start + chunk_size], dtype=np.float32) @ self.store.matrix.T
+            rows = top_k_rows(scores, k)
+            results.extend(zip(rows, np.take_along_axis(scores, rows, axis=1)))
+        return results
+
+    def sync(self) -> None:
+        """精确检索直接读取存储，无需同步"""
+
+
+class IVFIndex:
+    """纯NumPy实现的倒排文件（IVF）近似检索
+
+    用球面k-means将向量划分为 nlist 个列表，检索时只对与查询最接近的 nprobe 个列表内的向量打分。
+    索引与embedding存储放在同一目录，按id与存储对齐：新增的向量分配到最近的列表，删除的向量直接移除；
+    存储规模增长到训练时的数倍后重新训练。
+    """
+    name = "ivf"
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGN_FILE = "ivf_assign.npy"
+    IDS_FILE = "ivf_ids.txt"
+    HEADER_FILE = "ivf_header.json"
+    RETRAIN_GROWTH = 4
+    CHUNK_SIZE = 8192
+
+    def __init__(self, store: EmbeddingStore, nlist: int = 0, nprobe: int = 8, niter: int = 10,
+                 sample_size: int = 100000, seed: int = 0):
+        self.store = store
+        self.nlist = int(nlist)
+        self.nprobe = max(1, int(nprobe))
+        self.niter = int(niter)
+        self.sample_size = int(sample_size)
+        self.seed = seed
+        self.trained_count = 0
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self._order = np.zeros(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        # 索引当前对应的id顺序，与 assign 一一对应
+        self._saved_ids: List[str] = []
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.store.store_dir, name)
+
+    @staticmethod
+    def auto_nlist(n: int) -> int:
+        """按经验取 4 * sqrt(n) 个列表，并保证每个列表平均至少有32个向量"""
+        return max(1, min(int(4 * np.sqrt(n)), n // 32))
+
+    def _assign_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """分块计算每个向量最近的列表"""
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.CHUNK_SIZE):
+            chunk = np.asarray(vectors[start:start + self.CHUNK_SIZE], dtype=np.float32)
+            assign[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assign
+
+    def _rebuild_lists(self) -> None:
+        """按列表重排行号，得到CSR形式的倒排列表"""
+        self._order = np.argsort(self.assign, kind="stable").astype(np.int64)
+        counts = np.bincount(self.assign, minlength=len(self.centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    def train(self) -> None:
+        """在采样的向量上训练球面k-means，并为全部向量分配列表"""
+        n = len(self.store)
+        nlist = min(self.nlist or self.auto_nlist(n), n)
+        rng = np.random.default_rng(self.seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, max(self.sample_size, nlist)), replace=False))
+        sample = np.asarray(self.store.matrix[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(self.niter):
+            self.centroids = centroids
+            labels = self._assign_vectors(sample)
+            order = np.argsort(labels, kind="stable")
+            counts = np.bincount(labels, minlength=nlist)
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+            nonempty = counts > 0
+            sums = np.zeros_like(centroids)
+            sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+            # 空列表重新随机选择中心，避免列表退化
+            empty = np.flatnonzero(~nonempty)
+            sums[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        self.centroids = centroids
+        self.assign = self._assign_vectors(self.store.matrix)
+        self.trained_count = n
+        self._saved_ids = list(self.store.ids)
+        self._rebuild_lists()
+
+    def sync(self) -> None:
+        """与embedding存储按id对齐：增量分配新增的向量，移除已删除的向量"""
+        if self._saved_ids == list(self.store.ids):
+            return
+        saved_assign = {item_id: self.assign[row] for row, item_id in enumerate(self._saved_ids)}
+        assign = np.full(len(self.store), -1, dtype=np.int32)
+        new_rows = []
+        for row, item_id in enumerate(self.store.ids):
+            label = saved_assign.get(item_id)
+            if label is None:
+                new_rows.append(row)
+            else:
+                assign[row] = label
+        if new_rows:
+            assign[new_rows] = self._assign_vectors(self.store.matrix[np.array(new_rows)])
+        self.assign = assign
+        self._saved_ids = list(self.store.ids)
+        self._rebuild_lists()
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """只在最接近查询的 nprobe 个列表中检索，返回存储行号及其分数（降序）"""
+        probe = top_k_indices(self.centroids @ query, self.nprobe)
+        rows = np.concatenate([self._order[self._offsets[l]:self._offsets[l + 1]] for l in probe])
+        # 按行号排序，提高内存映射读取的局部性，同时保证并列时结果确定
+        rows.sort()
+        scores = np.asarray(self.store.matrix[rows], dtype=np.float32) @ query
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]
+
+    def search_many(self, queries: np.ndarray, k: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """每个查询探测的列表不同，逐个检索"""
+        return [self.search(query, k) for query in queries]
+
+    def save(self) -> None:
+        """将索引保存在embedding存储目录中"""
+        np.save(self._path(self.CENTROIDS_FILE), self.centroids)
+        np.save(self._path(self.ASSIGN_FILE), self.assign)
+        with open(self._path(self.IDS_FILE), "w", encoding="utf-8") as f:
+            f.write("\n".join(self.store.ids))
+        with open(self._path(self.HEADER_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "model": self.store.model,
+                "dim": self.store.dim,
+                "nlist": len(self.centroids),
+                "count": len(self.assign),
+                "trained_count": self.trained_count,
+            }, f, ensure_ascii=False, indent=2)
+
+    def load(self) -> bool:
+        """加载已保存的索引，不存在或与存储不兼容时返回False"""
+        paths = [self._path(name) for name in (self.CENTROIDS_FILE, self.ASSIGN_FILE, self.IDS_FILE, self.HEADER_FILE)]
+        if not all(os.path.exists(p) for p in paths):
+            return False
+        with open(self._path(self.HEADER_FILE), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        if header.get("model") != self.store.model or header.get("dim") != self.store.dim:
+            return False
+        if self.nlist and header.get("nlist") != self.nlist:
+            return False
+        with open(self._path(self.IDS_FILE), "r", encoding="utf-8") as f:
+            saved_ids = f.read().split("\n")[:header["count"]]
+        self.centroids = np.load(self._path(self.CENTROIDS_FILE))
+        self.assign = np.load(self._path(self.ASSIGN_FILE))
+        self.trained_count = header.get("trained_count", len(self.assign))
+        self._saved_ids = saved_ids
+        if len(saved_ids) != len(self.assign):
+            return False
+        self._rebuild_lists()
+        return True
+
+    def load_or_build(self) -> "IVFIndex":
+        """加载索引并与存储同步；索引不存在或规模增长过多时重新训练"""
+        if self.load() and len(self.store) <= self.RETRAIN_GROWTH * max(1, self.trained_count):
+            changed = self._saved_ids != list(self.store.ids)
+            self.sync()
+            if changed:
+                self.save()
+            return self
+        print(f"正在训练IVF索引: {len(self.store)} 条向量")
+        self.train()
+        self.save()
+        return self
+
+
+def build_vector_index(store: EmbeddingStore, kind: str = "exact", nlist: int = 0, nprobe: int = 8,
+                       min_vectors: int = 0):
+    """按配置构建向量索引，向量数不足 min_vectors 时使用精确检索"""
+    if kind == "ivf" and len(store) >= max(1, min_vectors):
+        return IVFIndex(store, nlist=nlist, nprobe=nprobe).load_or_build()
+    if kind not in ("exact", "ivf"):
+        raise ValueError(f"未知的向量索引类型: {kind}")
+    return ExactIndex(store)
+
+
+def recall_at_k(index, store: EmbeddingStore, queries: np.ndarray, k: int = 10) -> float:
+    """以精确检索为基准，计算近似索引的 recall@k"""
+    exact = ExactIndex(store)
+    hits = 0
+    for query in queries:
+        truth = set(exact.search(query, k)[0].tolist())
+        hits += len(truth & set(index.search(query, k)[0].tolist()))
+    return hits / max(1, len(queries) * k)
@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+from rich import print
+from config.settings import Config
+from services.metrics import CACHE_REQUESTS, span
+
+# Content-Type -> 扩展名，mimetypes 对部分图片类型给出的扩展名不常用（如 .jpe）
+IMAGE_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/bmp": ".bmp",
+}
+
+
+class WebImageCache:
+    """以内容哈希寻址的网络图片本地缓存
+
+    图片内容保存在 <缓存目录>/blobs/<哈希前两位>/<哈希><扩展名>，相同内容的多个URL共享同一份文件；
+    index.json 记录 URL -> 哈希、ETag、Last-Modified 与上次校验时间。超过 max_age 的条目在下次下载时
+    带上 If-None-Match / If-Modified-Since 重新校验，源站返回304时只更新校验时间；源站不可用时继续使用旧内容。
+    下载由有界的线程池与连接池并发进行，描述、缩略图与页面显示都读取本地文件。
+    """
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir: str, max_workers: int = 8, timeout: float = 10,
+                 max_age: float = 86400, max_bytes: int = 20 << 20):
+        self.cache_dir = cache_dir
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.entries: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._session = None
+        self._index_mtime: Optional[int] = None
+        self.load()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def load(self) -> None:
+        """读取索引，其他进程更新过索引时重新加载"""
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self._index_mtime:
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"网络图片缓存索引已损坏，将重新下载: {e}")
+            entries = {}
+        with self._lock:
+            self.entries = entries
+            self._index_mtime = mtime
+
+    def save(self) -> None:
+        """原子地写入索引"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._lock:
+            data = json.dumps(self.entries, ensure_ascii=False)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
+
+    @property
+    def session(self):
+        """共享的requests会话，连接池大小与下载并发数一致"""
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._session = session
+        return self._session
+
+    def blob_path(self, digest: str, extension: str) -> str:
+        return os.path.join(self.cache_dir, "blobs", digest[:2], digest + extension)
+
+    def cached_path(self, url: str) -> Optional[str]:
+        """已缓存图片的本地路径，不访问网络；未缓存时返回None"""
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        path = self.blob_path(entry["hash"], entry["extension"])
+        return path if os.path.exists(path) else None
+
+    @staticmethod
+    def _extension(url: str, content_type: str) -> str:
+        content_type = content_type.split(";")[0].strip().lower()
+        extension = IMAGE_CONTENT_TYPES.get(content_type)
+        if extension is None:
+            extension = os.path.splitext(unquote(urlparse(url).path))[1].lower()
+        if not extension:
+            extension = mimetypes.guess_extension(content_type) or ""
+        return extension
+
+    def _store(self, url: str, content: bytes, content_type: str) -> Tuple[str, str, str]:
+        """按内容哈希写入文件，内容已存在时直接复用"""
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        extension = self._extension(url, content_type)
+        path = self.blob_path(digest, extension)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        return digest, extension, path
+
+    def fetch(self, url: str, revalidate: bool = False) -> Optional[str]:
+        """返回图片的本地路径，必要时下载或重新校验；下载失败且没有旧内容时返回None"""
+        entry = self.entries.get(url)
+        path = self.cached_path(url)
+        if path is not None and not revalidate and time.time() - entry["checked_at"] < self.max_age:
+            CACHE_REQUESTS.inc(cache="web_image", result="hit")
+            return path
+
+        headers = {}
+        if path is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            with span("web_image_request"):
+                response = self.session.get(url, headers=headers, timeout=self.timeout, stream=True)
+                with response:
+                    if response.status_code == 304 and path is not None:
+                        CACHE_REQUESTS.inc(cache="web_image", result="revalidated")
+                        with self._lock:
+                            self.entries[url] = dict(entry, checked_at=time.time())
+                        return path
+                    response.raise_for_status()
+                    content = response.raw.read(self.max_bytes + 1, decode_content=True)
+                    if len(content) > self.max_bytes:
+                        raise ValueError(f"图片超过 {self.max_bytes} 字节")
+                    content_type = response.headers.get("Content-Type", "")
+                    etag = response.headers.get("ETag")
+                    last_modified = response.headers.get("Last-Modified")
+        except Exception as e:
+            if path is not None:
+                # 源站不可用时继续使用旧内容
+                CACHE_REQUESTS.inc(cache="web_image", result="stale")
+                return path
+            CACHE_REQUESTS.inc(cache="web_image", result="error")
+            print(f"下载网络图片失败 ({url}): {e}")
+            return None
+
+        CACHE_REQUESTS.inc(cache="web_image", result="miss")
+        digest, extension, path = self._store(url, content, content_type)
+        with self._lock:
+            self.entries[url] = {
+                "hash": digest,
+                "extension": extension,
+                "etag": etag,
+                "last_modified": last_modified,
+                "checked_at": time.time(),
+            }
+        return path
+
+    def fetch_many(self, urls: List[str], revalidate: bool = False) -> Dict[str, Optional[str]]:
+        """并发下载多张图片，返回 URL -> 本地路径（失败时为None），结束后保存索引"""
+        urls = list(dict.fromkeys(urls))
+        if not urls:
+            return {}
+        self.load()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            paths = dict(zip(urls, executor.map(lambda url: self.fetch(url, revalidate), urls)))
+        self.save()
+        return paths
+
+    def resolve(self, url: str) -> str:
+        """显示与描述时使用的路径：已缓存时为本地文件，否则仍为URL"""
+        self.load()
+        return self.cached_path(url) or url
+
+
+_cache: Optional[WebImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_web_image_cache() -> WebImageCache:
+    """进程内共享的网络图片缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = WebImageCache(
+                cache_dir=Config.WEB_IMAGE_CACHE_DIR,
+                max_workers=Config.WEB_IMAGE_MAX_WORKERS,
+                timeout=Config.WEB_IMAGE_TIMEOUT,
+                max_age=Config.WEB_IMAGE_MAX_AGE,
+                max_bytes=Config.WEB_IMAGE_MAX_BYTES,
+            )
+        return _cache
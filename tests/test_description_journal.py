@@ -0,0 +1,86 @@
+import os
+import pytest
+from pathlib import Path
+from services.description_journal import DescriptionJournal
+
+
+def _journal(tmp_path) -> DescriptionJournal:
+    return DescriptionJournal(journal_file=str(tmp_path / "database.journal"),
+                              database_file=str(tmp_path / "database.txt"),
+                              index_file=str(tmp_path / "index.txt"))
+
+
+def test_torn_compaction_keeps_descriptions_aligned(tmp_path, monkeypatch):
+    journal = _journal(tmp_path)
+    journal.load()
+    for image_id in ("a", "b", "c"):
+        journal.append(image_id, image_id.upper())
+    journal.close()
+    journal.remove("b")
+
+    # 模拟在替换完索引、替换描述之前崩溃
+    write_lines = DescriptionJournal._atomic_write_lines
+
+    def crash_after_index(path, lines):
+        if path == journal.database_file:
+            raise KeyboardInterrupt
+        write_lines(path, lines)
+
+    monkeypatch.setattr(DescriptionJournal, "_atomic_write_lines", staticmethod(crash_after_index))
+    with pytest.raises(KeyboardInterrupt):
+        journal.compact()
+    monkeypatch.undo()
+    assert journal._read_lines(journal.index_file) == ["a", "c"]
+    assert journal._read_lines(journal.database_file) == ["A", "B", "C"]
+
+    recovered = _journal(tmp_path)
+    assert recovered.load() == {"a": "A", "c": "C"}
+    assert recovered._read_lines(recovered.database_file) == ["A", "C"]
+    assert not os.path.exists(recovered.compact_file)
+    assert not os.path.exists(recovered.journal_file)
+
+
+def test_mismatched_snapshot_is_not_zipped(tmp_path):
+    journal = _journal(tmp_path)
+    (tmp_path / "index.txt").write_text("a\nc\n", encoding="utf-8")
+    (tmp_path / "database.txt").write_text("A\nB\nC\n", encoding="utf-8")
+    assert journal.load() == {}
+
+
+def test_empty_description_is_rejected_and_snapshot_survives(tmp_path):
+    journal = _journal(tmp_path)
+    journal.load()
+    journal.append("a", "A")
+    for description in ("", "  ", None, "多\n行"):
+        with pytest.raises(ValueError):
+            journal.append("b", description)
+    journal.append("c", "C")
+    journal.close()
+
+    assert _journal(tmp_path).load() == {"a": "A", "c": "C"}
+
+
+def test_read_only_load_leaves_files_untouched(tmp_path):
+    journal = _journal(tmp_path)
+    journal.load()
+    journal.append("a", "A")
+    journal.close()
+    journal.append("b", "B")
+    journal.flush()
+    with open(journal.journal_file, "ab") as f:
+        f.write(b'{"op": "put", "id": "c", "desc')
+    with open(journal.compact_file, "w", encoding="utf-8") as f:
+        f.write('["a", "A"]\n["b", "B"]\n')
+    files = {path: Path(path).read_bytes() for path in (journal.journal_file, journal.compact_file,
+                                                         journal.index_file, journal.database_file)}
+
+    # 有压缩文件时以压缩文件为准，但不完成压缩
+    assert _journal(tmp_path).load(read_only=True) == {"a": "A", "b": "B"}
+    os.remove(journal.compact_file)
+    del files[journal.compact_file]
+    # 残缺的日志记录被忽略，但不截断
+    assert _journal(tmp_path).load(read_only=True) == {"a": "A", "b": "B"}
+    assert {path: Path(path).read_bytes() for path in files} == files
+
+    assert _journal(tmp_path).load() == {"a": "A", "b": "B"}
+    assert os.path.getsize(journal.journal_file) < len(files[journal.journal_file])
@@ -0,0 +1,58 @@
+import time
+import numpy as np
+from services.embedding_cache import EmbeddingCache, text_key
+
+MODEL = "test-model"
+
+
+def _vectors(n: int) -> np.ndarray:
+    return np.eye(n, 4, dtype=np.float32)
+
+
+def _cache(tmp_path, gc_max_age: float = 3600) -> EmbeddingCache:
+    cache = EmbeddingCache(str(tmp_path), MODEL, gc_max_age=gc_max_age)
+    cache.load()
+    return cache
+
+
+def test_renamed_and_duplicate_images_reuse_vectors(tmp_path):
+    cache = _cache(tmp_path)
+    missing = cache.update(["a.png", "b.png", "c.png"], ["开心的猫", "无语的狗", "开心的猫"])
+    # 描述相同的图片只需要请求一次
+    assert list(missing.values()) == ["开心的猫", "无语的狗"]
+    cache.add(list(missing), _vectors(2))
+    cache.save()
+
+    reopened = _cache(tmp_path)
+    # 重命名后描述不变，全角空白与多余空格被规范化后仍命中同一个文本键
+    assert reopened.update(["猫/a2.png", "b.png"], ["开心的猫", "无语的狗　 "]) == {}
+    assert reopened.row_of("猫/a2.png") == reopened.store.id_to_row[text_key(MODEL, "开心的猫")]
+    assert reopened.row_of("a.png") is None
+    assert len(reopened) == 2
+
+
+def test_unreferenced_vectors_survive_until_gc_max_age(tmp_path):
+    cache = _cache(tmp_path)
+    cache.add(list(cache.update(["a.png", "b.png"], ["开心的猫", "无语的狗"])), _vectors(2))
+    cache.save()
+
+    # 重新描述后旧向量不再被引用，但在期限内保留，切换回来时可以直接复用
+    cache = _cache(tmp_path)
+    missing = cache.update(["a.png", "b.png"], ["开心的猫", "生气的狗"])
+    assert list(missing.values()) == ["生气的狗"]
+    cache.add(list(missing), _vectors(3)[2:])
+    cache.save()
+    assert len(_cache(tmp_path)) == 3
+    assert _cache(tmp_path).update(["a.png", "b.png"], ["开心的猫", "无语的狗"]) == {}
+
+    # 超过期限后被回收
+    cache = _cache(tmp_path)
+    cache.update(["a.png", "b.png"], ["开心的猫", "生气的狗"])
+    cache.last_used[text_key(MODEL, "无语的狗")] = time.time() - 7200
+    assert cache.collect_garbage() == 1
+    cache.save()
+
+    reopened = _cache(tmp_path)
+    assert len(reopened) == 2
+    assert text_key(MODEL, "无语的狗") not in reopened.store
+    assert reopened.update(["a.png", "b.png"], ["开心的猫", "无语的狗"]) == {text_key(MODEL, "无语的狗"): "无语的狗"}
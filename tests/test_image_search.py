@@ -0,0 +1,48 @@
+import pytest
+from benchmarks.run import configure, open_database
+from benchmarks.stub_server import start_stub_server, StubState
+from benchmarks.synthetic_library import generate_library
+from config.settings import Config
+from services.image_search import ImageSearch
+from services.query_cache import QueryCache
+
+MODEL = "stub-embedding"
+
+
+@pytest.fixture
+def library(tmp_path):
+    """指向桩服务器与合成库的配置，结束后恢复原来的配置"""
+    saved = {name: value for name, value in vars(Config).items() if name.isupper()}
+    server, base_url = start_stub_server(state=StubState(dim=32))
+    paths = generate_library(str(tmp_path / "library"), 40, dim=32, model=MODEL)
+    configure(paths, base_url, MODEL, "exact")
+    database = open_database(paths)
+    database.construct_image_description_database()
+    yield database
+    server.shutdown()
+    server.server_close()
+    for name, value in saved.items():
+        setattr(Config, name, value)
+
+
+def _disk_rows(cache: QueryCache) -> int:
+    return cache._db.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+
+
+@pytest.mark.parametrize("mode", ["embedding", "fusion", "hybrid"])
+def test_search_many_without_persist_skips_disk_with_query_understanding(library, tmp_path, mode):
+    engine = ImageSearch(search_mode=mode, use_query_understanding=True, image_description_database=library)
+    engine.query_cache = QueryCache(db_file=str(tmp_path / "query_cache.sqlite3"))
+    queries = ["开心的猫猫", "加班的打工人"]
+
+    results = engine.search_many(queries, top_k=3, persist=False)
+    assert [len(images) for images, _ in results] == [3, 3]
+    assert _disk_rows(engine.query_cache) == 0
+
+    # 查询理解与embedding都已在内存层，再次搜索不写入磁盘
+    assert engine.search_many(queries, top_k=3, persist=False) == results
+    assert _disk_rows(engine.query_cache) == 0
+
+    # 默认写入磁盘层：每个查询一条查询理解、一条embedding
+    engine.search_many(["震惊的熊猫头", "无语的同事"], top_k=3)
+    assert _disk_rows(engine.query_cache) == 4
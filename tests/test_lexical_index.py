@@ -0,0 +1,64 @@
+import numpy as np
+from services.lexical_index import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+IMAGE_IDS = ["猫猫/下班啦.png", "狗狗/加班中.png", "熊猫头/无语.png", "其他/震惊.png"]
+DESCRIPTIONS = [
+    "一只猫猫开心地下班回家",
+    "一只狗狗在办公室加班，加班到深夜，非常疲惫",
+    "熊猫头表情包，表示无语",
+    "一只猫猫震惊地看着屏幕，旁边的狗狗在加班",
+]
+
+
+def _index(tmp_path) -> LexicalIndex:
+    index = LexicalIndex(str(tmp_path))
+    index.sync(IMAGE_IDS, DESCRIPTIONS)
+    return index
+
+
+def test_tokenize_uses_character_ngrams():
+    assert tokenize("猫猫下班 A") == ["猫猫", "猫下", "下班", "猫猫下", "猫下班", "a"]
+
+
+def test_bm25_ranks_term_frequency_and_caption_higher(tmp_path):
+    index = _index(tmp_path)
+    docs, scores = index.search("加班", 10)
+    # 配文命中且描述中出现两次的文档排第一，只在描述中出现一次的其次
+    assert docs.tolist() == [1, 3]
+    assert scores[0] > scores[1] > 0
+
+    docs, _ = index.search("无语", 10)
+    assert docs.tolist() == [2]
+    # 词频相同时较短的文档得分更高
+    docs, _ = index.search("猫猫", 10)
+    assert docs.tolist() == [0, 3]
+    assert index.search("完全不相关", 10)[0].size == 0
+
+
+def test_incremental_sync_and_reload_match_fresh_build(tmp_path):
+    index = _index(tmp_path)
+    index.save()
+
+    ids = IMAGE_IDS[1:] + ["新的/点赞.png"]
+    descriptions = DESCRIPTIONS[1:] + ["一只狗狗竖起大拇指点赞"]
+    reloaded = LexicalIndex(str(tmp_path))
+    assert reloaded.load()
+    assert reloaded.sync(ids, descriptions)
+    assert not reloaded.sync(ids, descriptions)
+
+    fresh = LexicalIndex(str(tmp_path / "fresh"))
+    fresh.sync(ids, descriptions)
+    for query in ("加班", "狗狗", "点赞", "猫猫震惊"):
+        got, expected = reloaded.search(query, 10), fresh.search(query, 10)
+        assert got[0].tolist() == expected[0].tolist()
+        assert np.allclose(got[1], expected[1])
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]], k=60)
+    assert [doc for doc, _ in fused] == [1, 3, 2, 4]
+    assert np.isclose(dict(fused)[1], 1 / 61 + 1 / 62)
+
+    # 得分相同时按首次出现的顺序
+    assert [doc for doc, _ in reciprocal_rank_fusion([[5, 6], [6, 5]])] == [5, 6]
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import numpy as np
+import pytest
+from pathlib import Path
+from config.settings import Config
+from services.embedding_cache import EmbeddingCache, text_key
+from services.sharded_build import (FORMAT_VERSION, SHARD_FILE, ShardBuilder, merge_partials, open_journal,
+                                    shard_dir, shard_of)
+
+MODEL = "test-model"
+
+
+@pytest.fixture
+def canonical(tmp_path, monkeypatch):
+    """把正式数据库、embedding存储与本地图库指向临时目录"""
+    root = tmp_path / "canonical"
+    monkeypatch.setattr(Config, "DATABASE_FILE", str(root / "database.txt"))
+    monkeypatch.setattr(Config, "INDEX_FILE", str(root / "index.txt"))
+    monkeypatch.setattr(Config, "EMBEDDING_DATABASE_DIR", str(root / "embedding"))
+    monkeypatch.setattr(Config, "LOCAL_IMAGE_FOLDER", str(tmp_path / "images"))
+    monkeypatch.setattr(Config, "WEB_URL_FILE", str(tmp_path / "web_urls.txt"))
+    monkeypatch.setattr(Config, "IMAGE_EXTENSIONS", (".png",))
+    root.mkdir()
+    (tmp_path / "images").mkdir()
+    return root
+
+
+def _ids_of_shard(shard: int, num_shards: int, count: int):
+    ids = (f"{i}.png" for i in range(1000))
+    return [image_id for image_id in ids if shard_of(image_id, num_shards) == shard][:count]
+
+
+def _write_canonical(records: dict) -> None:
+    journal = open_journal(Config.DATABASE_FILE, Config.INDEX_FILE)
+    journal.load()
+    for image_id, description in records.items():
+        journal.append(image_id, description)
+    journal.close()
+
+
+def _write_partial(output_dir: str, shard: int, num_shards: int, records: dict) -> str:
+    """按 ShardBuilder 的输出格式写一个已完成的分片"""
+    path = shard_dir(output_dir, shard, num_shards)
+    journal = open_journal(os.path.join(path, "database.txt"), os.path.join(path, "index.txt"))
+    journal.load()
+    for image_id, description in records.items():
+        journal.append(image_id, description)
+    journal.close()
+    cache = EmbeddingCache(os.path.join(path, "embedding", MODEL), MODEL)
+    cache.load()
+    missing = cache.update(list(records), list(records.values()))
+    cache.add(list(missing), np.random.default_rng(shard).normal(size=(len(missing), 8)))
+    cache.save()
+    with open(os.path.join(path, SHARD_FILE), "w", encoding="utf-8") as f:
+        json.dump({"format_version": FORMAT_VERSION, "shard": shard, "num_shards": num_shards,
+                   "describe_model": "vlm", "embedding_model": MODEL, "images": len(records),
+                   "failed": [], "embedding_failed": 0, "finished_at": time.time()}, f)
+    return path
+
+
+def test_merge_keeps_newer_canonical_descriptions(canonical, tmp_path):
+    a, b = _ids_of_shard(0, 2, 2)
+    c, = _ids_of_shard(1, 2, 1)
+    _write_canonical({a: "正式库中更新过的描述"})
+    partials = [_write_partial(str(tmp_path / "shards"), 0, 2, {a: "分片中的旧描述", b: "描述B"}),
+                _write_partial(str(tmp_path / "shards"), 1, 2, {c: "描述C"})]
+
+    summary = merge_partials(partials)
+    assert (summary["added"], summary["updated"], summary["kept"]) == (2, 0, 1)
+    records = open_journal(Config.DATABASE_FILE, Config.INDEX_FILE).load()
+    assert records == {a: "正式库中更新过的描述", b: "描述B", c: "描述C"}
+    # 正式库中描述的embedding不在分片中，留给下次加载时生成
+    assert summary["embeddings_added"] == 2
+    assert summary["embeddings_missing"] == 1
+
+    summary = merge_partials(partials, overwrite=True)
+    assert (summary["added"], summary["updated"], summary["kept"]) == (0, 1, 0)
+    assert open_journal(Config.DATABASE_FILE, Config.INDEX_FILE).load()[a] == "分片中的旧描述"
+    assert summary["embeddings_missing"] == 0
+
+
+def test_merge_rejects_corrupted_embeddings(canonical, tmp_path):
+    a, = _ids_of_shard(0, 1, 1)
+    _write_canonical({a: "描述A"})
+    path = _write_partial(str(tmp_path / "shards"), 0, 1, {_ids_of_shard(0, 1, 2)[1]: "描述B"})
+    store = EmbeddingCache(os.path.join(path, "embedding", MODEL), MODEL).store
+    matrix = np.load(store.matrix_path)
+    matrix[0, 0] += 1
+    np.save(store.matrix_path, matrix)
+    before = {p: p.read_bytes() for p in canonical.iterdir() if p.is_file()}
+
+    with pytest.raises(ValueError, match="embedding"):
+        merge_partials([path])
+    # 校验失败时不写入任何内容
+    assert {p: p.read_bytes() for p in canonical.iterdir() if p.is_file()} == before
+    assert not os.path.exists(Config.EMBEDDING_DATABASE_DIR)
+
+
+def test_build_reads_canonical_database_read_only(canonical, tmp_path):
+    a, = _ids_of_shard(0, 1, 1)
+    (Path(Config.LOCAL_IMAGE_FOLDER) / a).write_bytes(b"")
+    _write_canonical({a: "描述A"})
+    journal = open_journal(Config.DATABASE_FILE, Config.INDEX_FILE)
+    # 正式库的日志中有一条写到一半的记录，可能是另一个进程正在写入
+    with open(journal.journal_file, "ab") as f:
+        f.write(b'{"op": "put", "id": "x.png", "desc')
+    before = {p: p.read_bytes() for p in canonical.iterdir() if p.is_file()}
+
+    summary = ShardBuilder(str(tmp_path / "shards"), 0, 1, with_embeddings=False).build()
+    assert summary["images"] == 0 and summary["failed"] == []
+    assert {p: p.read_bytes() for p in canonical.iterdir() if p.is_file()} == before
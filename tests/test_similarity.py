@@ -0,0 +1,42 @@
+import numpy as np
+from services.embedding_store import EmbeddingStore
+from services.similarity import top_k_indices, top_k_rows
+from services.vector_index import ExactIndex
+
+
+def test_ties_are_broken_by_lower_index():
+    scores = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.5], dtype=np.float32)
+    assert top_k_indices(scores, 1).tolist() == [1]
+    assert top_k_indices(scores, 3).tolist() == [1, 3, 0]
+    assert top_k_indices(scores, 4).tolist() == [1, 3, 0, 2]
+    assert top_k_indices(scores, 10).tolist() == [1, 3, 0, 2, 5, 4]
+    assert top_k_indices(scores, 0).tolist() == []
+
+
+def test_top_k_rows_matches_top_k_indices():
+    rng = np.random.default_rng(0)
+    # 取值很少的分数矩阵，保证第k名附近有大量并列
+    scores = rng.integers(0, 4, size=(50, 40)).astype(np.float32)
+    for k in (1, 5, 17, 40, 60):
+        rows = top_k_rows(scores, k)
+        assert rows.tolist() == [top_k_indices(row, k).tolist() for row in scores]
+
+
+def test_exact_index_returns_deterministic_order(tmp_path):
+    store = EmbeddingStore(str(tmp_path), "test-model")
+    vectors = np.array([[1, 0], [0, 1], [1, 0], [1, 1], [1, 0]], dtype=np.float32)
+    store.add(["a", "b", "c", "d", "e"], vectors)
+    index = ExactIndex(store)
+
+    query = np.array([1, 0], dtype=np.float32)
+    rows, scores = index.search(query, 4)
+    assert rows.tolist() == [0, 2, 4, 3]
+    assert np.allclose(scores[:3], 1.0)
+    assert [r.tolist() for r, _ in index.search_many(np.stack([query, query]), 4)] == [[0, 2, 4, 3]] * 2
+
+
+def test_exact_index_on_empty_store(tmp_path):
+    index = ExactIndex(EmbeddingStore(str(tmp_path), "test-model"))
+    rows, scores = index.search(np.ones(4, dtype=np.float32), 5)
+    assert rows.size == 0 and scores.size == 0
+    assert [r.size for r, _ in index.search_many(np.ones((2, 4), dtype=np.float32), 5)] == [0, 0]
@@ -0,0 +1,59 @@
+import pytest
+from benchmarks.stub_server import start_stub_server
+from services.web_image_cache import WebImageCache
+
+
+@pytest.fixture
+def stub():
+    server, base_url = start_stub_server()
+    yield server, base_url.rsplit("/v1", 1)[0]
+    server.shutdown()
+    server.server_close()
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_revalidation_keeps_local_paths_until_source_changes(stub, tmp_path):
+    server, base_url = stub
+    urls = [f"{base_url}/images/{n}.png" for n in range(3)]
+    cache = WebImageCache(str(tmp_path), max_workers=2, timeout=5, max_age=0)
+
+    first = cache.fetch_many(urls)
+    assert all(first.values())
+    assert len({cache.entries[url]["hash"] for url in urls}) == 3
+    assert server.state.image_requests == 3
+
+    # 源站未变：条件请求返回304，本地路径与内容不变
+    second = cache.fetch_many(urls, revalidate=True)
+    assert second == first
+    assert server.state.not_modified == 3
+
+    # 另一个进程打开同一缓存目录时不需要访问网络
+    reopened = WebImageCache(str(tmp_path), max_age=3600)
+    assert reopened.resolve(urls[0]) == first[urls[0]]
+    assert server.state.image_requests == 6
+
+    # 源站更新：返回200与新内容，旧内容的文件保持不变
+    old_content = _read(first[urls[0]])
+    server.state.image_revision += 1
+    third = cache.fetch_many(urls, revalidate=True)
+    assert server.state.not_modified == 3
+    assert server.state.image_requests == 9
+    assert all(third[url] != first[url] for url in urls)
+    assert _read(third[urls[0]]) != old_content
+    assert _read(first[urls[0]]) == old_content
+    assert cache.resolve(urls[0]) == third[urls[0]]
+
+
+def test_unavailable_source_keeps_stale_copy(stub, tmp_path):
+    server, base_url = stub
+    url = f"{base_url}/images/7.png"
+    cache = WebImageCache(str(tmp_path), timeout=5, max_age=0)
+    path = cache.fetch_many([url])[url]
+
+    server.state.error_rate = 1.0
+    assert cache.fetch_many([url], revalidate=True)[url] == path
+    assert cache.fetch_many([f"{base_url}/images/8.png"])[f"{base_url}/images/8.png"] is None